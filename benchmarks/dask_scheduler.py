@@ -0,0 +1,82 @@
+"""
+Check of the DaskScheduler on a dask.distributed LocalCluster.
+
+Graphs with the same task keys but different inputs are run on one client, one after the other and
+at the same time, as several pipelines sharing a cluster would. Each run must return the results of
+the LocalScheduler, not those of another run with the same keys. The time of each run is printed.
+
+Usage, from the root of the repository (dask[distributed] is needed):
+    python benchmarks/dask_scheduler.py --epochs 4 --points 200000 --workers 2
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from fourdgeo import projection, tasks
+from synthetic import synthetic_epoch
+
+
+def project_epoch(points, grid):
+    result = projection.project(points, grid)
+    return float(np.nansum(result.range_image))
+
+
+def total(*sums):
+    return sum(sums)
+
+
+def build_graph(n_epochs, n_points, seed, resolution_cm):
+    # The keys are the same for every seed, only the inputs differ
+    graph = tasks.TaskGraph()
+    for enum in range(n_epochs):
+        points = synthetic_epoch(n_points, seed * n_epochs + enum)
+        grid = projection.image_grid([0.0, 0.0, 0.0], points.mean(axis=0), resolution_cm)
+        graph.add(("project", enum), project_epoch, points, grid)
+    graph.add("total", total, *[tasks.TaskResult(("project", enum)) for enum in range(n_epochs)])
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--epochs", type=int, default=4, help="Number of synthetic epochs per graph.")
+    parser.add_argument("--points", type=int, default=200_000, help="Number of points per epoch.")
+    parser.add_argument("--resolution-cm", type=float, default=5.0, help="Pixel size at the anchor point.")
+    parser.add_argument("--workers", type=int, default=2, help="Number of workers of the LocalCluster.")
+    parser.add_argument("--runs", type=int, default=3, help="Number of graphs run on the cluster.")
+    args = parser.parse_args()
+
+    # dask is optional, it is only needed for this check
+    from dask.distributed import Client, LocalCluster
+
+    graphs = [build_graph(args.epochs, args.points, seed, args.resolution_cm) for seed in range(args.runs)]
+    expected = [graph.run(tasks.LocalScheduler(max_workers=1)) for graph in graphs]
+
+    with LocalCluster(n_workers=args.workers, threads_per_worker=1) as cluster, Client(cluster) as client:
+        scheduler = tasks.DaskScheduler(client)
+        print(f"{args.runs} graphs of {args.epochs} epochs of {args.points} points, {args.workers} workers")
+
+        start = time.perf_counter()
+        for seed, graph in enumerate(graphs):
+            if graph.run(scheduler) != expected[seed]:
+                raise RuntimeError(f"Run {seed} returned the results of another run")
+        elapsed = time.perf_counter() - start
+        print(f"{'sequential':>10}: {elapsed:8.2f} s")
+
+        # Graphs submitted at the same time share the scheduler of the cluster
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.runs) as executor:
+            results = list(executor.map(lambda graph: graph.run(scheduler), graphs))
+        elapsed = time.perf_counter() - start
+        for seed, result in enumerate(results):
+            if result != expected[seed]:
+                raise RuntimeError(f"Concurrent run {seed} returned the results of another run")
+        print(f"{'concurrent':>10}: {elapsed:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Regression check of the hole filling of the projected images.
+
+The pixels filled by projection.fill_empty_pixels ("occupancy" hole filling, the default) and by
+projection.fill_black_pixels ("black_pixels" hole filling, the images of earlier versions) are
+pinned on a small image, so that a change of either is noticed.
+
+Usage, from the root of the repository:
+    python benchmarks/hole_filling.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from fourdgeo import projection
+
+
+IMAGE = np.array([
+    [10, 0, 30, 0],
+    [0, 50, 0, 70],
+    [90, 0, 0, 0],
+    [0, 0, 0, 200],
+], dtype=np.uint8)
+
+# Mean of the occupied pixels of the 3 x 3 neighbourhood, rounded
+OCCUPANCY_FILLED = np.array([
+    [10, 30, 30, 50],
+    [50, 50, 50, 70],
+    [90, 70, 107, 135],
+    [90, 90, 200, 200],
+], dtype=np.uint8)
+
+# Same with a 5 x 5 neighbourhood
+OCCUPANCY_FILLED_5 = np.array([
+    [10, 50, 30, 50],
+    [45, 50, 75, 70],
+    [90, 75, 75, 88],
+    [70, 102, 102, 200],
+], dtype=np.uint8)
+
+# Mean of the 8 neighbours, empty or not, with reflected borders, truncated
+BLACK_PIXELS_FILLED = np.array([
+    [25, 17, 30, 25],
+    [25, 50, 18, 70],
+    [90, 17, 40, 33],
+    [22, 22, 25, 200],
+], dtype=np.uint8)
+
+
+def check(name, result, expected):
+    if not np.array_equal(result, expected):
+        raise RuntimeError(f"{name} changed:\n{result}\nexpected:\n{expected}")
+    print(f"{name}: ok")
+
+
+def main():
+    occupancy = IMAGE > 0
+    check("occupancy", projection.fill_empty_pixels(IMAGE.copy(), occupancy), OCCUPANCY_FILLED)
+    check("occupancy, kernel 5", projection.fill_empty_pixels(IMAGE.copy(), occupancy, kernel_size=5), OCCUPANCY_FILLED_5)
+    # Float images (the range image) are not rounded
+    filled = projection.fill_empty_pixels(IMAGE.astype(np.float32), occupancy)
+    check("occupancy, float", np.round(filled, 3), np.where(OCCUPANCY_FILLED == 107, 106.667, OCCUPANCY_FILLED).astype(np.float32))
+    check("occupancy, disabled", projection.fill_empty_pixels(IMAGE.copy(), occupancy, kernel_size=1), IMAGE)
+
+    check("black_pixels", projection.fill_black_pixels(IMAGE), BLACK_PIXELS_FILLED)
+    # A color pixel is black only if all its values are at most the threshold
+    color = np.dstack([IMAGE, IMAGE, np.full_like(IMAGE, 41)])
+    check("black_pixels, color", projection.fill_black_pixels(color), color)
+    color[..., 2] = 0
+    check("black_pixels, black color", projection.fill_black_pixels(color)[..., 0], BLACK_PIXELS_FILLED)
+
+
+if __name__ == "__main__":
+    main()
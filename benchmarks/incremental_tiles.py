@@ -0,0 +1,104 @@
+"""
+Check of the incremental background images ("incremental_tiles") of the getting started pipeline.
+
+Three synthetic epochs of a wall with a 0.5 m block are converted to the data model: the second
+epoch is identical to the first, in the third the block has moved. All the epochs must share the
+image size of the reference epoch, the identical epoch must reuse all its tiles and the moved block
+must only change the tiles it touches, at its old and new position. The number of changed tiles
+of each epoch is printed.
+
+Usage, from the root of the repository:
+    python benchmarks/incremental_tiles.py --points 400000 --tile-size 64
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import tempfile
+
+import laspy
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from fourdgeo.helpers import getting_started
+
+
+def write_epoch(filename, n_points, block_center):
+    # Wall 30 m in front of the camera and a 0.5 m block 1 m in front of it. The same points are
+    # drawn for every epoch, only the block is moved
+    rng = np.random.default_rng(0)
+    y = rng.uniform(-10, 10, n_points)
+    z = rng.uniform(-5, 8, n_points)
+    x = 30 + 0.5 * np.sin(y) + 0.3 * np.cos(z) + rng.normal(0, 0.01, n_points)
+    n_block = n_points // 50
+    block = rng.uniform(-0.25, 0.25, (n_block, 3)) + [29.0, *block_center]
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales = [0.001] * 3
+    header.offsets = [0, 0, 0]
+    las = laspy.LasData(header)
+    las.x, las.y, las.z = np.r_[x, block[:, 0]], np.r_[y, block[:, 1]], np.r_[z, block[:, 2]]
+    las.red = las.green = las.blue = np.full(n_points + n_block, 30000, dtype=np.uint16)
+    las.write(filename)
+
+
+def changed_tiles(manifest_0, manifest_1):
+    # Windows of the tiles whose content differs between two epochs, over all image types
+    changed = set()
+    for image_type, tiles_1 in manifest_1["images"].items():
+        tiles_0 = {(tile["row"], tile["col"]): tile["hash"] for tile in manifest_0["images"][image_type]}
+        for tile in tiles_1:
+            if tiles_0.get((tile["row"], tile["col"])) != tile["hash"]:
+                changed.add((tile["row"], tile["col"]))
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=400_000, help="Number of points of the wall.")
+    parser.add_argument("--resolution-cm", type=float, default=5.0, help="Pixel size at the anchor point.")
+    parser.add_argument("--tile-size", type=int, default=64, help="Size of the tiles in pixels.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder = os.path.join(folder, "data")
+        os.makedirs(data_folder)
+        block_centers = [(2.0, 1.0), (2.0, 1.0), (-4.0, 3.0)]
+        for hour, block_center in zip((12, 13, 14), block_centers):
+            write_epoch(os.path.join(data_folder, f"230101_{hour}0000.laz"), args.points, block_center)
+
+        configuration = getting_started.get_example_configuration()
+        output_folder = os.path.join(folder, "out")
+        configuration["project_setting"]["output_folder"] = output_folder
+        configuration["pc_projection"]["resolution_cm"] = args.resolution_cm
+        configuration["pc_projection"]["make_color_image"] = True
+        configuration["pc_projection"]["incremental_tiles"] = {
+            "store": os.path.join(output_folder, "tiles"), "tile_size": args.tile_size
+        }
+        getting_started.convert_point_cloud_time_series_to_datamodel(data_folder, configuration)
+
+        manifests = []
+        for filename in sorted(glob.glob(os.path.join(output_folder, "*_Tiles_*.json"))):
+            with open(filename, "r") as f:
+                manifests.append(json.load(f))
+        if len(manifests) != 3:
+            raise RuntimeError(f"Expected 3 tile manifests, got {len(manifests)}")
+
+    n_tiles = len(manifests[0]["images"]["Color"])
+    sizes = {(tile_manifest["width"], tile_manifest["height"]) for tile_manifest in manifests}
+    if len(sizes) != 1:
+        raise RuntimeError(f"The epochs do not share the image size of the reference: {sorted(sizes)}")
+    unchanged = changed_tiles(manifests[0], manifests[1])
+    moved = changed_tiles(manifests[1], manifests[2])
+    print(f"{n_tiles} tiles of {args.tile_size} pixels, image size {sizes.pop()}")
+    print(f"identical epoch: {len(unchanged)} changed tiles")
+    print(f"    moved block: {len(moved)} changed tiles")
+    if unchanged:
+        raise RuntimeError("The identical epoch changed tiles")
+    # A 0.5 m block touches at most 2 x 2 tiles at each of its positions
+    if not 0 < len(moved) <= 8:
+        raise RuntimeError(f"The moved block changed {len(moved)} of {n_tiles} tiles")
+
+
+if __name__ == "__main__":
+    main()
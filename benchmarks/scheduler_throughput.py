@@ -0,0 +1,69 @@
+"""
+Throughput of the TaskGraph schedulers on the projection of synthetic epochs.
+
+Each task projects one synthetic point cloud into color and range images with projection.project.
+The epochs are projected one after the other, then with the LocalScheduler on a spawned process
+pool and on a thread pool. The thread pool avoids spawning the workers and pickling the points and
+images, while the heavy steps (NumPy, OpenCV) release the GIL.
+
+Usage, from the root of the repository:
+    python benchmarks/scheduler_throughput.py --epochs 8 --points 1000000 --workers 4
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from fourdgeo import projection, tasks
+from synthetic import synthetic_epoch
+
+
+def project_epoch(points, colors, grid):
+    # Only the image shapes are returned, so that the measure is not dominated by sending images back
+    result = projection.project(points, grid, colors=colors)
+    return result.color_image.shape, result.range_image.shape
+
+
+def build_graph(epochs, resolution_cm):
+    graph = tasks.TaskGraph()
+    for enum, (points, colors) in enumerate(epochs):
+        grid = projection.image_grid([0.0, 0.0, 0.0], points.mean(axis=0), resolution_cm)
+        graph.add(("project", enum), project_epoch, points, colors, grid)
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--epochs", type=int, default=8, help="Number of synthetic epochs.")
+    parser.add_argument("--points", type=int, default=500_000, help="Number of points per epoch.")
+    parser.add_argument("--resolution-cm", type=float, default=5.0, help="Pixel size at the anchor point.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of workers of the pools.")
+    args = parser.parse_args()
+
+    epochs = [synthetic_epoch(args.points, seed, colors=True) for seed in range(args.epochs)]
+    graph = build_graph(epochs, args.resolution_cm)
+    schedulers = {
+        "serial": tasks.LocalScheduler(max_workers=1),
+        "processes": tasks.LocalScheduler(max_workers=args.workers),
+        "threads": tasks.LocalScheduler(max_workers=args.workers, threads=True),
+    }
+
+    print(f"{args.epochs} epochs of {args.points} points, {args.workers} workers on {os.cpu_count()} CPUs")
+    reference = None
+    for name, scheduler in schedulers.items():
+        start = time.perf_counter()
+        results = graph.run(scheduler)
+        elapsed = time.perf_counter() - start
+        # All the schedulers must produce the same images
+        if reference is None:
+            reference = results
+        elif results != reference:
+            raise RuntimeError(f"The {name} scheduler returned different results")
+        print(f"{name:>10}: {elapsed:8.2f} s, {args.epochs / elapsed:6.2f} epochs/s")
+
+
+if __name__ == "__main__":
+    main()
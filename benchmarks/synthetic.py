@@ -0,0 +1,22 @@
+"""
+Synthetic point clouds shared by the benchmarks and checks of this folder.
+"""
+import numpy as np
+
+
+def synthetic_epoch(n_points, seed, colors=False):
+    """
+    Noisy hemisphere of radius 30 m around the camera at the origin, seen from inside.
+    :param n_points: Number of points.
+    :param seed: Seed of the random generator, the same seed gives the same epoch.
+    :param colors: Whether random (red, green, blue) uint8 colors are also returned.
+    :return: Array of the points with shape (n_points, 3), and the colors if requested.
+    """
+    rng = np.random.default_rng(seed)
+    theta = rng.uniform(0.2, 1.4, n_points)
+    phi = rng.uniform(-1.2, 1.2, n_points)
+    r = 30 + rng.normal(0, 0.05, n_points)
+    points = np.c_[r * np.sin(theta) * np.cos(phi), r * np.sin(theta) * np.sin(phi), r * np.cos(theta)]
+    if not colors:
+        return points
+    return points, tuple(rng.integers(0, 256, n_points, dtype=np.uint8) for _ in range(3))
@@ -0,0 +1,88 @@
+"""
+Check of change.cluster_m3c2_changes_tiled against the untiled DBSCAN of change.cluster_m3c2_changes.
+
+A small cluster is laid across a tile seam so that two of its core points, on both sides of the
+seam, are only border points in the tile of the other one, where DBSCAN attaches them to another
+cluster of the tile. Stitching the tiles through the core points alone splits this cluster. Random
+scenes of blobs crossing several seams are checked as well. The clustered changes and the labels
+of the core points must match the untiled DBSCAN, border points reachable from several clusters
+may be labelled differently. The time of both is printed for the random scenes.
+
+Usage, from the root of the repository:
+    python benchmarks/tiled_dbscan.py --points 20000 --scenes 5 --workers 1
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from sklearn import cluster
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from fourdgeo import change
+
+
+# XY of the cluster crossing the seam x = 1 of the tiles of size 1, with dbscan_eps = 0.1 and
+# min_cluster_size = 4. The first point is a noise point placing the tile origin at (0, -0.5).
+# The core points (0.97, 0) and (1.03, 0.06) are border points in the tile of the other one
+SEAM_CLUSTER = np.array([
+    (0.0, -0.5),
+    (0.99, 0.13), (1.01, -0.07), (0.97, 0.0), (1.03, 0.06), (0.89, -0.02),
+    (1.11, 0.08), (0.895, 0.15), (0.895, 0.11), (1.105, -0.09), (1.105, -0.05),
+])
+
+
+def check(name, significant_changes, dbscan_eps, min_cluster_size, tile_size, max_workers):
+    start = time.perf_counter()
+    expected = change.cluster_m3c2_changes(significant_changes, dbscan_eps, min_cluster_size)
+    untiled_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = change.cluster_m3c2_changes_tiled(significant_changes, dbscan_eps, min_cluster_size, tile_size, max_workers)
+    tiled_time = time.perf_counter() - start
+
+    dbscan = cluster.DBSCAN(eps=dbscan_eps, min_samples=min_cluster_size).fit(significant_changes[:, :-1])
+    core = np.zeros(significant_changes.shape[0], dtype=bool)
+    core[dbscan.core_sample_indices_] = True
+    core = core[dbscan.labels_ >= 0]
+
+    if not np.array_equal(result[:, :-1], expected[:, :-1]):
+        raise RuntimeError(f"{name}: {result.shape[0]} clustered changes, expected {expected.shape[0]}")
+    if not np.array_equal(result[core, -1], expected[core, -1]):
+        raise RuntimeError(
+            f"{name}: {len(np.unique(result[:, -1]))} clusters, expected {len(np.unique(expected[:, -1]))}"
+        )
+    print(f"{name}: ok, {len(np.unique(expected[:, -1]))} clusters, untiled {untiled_time:.2f} s, tiled {tiled_time:.2f} s")
+
+
+def blob_scene(n_points, seed):
+    # Blobs of changes and sparse noise on a 10 m x 10 m area, most blobs crossing a seam of the 2 m tiles
+    rng = np.random.default_rng(seed)
+    n_blobs = 20
+    centers = rng.uniform(0, 10, (n_blobs, 2))
+    sizes = rng.uniform(0.2, 1.5, (n_blobs, 2))
+    blob = rng.integers(0, n_blobs, n_points)
+    xy = centers[blob] + rng.normal(0, 1, (n_points, 2)) * sizes[blob]
+    noise = rng.random(n_points) < 0.1
+    xy[noise] = rng.uniform(0, 10, (noise.sum(), 2))
+    z = rng.normal(0, 0.05, n_points)
+    distances = rng.normal(0.5, 0.1, n_points)
+    return np.column_stack((xy, z, distances))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=20_000, help="Number of changes per random scene.")
+    parser.add_argument("--scenes", type=int, default=5, help="Number of random scenes.")
+    parser.add_argument("--tile-size", type=float, default=2.0, help="Size of the tiles of the random scenes.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes clustering the tiles.")
+    args = parser.parse_args()
+
+    seam_changes = np.column_stack((SEAM_CLUSTER, np.zeros((SEAM_CLUSTER.shape[0], 2))))
+    check("seam cluster", seam_changes, 0.1, 4, 1.0, args.workers)
+    for seed in range(args.scenes):
+        check(f"scene {seed}", blob_scene(args.points, seed), 0.1, 10, args.tile_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
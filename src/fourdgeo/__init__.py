@@ -1,3 +1,13 @@
 from .projection import *
 from .change import *
+from .geometry import *
+from .manifest import *
+from .ingest import *
+from .tasks import *
+from .catalog import *
+from .raster_change import *
+from .point_lookup import *
+from .image_store import *
+from .tiles import *
+from .aggregates import *
 from .utilities import *
\ No newline at end of file
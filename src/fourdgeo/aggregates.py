@@ -0,0 +1,233 @@
+import os
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+
+from fourdgeo import manifest
+
+
+# Time buckets of the rollups, and the format of their keys
+ROLLUPS = {
+    "hour": "%Y-%m-%dT%H",
+    "day": "%Y-%m-%d",
+    "week": "%G-W%V",
+}
+
+
+def _parse_datetime(dateTime):
+    # Data model timestamps are ISO 8601 in UTC, e.g. "2023-01-01T12:00:00Z"
+    parsed = datetime.fromisoformat(dateTime.replace("Z", "+00:00"))
+    return parsed.astimezone(timezone.utc) if parsed.tzinfo is not None else parsed
+
+
+def bucket_key(dateTime, rollup):
+    """
+    :param dateTime: ISO 8601 timestamp of the data model.
+    :param rollup: "hour", "day" or "week" (ISO week).
+    :return: The key of the time bucket holding the timestamp, e.g. "2023-01-01T12", "2023-01-01" or "2022-W52".
+    """
+    return _parse_datetime(dateTime).strftime(ROLLUPS[rollup])
+
+
+def numeric_attributes(geoObject, fields=None):
+    """
+    The finite numeric custom attributes of a geoObject, the values the Chart module can aggregate.
+    :param geoObject: geoObject dictionary of the data model.
+    :param fields: If given, only these attributes are returned.
+    :return: Dictionary of the attribute values.
+    """
+    attributes = geoObject.get("customAttributes") or {}
+    return {
+        key: float(value) for key, value in attributes.items()
+        if (fields is None or key in fields)
+        and isinstance(value, (int, float, np.number)) and not isinstance(value, bool) and np.isfinite(value)
+    }
+
+
+def _collect_values(observations, fields=None):
+    # Values of each attribute per type: {type: {"count": number of geoObjects, "values": {field: [values]}}}
+    collected = {}
+    for observation in observations:
+        for geoObject in observation.get("geoObjects") or []:
+            entry = collected.setdefault(geoObject.get("type", "undefined"), {"count": 0, "values": {}})
+            entry["count"] += 1
+            for key, value in numeric_attributes(geoObject, fields).items():
+                entry["values"].setdefault(key, []).append(value)
+    return collected
+
+
+def summarize_values(values, percentiles=(50, 90)):
+    """
+    :param values: The values of an attribute.
+    :param percentiles: Percentiles to compute, in [0, 100].
+    :return: Dictionary with the "count", "sum", "min", "max" and percentiles ("p50", ...) of the values.
+        The mean is sum / count.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    summary = {
+        "count": int(values.shape[0]),
+        "sum": float(values.sum()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+    }
+    for percentile, value in zip(percentiles, np.percentile(values, percentiles)):
+        summary[f"p{percentile:g}"] = float(value)
+    return summary
+
+
+def _summarize(collected, percentiles):
+    return {
+        type_: {
+            "count": entry["count"],
+            "fields": {key: summarize_values(values, percentiles) for key, values in sorted(entry["values"].items())}
+        }
+        for type_, entry in sorted(collected.items())
+    }
+
+
+def observation_aggregates(observation, fields=None, percentiles=(50, 90)):
+    """
+    Per type aggregates of the geoObjects of an observation.
+    :param observation: Observation dictionary of the data model.
+    :param fields: If given, only these custom attributes are aggregated. Defaults to all the numeric ones.
+    :param percentiles: Percentiles of the attributes, see summarize_values.
+    :return: Dictionary with the "startDateTime" and "endDateTime" of the observation and its
+        "types": for each geoObject type, the "count" of geoObjects and the summary of each
+        attribute in "fields" (e.g. the summed volume or the mean m3c2_magnitude_abs_average_per_cluster).
+    """
+    return {
+        "startDateTime": observation.get("startDateTime"),
+        "endDateTime": observation.get("endDateTime"),
+        "types": _summarize(_collect_values([observation], fields), percentiles),
+    }
+
+
+class ObservationAggregates:
+    """
+    Precomputed aggregates of a data model, written as a compact sidecar file for the dashboard.
+
+    The Chart module sums, averages or counts the custom attributes of every geoObject of every
+    observation. The sidecar holds these aggregates per observation and geoObject type (count, sum,
+    min, max and percentiles of each numeric attribute), in the order of the observations of the
+    data model, and their rollups per hour, day and week of the startDateTime. Charts are thus
+    drawn from one small entry per observation or time bucket, without the geoObjects.
+
+    Observations are appended as they are added to the data model. Only the per observation entries
+    and the time buckets of the new observations are updated. The percentiles of a bucket need all
+    its values, which are kept for the latest bucket of each rollup in a state file next to the
+    sidecar. An observation older than these buckets requires a rebuild.
+
+    Methods:
+        - append: Adds observations and updates their time buckets.
+        - rebuild: Recomputes the aggregates of all the observations.
+        - save: Writes the sidecar file and the state file.
+    """
+
+    def __init__(self, filename, fields=None, percentiles=(50, 90)):
+        """
+        :param filename: Path of the sidecar file, e.g. data_model_aggregates.json.
+        :param fields: If given, only these custom attributes are aggregated. Defaults to all the numeric ones.
+        :param percentiles: Percentiles of the attributes, see summarize_values.
+        """
+        self.filename = filename
+        self.state_filename = os.path.splitext(filename)[0] + "_state.json"
+        self.fields = None if fields is None else sorted(fields)
+        self.percentiles = list(percentiles)
+
+        self.data = None
+        self.state = None
+        if os.path.isfile(self.filename) and os.path.isfile(self.state_filename):
+            with open(self.filename, "r") as f:
+                self.data = json.load(f)
+            with open(self.state_filename, "r") as f:
+                self.state = json.load(f)
+            # Aggregates of other fields or percentiles are recomputed
+            if self.data.get("fields") != self.fields or self.data.get("percentiles") != self.percentiles:
+                self.data, self.state = None, None
+        if self.data is None:
+            self._reset()
+
+
+    def _reset(self):
+        self.data = {
+            "fields": self.fields,
+            "percentiles": self.percentiles,
+            "observations": [],
+            "rollups": {rollup: {} for rollup in ROLLUPS},
+        }
+        # Key and collected values of the latest bucket of each rollup
+        self.state = {rollup: {"key": None, "types": {}} for rollup in ROLLUPS}
+
+
+    def append(self, observations, all_observations=None):
+        """
+        Add observations, appended to the data model, and update their time buckets.
+        :param observations: Observation dictionaries of the data model, in time order.
+        :param all_observations: All the observations of the data model, including the new ones.
+            Used to rebuild the aggregates if an observation is older than the latest time buckets.
+        """
+        observations = list(observations)
+        for observation in observations:
+            for rollup in ROLLUPS:
+                latest = self.state[rollup]["key"]
+                if latest is not None and bucket_key(observation["startDateTime"], rollup) < latest:
+                    if all_observations is None:
+                        raise ValueError(
+                            f"Observation {observation['startDateTime']} is older than the latest {rollup} "
+                            f"bucket {latest}, rebuild the aggregates with all the observations"
+                        )
+                    self.rebuild(all_observations)
+                    return
+
+        for observation in observations:
+            self.data["observations"].append(observation_aggregates(observation, self.fields, self.percentiles))
+            for rollup in ROLLUPS:
+                self._add_to_bucket(rollup, observation)
+
+
+    def _add_to_bucket(self, rollup, observation):
+        key = bucket_key(observation["startDateTime"], rollup)
+        latest = self.state[rollup]
+        if latest["key"] != key:
+            # A new bucket starts, the values of the previous one are not needed anymore
+            latest["key"], latest["types"] = key, {}
+        for type_, entry in _collect_values([observation], self.fields).items():
+            collected = latest["types"].setdefault(type_, {"count": 0, "values": {}})
+            collected["count"] += entry["count"]
+            for field, values in entry["values"].items():
+                collected["values"].setdefault(field, []).extend(values)
+
+        bucket = self.data["rollups"][rollup].setdefault(key, {"observations": 0, "types": {}})
+        bucket["observations"] += 1
+        bucket["types"] = _summarize(latest["types"], self.percentiles)
+
+
+    def rebuild(self, observations):
+        """
+        Recompute the aggregates of all the observations of the data model.
+        :param observations: All the observation dictionaries of the data model, in their order.
+        """
+        self._reset()
+        observations = list(observations)
+        for observation in observations:
+            self.data["observations"].append(observation_aggregates(observation, self.fields, self.percentiles))
+
+        # Buckets in time order, so that the latest ones end up in the state
+        for rollup in ROLLUPS:
+            for observation in sorted(observations, key=lambda observation: _parse_datetime(observation["startDateTime"])):
+                self._add_to_bucket(rollup, observation)
+
+
+    def save(self):
+        """Write the sidecar and state files atomically, so that the dashboard never reads a partial file."""
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with manifest.atomic_output(self.state_filename) as tmp_filename:
+            with open(tmp_filename, "w") as f:
+                json.dump(self.state, f, separators=(",", ":"))
+        # Compact JSON, as the sidecar is downloaded by the dashboard
+        with manifest.atomic_output(self.filename) as tmp_filename:
+            with open(tmp_filename, "w") as f:
+                json.dump(self.data, f, sort_keys=True, separators=(",", ":"))
@@ -0,0 +1,165 @@
+import os
+import fnmatch
+import hashlib
+import sqlite3
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import laspy
+
+
+class EpochCatalog:
+    """
+    SQLite index of the epochs of a point cloud time series, built from the LAS/LAZ headers only.
+
+    Each file is stored with its timestamp, point count, bounds, format and a fingerprint. Updates
+    only open the files that are new or whose size or modification time changed, so the catalog of
+    a large archive is refreshed in seconds. Queries replace the os.listdir/glob and filename
+    parsing of the notebooks and helpers.
+
+    Methods:
+        - update: Adds, refreshes and removes the epochs of a folder.
+        - epochs: Returns the epochs in time order, filtered by time range, bbox and step.
+        - paths: Same as epochs, returning the file paths only.
+        - close: Closes the database.
+    """
+
+    columns = (
+        "path", "name", "timestamp", "size", "mtime_ns", "fingerprint", "point_count",
+        "min_x", "min_y", "min_z", "max_x", "max_y", "max_z", "las_version", "point_format", "crs"
+    )
+
+    def __init__(self, db_path, temporal_format="%y%m%d_%H%M%S"):
+        self.db_path = db_path
+        # Format of the timestamps in the filenames, as in get_delta_t
+        self.temporal_format = temporal_format
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS epochs ("
+            "path TEXT PRIMARY KEY, name TEXT, timestamp TEXT, size INTEGER, mtime_ns INTEGER, "
+            "fingerprint TEXT, point_count INTEGER, min_x REAL, min_y REAL, min_z REAL, "
+            "max_x REAL, max_y REAL, max_z REAL, las_version TEXT, point_format INTEGER, crs TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS epochs_timestamp ON epochs (timestamp, name)")
+        self.connection.commit()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def timestamp(self, name, header=None):
+        # Timestamp from the filename, or the creation date of the header
+        stem = os.path.splitext(name)[0].split(" ")[-1]
+        try:
+            return datetime.strptime(stem, self.temporal_format).isoformat()
+        except ValueError:
+            if header is not None and header.creation_date is not None:
+                return datetime.combine(header.creation_date, datetime.min.time()).isoformat()
+            return None
+
+
+    def _read_header(self, path, size, mtime_ns, read_crs):
+        with laspy.open(path) as las_file:
+            header = las_file.header
+            crs = None
+            if read_crs:
+                # Parsing the CRS needs the VLRs, which are read with the header
+                parsed = header.parse_crs()
+                crs = parsed.to_string() if parsed is not None else None
+        # The header and VLR bytes identify the content together with the size
+        with open(path, "rb") as f:
+            fingerprint = hashlib.sha256(f.read(header.offset_to_point_data)).hexdigest()[:16]
+        return (
+            path, os.path.basename(path), self.timestamp(os.path.basename(path), header), size, mtime_ns,
+            fingerprint, int(header.point_count),
+            *[float(value) for value in header.mins], *[float(value) for value in header.maxs],
+            str(header.version), int(header.point_format.id), crs
+        )
+
+
+    def update(self, folder, patterns=("*.las", "*.laz"), recursive=False, read_crs=False, max_workers=16):
+        """
+        Index the epochs of a folder. Unchanged files are not opened, removed files are dropped.
+        :param folder: The folder of the epochs.
+        :param patterns: Filename patterns of the epochs.
+        :param recursive: Whether the subfolders are scanned too.
+        :param read_crs: Whether the CRS is parsed from the VLRs.
+        :param max_workers: Number of threads reading headers.
+        :return: The number of added or refreshed epochs and the number of removed ones.
+        """
+        found = {}
+        folders = [folder]
+        while folders:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir() and recursive:
+                        folders.append(entry.path)
+                    elif entry.is_file() and any(fnmatch.fnmatch(entry.name.lower(), pattern) for pattern in patterns):
+                        stat = entry.stat()
+                        found[entry.path] = (stat.st_size, stat.st_mtime_ns)
+
+        prefix = os.path.join(folder, "")
+        known = {
+            row["path"]: (row["size"], row["mtime_ns"])
+            for row in self.connection.execute(
+                "SELECT path, size, mtime_ns FROM epochs WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+            )
+        }
+        changed = [path for path, stat in found.items() if known.get(path) != stat]
+        removed = [path for path in known if path not in found]
+        if not recursive:
+            removed = [path for path in removed if os.path.dirname(path) == os.path.dirname(prefix)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            rows = list(executor.map(lambda path: self._read_header(path, *found[path], read_crs), changed))
+
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO epochs ({', '.join(self.columns)}) VALUES ({', '.join('?' * len(self.columns))})",
+                rows
+            )
+            self.connection.executemany("DELETE FROM epochs WHERE path = ?", [(path,) for path in removed])
+        return len(rows), len(removed)
+
+
+    def epochs(self, start=None, end=None, bbox=None, every_nth=1, folder=None):
+        """
+        Query the epochs in time order.
+        :param start: ISO timestamp, only the epochs at or after it are returned.
+        :param end: ISO timestamp, only the epochs at or before it are returned.
+        :param bbox: (min_x, min_y, max_x, max_y), only the epochs whose bounds overlap it are returned.
+        :param every_nth: Only every nth of the matching epochs is returned, starting with the first.
+        :param folder: Only the epochs of this folder are returned.
+        :return: A list of dictionaries with the catalog columns.
+        """
+        conditions, parameters = [], []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("timestamp <= ?")
+            parameters.append(end)
+        if bbox is not None:
+            conditions.append("max_x >= ? AND max_y >= ? AND min_x <= ? AND min_y <= ?")
+            parameters.extend(bbox)
+        if folder is not None:
+            prefix = os.path.join(folder, "")
+            conditions.append("substr(path, 1, ?) = ?")
+            parameters.extend((len(prefix), prefix))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection.execute(f"SELECT * FROM epochs{where} ORDER BY timestamp, name", parameters)
+        return [dict(row) for row in rows][::every_nth]
+
+
+    def paths(self, **kwargs):
+        return [row["path"] for row in self.epochs(**kwargs)]
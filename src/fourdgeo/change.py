@@ -1,8 +1,73 @@
+import os
+import re
+import json
 import uuid
+import functools
+import itertools
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse, spatial
+from scipy.sparse import csgraph
 
 from sklearn import cluster
-from scipy import spatial
+from fourdgeo import geometry, utilities, manifest
+
+
+def filter_significant_changes(corepoints, distances, uncertainties, chunk_size=1_000_000, keep_nan=False, max_distance=None):
+    """
+    Select the significant M3C2 changes block by block and stack them for clustering.
+    Only the significant rows are copied, into a buffer that grows when full, so that the memory
+    used stays proportional to the number of significant changes rather than of corepoints.
+    :param corepoints: Array of the corepoints with shape (n, 3).
+    :param distances: Array of the M3C2 distances with shape (n,).
+    :param uncertainties: Structured array of the uncertainties with a "lodetection" field, or
+        array of the level of detection with shape (n,).
+    :param chunk_size: The number of corepoints processed at once.
+    :param keep_nan: Whether corepoints without a distance (NaN) are kept. They are dropped by default.
+        Kept rows have a NaN distance, which propagates to the attributes of their clusters, so they
+        are meant for inspection rather than for cluster_m3c2_changes. Corepoints with non-finite
+        coordinates are dropped in any case.
+    :param max_distance: If given, changes with a larger absolute distance are dropped.
+    :return: Array of significant changes with shape (m, 4): x, y, z and distance.
+    """
+    uncertainties = np.asarray(uncertainties)
+    if uncertainties.dtype.names is not None:
+        lodetection = uncertainties["lodetection"]
+    else:
+        lodetection = uncertainties
+
+    n = distances.shape[0]
+    # Sized by the first chunk with significant changes
+    significant_changes = np.empty((0, 4), dtype=np.float64)
+    count = 0
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        abs_distances = np.abs(distances[start:stop])
+        # NaN compares as False, so corepoints without a distance are never significant
+        mask = abs_distances >= lodetection[start:stop]
+        if max_distance is not None:
+            mask &= abs_distances <= max_distance
+        if keep_nan:
+            mask |= np.isnan(abs_distances)
+        mask &= np.isfinite(corepoints[start:stop]).all(axis=1)
+
+        n_significant = np.count_nonzero(mask)
+        if n_significant == 0:
+            continue
+        # Grow the buffer geometrically when full
+        if count + n_significant > significant_changes.shape[0]:
+            capacity = max(2 * significant_changes.shape[0], count + n_significant)
+            significant_changes = np.resize(significant_changes, (capacity, 4))
+
+        significant_changes[count:count + n_significant, :3] = corepoints[start:stop][mask]
+        significant_changes[count:count + n_significant, 3] = distances[start:stop][mask]
+        count += n_significant
+
+    # Copy, so that the unused capacity of the buffer is released
+    if count < significant_changes.shape[0]:
+        significant_changes = significant_changes[:count].copy()
+    return significant_changes
 
 
 def cluster_m3c2_changes(significant_changes, dbscan_eps, min_cluster_size):
@@ -24,37 +89,153 @@ def cluster_m3c2_changes(significant_changes, dbscan_eps, min_cluster_size):
     all_changes_with_labels = all_changes_with_labels[all_changes_with_labels[:, -1] != -1]
     return all_changes_with_labels
 
-def extract_geoObjects_from_clusters(all_changes_with_labels, endDateTime_, filename_0, filename_1):
+def _tile_dbscan(points, dbscan_eps, min_cluster_size):
+    # DBSCAN of one tile, with the core flags needed to stitch the tiles
+    dbscan = cluster.DBSCAN(eps=dbscan_eps, min_samples=min_cluster_size)
+    labels = dbscan.fit_predict(points)
+    core = np.zeros(points.shape[0], dtype=bool)
+    core[dbscan.core_sample_indices_] = True
+    return labels, core
+
+
+def cluster_m3c2_changes_tiled(significant_changes, dbscan_eps, min_cluster_size, tile_size, max_workers=1):
+    """
+    Cluster M3C2 changes like cluster_m3c2_changes, tile by tile over the XY extent.
+    Each tile is extended by dbscan_eps on all sides, so its own points are core points exactly when
+    they are for a single DBSCAN. A core point shared by several tiles belongs to every tile cluster
+    it is reachable from, also in the tiles where it is only a border point, and the tile clusters
+    sharing a core point are merged. The clusters are numbered like DBSCAN does. The result matches cluster_m3c2_changes up to border points
+    reachable from several clusters.
+    :param significant_changes: Array of significant changes with shape (n, 4) where n is the number of points.
+    :param dbscan_eps: The maximum distance between two samples for one to be considered as in the neighborhood of the other.
+    :param min_cluster_size: The minimum number of samples in a cluster.
+    :param tile_size: The XY size of the tiles, in the unit of the coordinates.
+    :param max_workers: Number of processes clustering the tiles, 1 to cluster them in this process.
+    :return: Array of the clustered changes with their label as last column, without noise points.
+    """
+    xyz = significant_changes[:, :-1]
+    n = xyz.shape[0]
+    if n == 0:
+        return np.column_stack((significant_changes, np.zeros(0)))
+
+    origin = xyz[:, :2].min(axis=0)
+    home = np.floor((xyz[:, :2] - origin) / tile_size).astype(np.int64)
+    tiles = np.unique(home, axis=0)
+    tile_points = []
+    for tile in tiles:
+        lower = origin + tile * tile_size - dbscan_eps
+        upper = origin + (tile + 1) * tile_size + dbscan_eps
+        tile_points.append(np.flatnonzero(np.all((xyz[:, :2] >= lower) & (xyz[:, :2] <= upper), axis=1)))
+
+    if max_workers == 1:
+        results = [_tile_dbscan(xyz[indices], dbscan_eps, min_cluster_size) for indices in tile_points]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(
+                _tile_dbscan, [xyz[indices] for indices in tile_points],
+                [dbscan_eps] * len(tile_points), [min_cluster_size] * len(tile_points)
+            ))
+
+    # Every (point, tile cluster) membership, with the tile clusters numbered across the tiles
+    offsets = np.cumsum([0] + [int(labels.max()) + 1 for labels, _ in results])
+    if offsets[-1] == 0:
+        # Only noise points
+        return np.column_stack((significant_changes, np.zeros(n)))[:0]
+    points, tile_clusters, own = [], [], []
+    core = np.zeros(n, dtype=bool)
+    for t, (indices, (labels, tile_core)) in enumerate(zip(tile_points, results)):
+        is_own = np.all(home[indices] == tiles[t], axis=1)
+        # Core flags are exact for the own points of a tile only
+        core[indices[is_own & tile_core]] = True
+        clustered = labels >= 0
+        points.append(indices[clustered])
+        tile_clusters.append(labels[clustered] + offsets[t])
+        own.append(is_own[clustered])
+
+    # A core point in the overlap of a tile can be a border point there, reachable from several
+    # clusters of the tile while DBSCAN attaches it to one of them: it joins all of them
+    for t, (indices, (labels, tile_core)) in enumerate(zip(tile_points, results)):
+        overlap = np.flatnonzero(core[indices] & ~tile_core)
+        tile_core_points = np.flatnonzero(tile_core)
+        if overlap.size == 0 or tile_core_points.size == 0:
+            continue
+        tree = spatial.cKDTree(xyz[indices[tile_core_points]])
+        neighbours = tree.query_ball_point(xyz[indices[overlap]], dbscan_eps)
+        counts = np.array([len(neighbour) for neighbour in neighbours])
+        neighbours = np.fromiter(itertools.chain.from_iterable(neighbours), dtype=np.int64, count=counts.sum())
+        points.append(np.repeat(indices[overlap], counts))
+        tile_clusters.append(labels[tile_core_points[neighbours]] + offsets[t])
+        own.append(np.zeros(neighbours.shape[0], dtype=bool))
+    points = np.concatenate(points) if points else np.zeros(0, dtype=np.int64)
+    tile_clusters = np.concatenate(tile_clusters) if tile_clusters else np.zeros(0, dtype=np.int64)
+    own = np.concatenate(own) if own else np.zeros(0, dtype=bool)
+
+    # Tile clusters containing the same core point are one cluster, whether it is a core or a
+    # border point in the tile
+    order = np.lexsort((~own, points))
+    points, tile_clusters, own = points[order], tile_clusters[order], own[order]
+    same_point = (points[1:] == points[:-1]) & core[points[1:]]
+    edges = sparse.coo_matrix(
+        (np.ones(same_point.sum()), (tile_clusters[:-1][same_point], tile_clusters[1:][same_point])),
+        shape=(offsets[-1], offsets[-1])
+    )
+    _, merged = csgraph.connected_components(edges, directed=False)
+
+    # Label of each point from its own tile first, otherwise from any tile where it is clustered
+    first = np.r_[True, points[1:] != points[:-1]]
+    labels = np.full(n, -1, dtype=np.int64)
+    labels[points[first]] = merged[tile_clusters[first]]
+
+    # Number the clusters by their first core point, as DBSCAN does
+    first_core = np.full(offsets[-1], n, dtype=np.int64)
+    core_points = np.flatnonzero(core & (labels >= 0))
+    np.minimum.at(first_core, labels[core_points], core_points)
+    numbering = np.argsort(np.argsort(first_core, kind="stable"), kind="stable")
+
+    all_changes_with_labels = np.column_stack((significant_changes, np.where(labels >= 0, numbering[labels], -1)))
+    # Remove noise points (label -1)
+    return all_changes_with_labels[all_changes_with_labels[:, -1] != -1]
+
+
+def extract_geoObjects_from_clusters(all_changes_with_labels, endDateTime_, filename_0, filename_1, vertex_budget=None, concave_ratio=None, footprints=None):
     """
     Extract observations from clusters of M3C2 changes.
     :param all_changes_with_labels: Array of significant changes with labels.
     :param endDateTime_: The end date and time of the observation.
     :param filename_0: The filename of the first epoch.
     :param filename_1: The filename of the second epoch.
+    :param vertex_budget: If given, the maximum number of vertices of the stored geometries.
+    :param concave_ratio: If given, the footprint is a concave hull with this ratio (see geometry.concave_footprint).
+    :param footprints: If given, a dictionary filled with the 2D footprint of each geoObject, keyed by its id.
+        Pass it to ProjectChange to reuse the footprints for the GIS layer.
     :return: A list of observations with geo objects.
     """
-    # Extract unique cluster IDs and their counts
-    cluster_ids, cluster_count = np.unique(all_changes_with_labels[:, -1],return_counts=True)
-
     # If no clusters found, continue to the next file
-    if len(cluster_ids) == 0:
+    if all_changes_with_labels.shape[0] == 0:
         print(f"No clusters found between {filename_0} and {filename_1}.")
         return
 
     # backgroundImageData_ = XXX
 
+    labels = all_changes_with_labels[:, -1]
+    hulls = geometry.cluster_hulls(
+        all_changes_with_labels[:, :3], labels, vertex_budget=vertex_budget, concave_ratio=concave_ratio
+    )
+
+    # Per cluster sums of the coordinates and absolute distances, in the label order of the hulls
+    _, inverse = np.unique(labels, return_inverse=True)
+    sums = np.zeros((len(hulls), 4))
+    np.add.at(sums, inverse, np.column_stack((all_changes_with_labels[:, :3], np.abs(all_changes_with_labels[:, -2]))))
+
     geoObjects_ = []
 
     # If clusters found, print the largest and smallest cluster sizes    
-    for cluster_id in range(len(cluster_ids)):
-        xyz = all_changes_with_labels[all_changes_with_labels[:, -1] == cluster_ids[cluster_id], :3]
-        m3c2_distances = all_changes_with_labels[all_changes_with_labels[:, -1] == cluster_ids[cluster_id], -2]
-        convex_hull = spatial.ConvexHull(xyz)
-        volume = convex_hull.volume
-        area = convex_hull.area
+    for cluster_hull, cluster_sums in zip(hulls, sums):
+        volume = cluster_hull["volume"]
+        area = cluster_hull["area"]
         surface_to_volume_ratio = area / volume if volume > 0 else float('inf')
-        m3c2_mean_distance = np.mean(np.abs(m3c2_distances))
-        vertices_of_hull = convex_hull.points[convex_hull.vertices]
+        centroid = cluster_sums[:3] / cluster_hull["size"]
+        m3c2_mean_distance = cluster_sums[3] / cluster_hull["size"]
 
         # Create an geo object based on the cluster for the observations
         dateTime_ = endDateTime_
@@ -64,20 +245,22 @@ def extract_geoObjects_from_clusters(all_changes_with_labels, endDateTime_, file
         type_ = "unknown"
 
         customAttributes_ = {
-            "X_centroid": np.mean(xyz[:, 0]),
-            "Y_centroid": np.mean(xyz[:, 1]),
-            "Z_centroid": np.mean(xyz[:, 2]),
+            "X_centroid": centroid[0],
+            "Y_centroid": centroid[1],
+            "Z_centroid": centroid[2],
             "m3c2_magnitude_abs_average_per_cluster": m3c2_mean_distance,
             "volume": volume,
             "surface_area": area,
             "surface_to_volume_ratio": surface_to_volume_ratio,
-            "cluster_size_points": int(cluster_count[cluster_id]),
+            "cluster_size_points": cluster_hull["size"],
             }
         
         geometry_ = {
             "type": "Polygon",
-            "coordinates": vertices_of_hull.tolist()
+            "coordinates": cluster_hull["vertices"].tolist()
         }
+        if footprints is not None:
+            footprints[id_] = cluster_hull["footprint"]
 
         geoObjects_.append({
             "id": id_,
@@ -88,3 +271,392 @@ def extract_geoObjects_from_clusters(all_changes_with_labels, endDateTime_, file
         })
     return geoObjects_
 
+
+class ChangeResultsStore:
+    """
+    Persistent store of M3C2 change results.
+
+    Each epoch pair is stored as a compressed .npz file with one column per array: the corepoint
+    coordinates, the distances, every field of the uncertainties and the significance mask. Files
+    are keyed by the epoch pair, a hash of the folders of the epochs and a hash of the M3C2 settings,
+    so that clustering parameters can be re-tuned from the stored results without recomputing M3C2,
+    and epochs with the same filename in different folders do not overwrite each other.
+
+    Methods:
+        - settings_hash: Hash of a settings dictionary.
+        - contains: Whether results are stored for an epoch pair and settings.
+        - save: Stores the results of an epoch pair.
+        - load: Loads the results of an epoch pair.
+        - significant_changes: Loads the significant changes of an epoch pair, ready for clustering.
+        - pairs: Lists the stored epoch pairs.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+
+    @staticmethod
+    def settings_hash(settings):
+        """
+        Hash of a settings dictionary, independent of the order of its keys (see manifest.settings_hash).
+        :param settings: Dictionary of the M3C2 settings.
+        :return: The first 16 characters of the SHA-256 hex digest.
+        """
+        return manifest.settings_hash(settings)
+
+
+    def path(self, epoch_0, epoch_1, settings):
+        """
+        Path of the file storing the results of an epoch pair.
+        :param epoch_0: Name or path of the first epoch. Names are relative to the working directory.
+        :param epoch_1: Name or path of the second epoch.
+        :param settings: Dictionary of the M3C2 settings.
+        :return: The path of the .npz file.
+        """
+        names = [
+            re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.splitext(os.path.basename(str(epoch)))[0])
+            for epoch in (epoch_0, epoch_1)
+        ]
+        folders = manifest.settings_hash([os.path.dirname(os.path.abspath(str(epoch))) for epoch in (epoch_0, epoch_1)])
+        return os.path.join(self.folder, f"{names[0]}__{names[1]}__{folders[:8]}__{self.settings_hash(settings)}.npz")
+
+
+    def contains(self, epoch_0, epoch_1, settings):
+        """Whether results are stored for the epoch pair and settings."""
+        return os.path.isfile(self.path(epoch_0, epoch_1, settings))
+
+
+    def save(self, epoch_0, epoch_1, settings, corepoints, distances, uncertainties):
+        """
+        Store the M3C2 results of an epoch pair.
+        :param epoch_0: Name or path of the first epoch.
+        :param epoch_1: Name or path of the second epoch.
+        :param settings: Dictionary of the M3C2 settings.
+        :param corepoints: Array of the corepoints with shape (n, 3).
+        :param distances: Array of the M3C2 distances with shape (n,).
+        :param uncertainties: Structured array of the uncertainties with a "lodetection" field, or
+            array of the level of detection with shape (n,).
+        :return: The path of the written file.
+        """
+        corepoints = np.asarray(corepoints)
+        distances = np.asarray(distances)
+        uncertainties = np.asarray(uncertainties)
+        if uncertainties.dtype.names is not None and "lodetection" not in uncertainties.dtype.names:
+            raise ValueError(f"The uncertainties have no lodetection field: {uncertainties.dtype.names}")
+        columns = {
+            "epoch_0": np.array(os.path.basename(str(epoch_0))),
+            "epoch_1": np.array(os.path.basename(str(epoch_1))),
+            "settings": np.array(json.dumps(settings, sort_keys=True, default=str)),
+            "x": corepoints[:, 0],
+            "y": corepoints[:, 1],
+            "z": corepoints[:, 2],
+            "distances": distances,
+        }
+        if uncertainties.dtype.names is not None:
+            for field in uncertainties.dtype.names:
+                columns[f"uncertainties_{field}"] = uncertainties[field]
+        else:
+            columns["uncertainties_lodetection"] = uncertainties
+
+        # NaN distances compare as False, so they are never significant
+        with np.errstate(invalid="ignore"):
+            columns["significant"] = np.abs(distances) >= columns["uncertainties_lodetection"]
+
+        # Write to a temporary file first, so that an interrupted run leaves no partial result
+        filename = self.path(epoch_0, epoch_1, settings)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmp_filename, filename)
+        return filename
+
+
+    def load(self, epoch_0, epoch_1, settings):
+        """
+        Load the M3C2 results of an epoch pair.
+        :param epoch_0: Name or path of the first epoch.
+        :param epoch_1: Name or path of the second epoch.
+        :param settings: Dictionary of the M3C2 settings.
+        :return: A dictionary with the "corepoints", "distances", "uncertainties" (structured array,
+            as returned by py4dgeo) and "significant" arrays, or None if nothing is stored.
+        """
+        filename = self.path(epoch_0, epoch_1, settings)
+        if not os.path.isfile(filename):
+            return None
+
+        with np.load(filename) as data:
+            fields = [key[len("uncertainties_"):] for key in data.files if key.startswith("uncertainties_")]
+            uncertainties = np.empty(
+                data["distances"].shape[0],
+                dtype=[(field, data[f"uncertainties_{field}"].dtype) for field in fields]
+            )
+            for field in fields:
+                uncertainties[field] = data[f"uncertainties_{field}"]
+
+            return {
+                "corepoints": np.column_stack((data["x"], data["y"], data["z"])),
+                "distances": data["distances"],
+                "uncertainties": uncertainties,
+                "significant": data["significant"],
+            }
+
+
+    def significant_changes(self, epoch_0, epoch_1, settings):
+        """
+        Load the significant changes of an epoch pair, as expected by cluster_m3c2_changes.
+        :param epoch_0: Name or path of the first epoch.
+        :param epoch_1: Name or path of the second epoch.
+        :param settings: Dictionary of the M3C2 settings.
+        :return: Array of the significant changes with shape (n, 4), or None if nothing is stored.
+        """
+        filename = self.path(epoch_0, epoch_1, settings)
+        if not os.path.isfile(filename):
+            return None
+
+        # Only the needed columns are decompressed
+        with np.load(filename) as data:
+            mask = data["significant"]
+            return np.column_stack(
+                (data["x"][mask], data["y"][mask], data["z"][mask], data["distances"][mask])
+            )
+
+
+    def pairs(self, settings=None):
+        """
+        List the stored epoch pairs.
+        :param settings: If given, only the pairs computed with these settings are listed.
+        :return: A sorted list of (epoch_0, epoch_1) filename tuples.
+        """
+        suffix = f"__{self.settings_hash(settings)}.npz" if settings is not None else ".npz"
+        pairs = set()
+        for filename in os.listdir(self.folder):
+            if not filename.endswith(suffix):
+                continue
+            with np.load(os.path.join(self.folder, filename)) as data:
+                pairs.add((str(data["epoch_0"]), str(data["epoch_1"])))
+        return sorted(pairs)
+
+
+###############################################
+# Change detection against several baselines
+
+def baseline_pairs(n_epochs, baseline="consecutive", reference=0, window=1):
+    """
+    Epoch pairs compared by a baseline strategy.
+    :param n_epochs: The number of epochs, in time order.
+    :param baseline: "consecutive" compares each epoch to the previous one, "reference" to a fixed
+        reference epoch and "window" to each of the window previous epochs.
+    :param reference: Index of the reference epoch of the "reference" baseline, negative indices
+        counting from the end.
+    :param window: Number of previous epochs of the "window" baseline.
+    :return: List of the (index_0, index_1) pairs, ordered by index_1.
+    """
+    if baseline == "consecutive":
+        return [(enum - 1, enum) for enum in range(1, n_epochs)]
+    if baseline == "reference":
+        if not -n_epochs <= reference < n_epochs:
+            raise ValueError(f"Reference epoch {reference} out of range for {n_epochs} epochs")
+        reference = reference % n_epochs
+        return [(reference, enum) for enum in range(n_epochs) if enum != reference]
+    if baseline == "window":
+        if window < 1:
+            raise ValueError(f"The window must hold at least one epoch, got {window}")
+        return [(previous, enum) for enum in range(1, n_epochs) for previous in range(max(enum - window, 0), enum)]
+    raise ValueError(f"Unknown baseline {baseline!r}, expected 'consecutive', 'reference' or 'window'")
+
+
+class BaselineChangeScheduler:
+    """
+    M3C2 change detection of a time series against a baseline: the previous epoch, a fixed reference
+    epoch or a sliding window of previous epochs (see baseline_pairs).
+
+    Each epoch is read once and keeps its search tree, and the corepoints and normals of a reference
+    epoch are computed once, for all the pairs sharing them. An epoch is dropped after the last pair
+    using it, so a window of k epochs keeps at most k + 1 epochs in memory, and comparing all the
+    epochs to a fixed reference estimates the normals once. Pairs already in the results store are
+    loaded instead of computed.
+
+    Methods:
+        - pairs: The epoch pairs of the baseline.
+        - results_settings: The settings keying the stored results.
+        - compare: M3C2 corepoints, distances and uncertainties of an epoch pair.
+        - release: Drops the cached data of an epoch.
+        - run: Compares all the epoch pairs, yielding their significant changes.
+        - detect_changes: Compares all the epoch pairs, yielding their observations.
+    """
+
+    def __init__(self, m3c2_settings, baseline="consecutive", reference=0, window=1, corepoints=None, results_store=None,
+                 corepoint_settings=None):
+        """
+        :param m3c2_settings: Dictionary with the "cyl_radius", "normal_radii", "max_distance" and
+            "registration_error" M3C2 settings.
+        :param baseline: "consecutive", "reference" or "window", see baseline_pairs.
+        :param reference: Index of the reference epoch of the "reference" baseline.
+        :param window: Number of previous epochs of the "window" baseline.
+        :param corepoints: Function returning the corepoints of a reference epoch from its points with
+            shape (n, 3). By default, all the points are corepoints, as in the rockfall notebook.
+        :param results_store: Optional ChangeResultsStore, or its folder, storing the M3C2 results.
+            The results depend on the epoch pair only, so they are shared between the baselines.
+        :param corepoint_settings: JSON serializable parameters of the corepoint selection, stored
+            with the M3C2 settings in the key of the results (see results_settings). Defaults to the
+            name of the corepoints function, and the arguments of a functools.partial. Pass it when
+            the function depends on other parameters, e.g. a closure or a lambda, so that changing
+            them does not return stale results.
+        """
+        ##############################
+        ### INITIALIZING VARIABLES ###
+        self.m3c2_settings = m3c2_settings
+        self.baseline = baseline
+        self.reference = reference
+        self.window = window
+        self.corepoints = corepoints
+        self.corepoint_settings = corepoint_settings
+        if isinstance(results_store, str):
+            results_store = ChangeResultsStore(results_store)
+        self.results_store = results_store
+        # py4dgeo epochs, with their search tree, and corepoints and normals of the reference epochs
+        self._epochs = {}
+        self._references = {}
+        # Work done, e.g. one normal estimation for a fixed reference
+        self.epochs_read = 0
+        self.normal_estimations = 0
+        ##############################
+
+
+    def pairs(self, n_epochs):
+        return baseline_pairs(n_epochs, self.baseline, self.reference, self.window)
+
+
+    def results_settings(self):
+        """
+        Settings of the stored results: the M3C2 settings, and the corepoint selection unless all the
+        points are corepoints.
+        """
+        if self.corepoints is None:
+            return self.m3c2_settings
+        corepoint_settings = self.corepoint_settings
+        if corepoint_settings is None:
+            function = self.corepoints
+            if isinstance(function, functools.partial):
+                corepoint_settings = {"args": list(function.args), "keywords": function.keywords}
+                function = function.func
+                corepoint_settings["function"] = f"{function.__module__}.{function.__qualname__}"
+            else:
+                corepoint_settings = {"function": f"{function.__module__}.{function.__qualname__}"}
+        return dict(self.m3c2_settings, corepoints=corepoint_settings)
+
+
+    def _epoch(self, pc_path):
+        if pc_path not in self._epochs:
+            # py4dgeo is only needed to compute new pairs
+            import py4dgeo
+
+            # Absolute path, so py4dgeo does not look for the file in its test data
+            self._epochs[pc_path] = py4dgeo.read_from_las(os.path.abspath(pc_path))
+            self.epochs_read += 1
+        return self._epochs[pc_path]
+
+
+    def _reference_data(self, pc_path):
+        if pc_path not in self._references:
+            cloud = self._epoch(pc_path).cloud
+            corepoints = cloud if self.corepoints is None else np.asarray(self.corepoints(cloud), dtype=np.float64)
+            # The normals are estimated by the first pair using the reference
+            self._references[pc_path] = {"corepoints": corepoints, "normals": None}
+        return self._references[pc_path]
+
+
+    def compare(self, pc_path_0, pc_path_1):
+        """
+        Run M3C2 between two epochs, reusing the cached epochs, corepoints and normals.
+        :param pc_path_0: Path of the reference epoch.
+        :param pc_path_1: Path of the compared epoch.
+        :return: The corepoints with shape (n, 3), the distances and the uncertainties.
+        """
+        import py4dgeo
+
+        reference = self._reference_data(pc_path_0)
+        m3c2 = py4dgeo.M3C2(
+            epochs=(self._epoch(pc_path_0), self._epoch(pc_path_1)),
+            corepoints=reference["corepoints"],
+            corepoint_normals=reference["normals"],
+            cyl_radius=self.m3c2_settings["cyl_radius"],
+            normal_radii=self.m3c2_settings["normal_radii"],
+            max_distance=self.m3c2_settings["max_distance"],
+            registration_error=self.m3c2_settings["registration_error"],
+        )
+        distances, uncertainties = m3c2.run()
+        if reference["normals"] is None:
+            reference["normals"] = m3c2.directions()
+            self.normal_estimations += 1
+        return reference["corepoints"], distances, uncertainties
+
+
+    def release(self, pc_path):
+        self._epochs.pop(pc_path, None)
+        self._references.pop(pc_path, None)
+
+
+    def run(self, pc_paths):
+        """
+        Compare the epoch pairs of the baseline.
+        :param pc_paths: The point cloud paths of the epochs, in time order.
+        :return: Generator of (pc_path_0, pc_path_1, significant_changes) tuples, one per pair in the
+            order of pairs, the significant changes being as returned by filter_significant_changes.
+        """
+        pc_paths = [str(pc_path) for pc_path in pc_paths]
+        pairs = self.pairs(len(pc_paths))
+        # Index of the last pair using each epoch, after which its data is dropped
+        last_use = {}
+        for enum, pair in enumerate(pairs):
+            for index in pair:
+                last_use[index] = enum
+
+        try:
+            for enum, (index_0, index_1) in enumerate(pairs):
+                pc_path_0, pc_path_1 = pc_paths[index_0], pc_paths[index_1]
+                significant_changes = None
+                if self.results_store is not None:
+                    significant_changes = self.results_store.significant_changes(pc_path_0, pc_path_1, self.results_settings())
+                if significant_changes is None:
+                    corepoints, distances, uncertainties = self.compare(pc_path_0, pc_path_1)
+                    if self.results_store is not None:
+                        self.results_store.save(pc_path_0, pc_path_1, self.results_settings(), corepoints, distances, uncertainties)
+                    significant_changes = filter_significant_changes(corepoints, distances, uncertainties)
+
+                for index in (index_0, index_1):
+                    if last_use[index] == enum:
+                        self.release(pc_paths[index])
+                yield pc_path_0, pc_path_1, significant_changes
+        finally:
+            self._epochs.clear()
+            self._references.clear()
+
+
+    def detect_changes(self, pc_paths, dbscan_eps, min_cluster_size, vertex_budget=None):
+        """
+        Compare the epoch pairs of the baseline and extract their geoObjects, as in the rockfall notebook.
+        :param pc_paths: The point cloud paths of the epochs, in time order, named "%y%m%d_%H%M%S".
+        :param dbscan_eps: The DBSCAN eps of cluster_m3c2_changes.
+        :param min_cluster_size: The minimum cluster size of cluster_m3c2_changes.
+        :param vertex_budget: Passed to extract_geoObjects_from_clusters.
+        :return: Generator of observation dictionaries, one per pair, spanning from the first to the
+            second epoch of the pair.
+        """
+        for pc_path_0, pc_path_1, significant_changes in self.run(pc_paths):
+            fname_0, fname_1 = os.path.basename(pc_path_0), os.path.basename(pc_path_1)
+            endDateTime = utilities.iso_timestamp(fname_1) + "Z"
+            geoObjects = []
+            if significant_changes.shape[0] > 0:
+                labeled = cluster_m3c2_changes(significant_changes, dbscan_eps, min_cluster_size)
+                geoObjects = extract_geoObjects_from_clusters(
+                    labeled, endDateTime, fname_0, fname_1, vertex_budget=vertex_budget
+                ) or []
+            yield {
+                "backgroundImageData": {},
+                "startDateTime": utilities.iso_timestamp(fname_0) + "Z",
+                "endDateTime": endDateTime,
+                "geoObjects": geoObjects,
+            }
@@ -0,0 +1,231 @@
+import numpy as np
+import shapely
+import pandas as pd
+from scipy import spatial
+
+
+def convex_hull_indices(points):
+    """
+    Indices of the convex hull vertices of a set of 2D points, ordered counter-clockwise.
+    Degenerate sets (less than 3 points, collinear or duplicated points) do not raise: the indices
+    of their distinct points are returned in input order instead.
+    :param points: Array of points with shape (n, 2).
+    :return: Array of indices into points.
+    """
+    points = np.asarray(points)
+    if points.shape[0] >= 3:
+        try:
+            return spatial.ConvexHull(points).vertices
+        except spatial.QhullError:
+            pass
+    _, indices = np.unique(points, axis=0, return_index=True)
+    indices = np.sort(indices)
+    if indices.shape[0] > 2:
+        # Collinear points, only the two extremes are kept
+        extent = points[indices] - points[indices].mean(axis=0)
+        direction = extent[np.argmax(np.linalg.norm(extent, axis=1))]
+        projection = extent @ direction
+        indices = indices[[np.argmin(projection), np.argmax(projection)]]
+    return indices
+
+
+def simplify_ring(ring, vertex_budget):
+    """
+    Simplify a polygon ring to a vertex budget by Visvalingam-Whyatt elimination.
+    The vertex spanning the smallest triangle with its neighbours is removed until the budget is met.
+    :param ring: Array of the ordered vertices with shape (n, d), without the closing vertex. Areas
+        are computed from the first two coordinates.
+    :param vertex_budget: The maximum number of vertices, at least 3.
+    :return: Array of the indices of the kept vertices, in ring order.
+    """
+    ring = np.asarray(ring)
+    indices = np.arange(ring.shape[0])
+    if vertex_budget is None or ring.shape[0] <= vertex_budget:
+        return indices
+
+    vertex_budget = max(int(vertex_budget), 3)
+    xy = ring[:, :2].astype(np.float64)
+    while indices.shape[0] > vertex_budget:
+        current = xy[indices]
+        previous = np.roll(current, 1, axis=0)
+        following = np.roll(current, -1, axis=0)
+        areas = np.abs(
+            (previous[:, 0] - following[:, 0]) * (current[:, 1] - previous[:, 1])
+            - (previous[:, 0] - current[:, 0]) * (following[:, 1] - previous[:, 1])
+        )
+        indices = np.delete(indices, np.argmin(areas))
+    return indices
+
+
+def reduce_vertices(points, vertex_budget, keep=None):
+    """
+    Reduce an unordered set of vertices to a budget by farthest point sampling.
+    :param points: Array of the vertices with shape (n, d).
+    :param vertex_budget: The maximum number of vertices.
+    :param keep: Indices of vertices that are always kept, they seed the sampling.
+    :return: Array of the indices of the kept vertices, in input order.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = points.shape[0]
+    if vertex_budget is None or n <= vertex_budget:
+        return np.arange(n)
+
+    selected = list(keep[:vertex_budget]) if keep is not None and len(keep) > 0 else []
+    if not selected:
+        # Start from the vertex farthest from the centroid
+        selected = [int(np.argmax(np.linalg.norm(points - points.mean(axis=0), axis=1)))]
+
+    distances = np.min(
+        np.linalg.norm(points[:, np.newaxis, :] - points[np.asarray(selected)][np.newaxis, :, :], axis=2),
+        axis=1
+    )
+    while len(selected) < vertex_budget:
+        farthest = int(np.argmax(distances))
+        selected.append(farthest)
+        np.minimum(distances, np.linalg.norm(points - points[farthest], axis=1), out=distances)
+    return np.sort(np.asarray(selected))
+
+
+def concave_footprint(points_xy, ratio):
+    """
+    Concave (alpha shape like) footprint of a set of 2D points.
+    :param points_xy: Array of points with shape (n, 2).
+    :param ratio: Between 0 and 1, the lower the more concave. 1 gives the convex hull.
+    :return: Array of the ordered footprint vertices with shape (m, 2), without the closing vertex.
+    """
+    hull = shapely.concave_hull(shapely.MultiPoint(np.asarray(points_xy)), ratio=ratio)
+    if hull.geom_type == "Polygon":
+        return np.asarray(hull.exterior.coords)[:-1]
+    return np.asarray(hull.coords) if hull.geom_type == "LineString" else np.asarray([hull.coords[0]])
+
+
+def cluster_hulls(xyz, labels, vertex_budget=None, concave_ratio=None):
+    """
+    Compute the hull geometry of every cluster in one batch.
+    The 3D convex hull of each cluster is computed once. Its 2D footprint is derived from the hull
+    vertices only, as the footprint of a convex hull is the convex hull of its projected vertices.
+    :param xyz: Array of the clustered points with shape (n, 3).
+    :param labels: Array of the cluster labels with shape (n,).
+    :param vertex_budget: If given, the footprint and the 3D vertices are reduced to at most this
+        many vertices. The footprint vertices are kept first among the 3D vertices.
+    :param concave_ratio: If given, the footprint is a concave hull of all the cluster points
+        with this ratio (see concave_footprint) instead of the convex one.
+    :return: A list of dictionaries, one per cluster in increasing label order, with the "label",
+        "size", "volume", "area", "vertices" (3D hull vertices) and "footprint" (2D ring) of the cluster.
+    """
+    # Group the points by label once, instead of masking the whole array per cluster
+    order = np.argsort(labels, kind="stable")
+    cluster_ids, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+
+    hulls = []
+    for cluster_id, start, count in zip(cluster_ids, starts, counts):
+        points = xyz[order[start:start + count]]
+        try:
+            hull = spatial.ConvexHull(points)
+            volume, area = hull.volume, hull.area
+            vertices = points[hull.vertices]
+        except spatial.QhullError:
+            # Flat or degenerate cluster
+            volume, area = 0.0, 0.0
+            vertices = points[np.unique(points, axis=0, return_index=True)[1]]
+
+        if concave_ratio is not None:
+            footprint = concave_footprint(points[:, :2], concave_ratio)
+            footprint = footprint[simplify_ring(footprint, vertex_budget)]
+            vertices = vertices[reduce_vertices(vertices, vertex_budget)]
+        else:
+            footprint_indices = convex_hull_indices(vertices[:, :2])
+            footprint_indices = footprint_indices[simplify_ring(vertices[footprint_indices], vertex_budget)]
+            footprint = vertices[footprint_indices, :2]
+            kept = reduce_vertices(vertices, vertex_budget, keep=footprint_indices)
+            vertices = vertices[kept]
+
+        hulls.append({
+            "label": cluster_id,
+            "size": int(count),
+            "volume": volume,
+            "area": area,
+            "vertices": vertices,
+            "footprint": footprint,
+        })
+    return hulls
+
+
+def voxel_size_from(resolution_cm=None, dbscan_eps=None):
+    """
+    Default voxel size of the thinning before a projection or a clustering.
+    One pixel at the anchor point is at most one pixel for the points at or beyond the anchor
+    distance. Closer points, where a pixel covers less than resolution_cm, are thinned more coarsely
+    than the image, so the projection can change there. Half of dbscan_eps keeps the neighbourhoods
+    of the clustering.
+    :param resolution_cm: The pixel size of the projection at the anchor point, in cm.
+    :param dbscan_eps: The DBSCAN eps of the clustering.
+    :return: The voxel size, the smallest of one pixel and half of dbscan_eps.
+    """
+    sizes = []
+    if resolution_cm is not None:
+        sizes.append(resolution_cm / 100)
+    if dbscan_eps is not None:
+        sizes.append(dbscan_eps / 2)
+    if not sizes:
+        raise ValueError("resolution_cm or dbscan_eps is needed to derive the voxel size.")
+    return min(sizes)
+
+
+def voxel_thin(points, voxel_size, mode="first", reference_point=None):
+    """
+    Keep one point per voxel of a regular grid.
+    The integer voxel keys are packed into one integer per point and grouped with a hash table, so
+    the thinning is linear in the number of points.
+    :param points: Array with shape (n, d). The voxels are computed from the first three columns, the
+        other columns (e.g. the M3C2 distance) are carried along.
+    :param voxel_size: The edge length of the voxels.
+    :param mode: "first" keeps the first point of each voxel, "nearest" the point nearest to
+        reference_point (the scanner) and "centroid" the mean of the points of each voxel.
+    :param reference_point: The scanner position, needed by the "nearest" mode.
+    :return: The indices of the kept points (for centroid, the first point of each voxel), the thinned
+        points in the same order, and the reduction ratio (input points per kept point).
+    """
+    points = np.asarray(points)
+    n = points.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), points.copy(), 1.0
+
+    voxels = np.floor((points[:, :3] - points[:, :3].min(axis=0)) / voxel_size).astype(np.int64)
+    extent = voxels.max(axis=0) + 1
+    if np.prod(extent.astype(np.float64)) < 2 ** 63:
+        keys = np.ravel_multi_index(voxels.T, extent)
+    else:
+        # Too many voxels for one integer key, the rows are hashed instead
+        keys = pd.MultiIndex.from_arrays(voxels.T)
+    # Voxel ids in order of first appearance
+    codes, uniques = pd.factorize(keys, sort=False)
+    n_voxels = len(uniques)
+
+    if mode == "first" or mode == "centroid":
+        seen = np.maximum.accumulate(codes)
+        indices = np.flatnonzero(np.r_[True, codes[1:] > seen[:-1]])
+    elif mode == "nearest":
+        if reference_point is None:
+            raise ValueError("The nearest mode needs the reference_point.")
+        offsets = points[:, :3] - np.asarray(reference_point, dtype=np.float64)
+        distances = np.einsum("ij,ij->i", offsets, offsets)
+        nearest = np.full(n_voxels, np.inf)
+        np.minimum.at(nearest, codes, distances)
+        # First of the nearest points of each voxel
+        candidates = np.flatnonzero(distances == nearest[codes])
+        indices = np.full(n_voxels, n, dtype=np.int64)
+        np.minimum.at(indices, codes[candidates], candidates)
+        indices = np.sort(indices)
+    else:
+        raise ValueError(f"Unknown voxel thinning mode: {mode}")
+
+    if mode == "centroid":
+        counts = np.bincount(codes, minlength=n_voxels)
+        thinned = np.column_stack([
+            np.bincount(codes, weights=points[:, column], minlength=n_voxels) / counts
+            for column in range(points.shape[1])
+        ])
+    else:
+        thinned = points[indices]
+    return indices, thinned, n / n_voxels
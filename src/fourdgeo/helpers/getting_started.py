@@ -7,6 +7,9 @@ import json
 sys.path.insert(0, "../src")
 from fourdgeo import projection
 from fourdgeo import utilities
+from fourdgeo import manifest
+from fourdgeo import image_store
+from fourdgeo import aggregates
 from fourdgeo.helpers.getting_started import *
 
 # File download and handling
@@ -19,6 +22,7 @@ from PIL import Image, ImageSequence
 # Hosting
 import http.server
 import socketserver
+import re
 
 
 
@@ -67,17 +71,40 @@ def get_example_configuration():
 def convert_point_cloud_time_series_to_datamodel(data_folder, configuration):
 
     laz_paths = list(Path(data_folder).glob("*.laz"))
-    laz_paths = sorted(laz_paths)
-
-    images = []
-    list_background_projections = []
     pcs = sorted(laz_paths)
 
     project_name = configuration['project_setting']['project_name']
     output_folder = configuration['project_setting']['output_folder']
 
+    # Epochs projected by a previous run with the same inputs and settings are skipped
+    job_manifest = manifest.JobManifest(os.path.join(output_folder, "manifest.jsonl"))
+    projection_settings = {key: value for key, value in configuration['pc_projection'].items() if key != "pc_path"}
+    reference = None
+
+    # The png images are stored by content hash, so identical frames are stored and served once.
+    # Frames whose mean absolute difference to the previous one is at most image_tolerance reuse it
+    images = image_store.ImageStore(
+        configuration['project_setting'].get("image_store", os.path.join(output_folder, "images"))
+    )
+    image_tolerance = configuration['project_setting'].get("image_tolerance", 0)
+
+    png_images = []
+    image_hash = None
     for enum, pc in enumerate(pcs):
-        lf = laspy.read(pc)
+        job = manifest.JobManifest.epoch_job(pc)
+        # Later epochs depend on the reference geometry of the first one
+        settings = {
+            "project_name": project_name, "pc_projection": projection_settings, "reference": reference,
+            "image_store": images.folder, "image_tolerance": image_tolerance
+        }
+        if job_manifest.is_complete(job, [pc], settings):
+            result = job_manifest.result(job)
+            image_hash = result["image_hash"]
+            png_images.append((result["startDateTime"], job_manifest.outputs(job)[1], result.get("tiles")))
+            if enum == 0:
+                reference = result["reference"]
+            continue
+
         configuration['pc_projection']['pc_path'] = pc
 
         background_projection = projection.PCloudProjection(
@@ -91,16 +118,23 @@ def convert_point_cloud_time_series_to_datamodel(data_folder, configuration):
                 ref_h_fov, ref_v_fov, ref_anchor_point_xyz, 
                 ref_h_img_res, ref_v_img_res
             ) = background_projection.project_pc(buffer_m = 0.5)
+            reference = {
+                "h_fov": [float(value) for value in ref_h_fov],
+                "v_fov": [float(value) for value in ref_v_fov],
+                "anchor_point_xyz": [float(value) for value in ref_anchor_point_xyz],
+                "h_img_res": int(ref_h_img_res),
+                "v_img_res": int(ref_v_img_res),
+            }
         # Next projections using reference data
         else:
             background_projection.project_pc(
-                ref_theta=ref_h_fov[0],
-                ref_phi=ref_v_fov[0],
-                ref_anchor_point_xyz=None,
-                ref_h_fov=ref_h_fov,
-                ref_v_fov=ref_v_fov,
-                ref_h_img_res=ref_h_img_res,
-                ref_v_img_res=ref_v_img_res
+                ref_theta=reference["h_fov"][0],
+                ref_phi=reference["v_fov"][0],
+                ref_anchor_point_xyz=reference["anchor_point_xyz"],
+                ref_h_fov=tuple(reference["h_fov"]),
+                ref_v_fov=tuple(reference["v_fov"]),
+                ref_h_img_res=reference["h_img_res"],
+                ref_v_img_res=reference["v_img_res"]
             )
 
         bg_img = background_projection.bg_image_filename[0]
@@ -110,67 +144,75 @@ def convert_point_cloud_time_series_to_datamodel(data_folder, configuration):
         curr_fname = os.path.basename(pc)
         start_scan = (utilities.iso_timestamp(curr_fname) + "Z").replace(":", " ")
 
-        
         outfile = bg_img.split('.')[0] + f"_{start_scan}." + bg_img.split('.')[1]
-
-        try:
-            os.rename(bg_img, outfile)
-        except FileExistsError:
-            os.remove(outfile)
-            os.rename(bg_img, outfile)
-
-        images.append(outfile)
-
-        background_projection.bg_image_filename[0] = outfile
-        list_background_projections.append(background_projection)
-
-
-    # Convert tif to png
-    png_images = []
-    for background_projection in list_background_projections:
-        image_path = background_projection.bg_image_filename[0]
-        filename = str.split(image_path, ".")[0]
-        try:
-            with Image.open(image_path) as im:
-                for i, page in enumerate(ImageSequence.Iterator(im)):
-                    out_path = filename + ".png"
-                    if not os.path.isfile(out_path):
-                        try:
-                            page.save(out_path)
-                        except:
-                            print(out_path)
-                png_images.append(out_path)
-        except:
-            print(filename)
+        os.replace(bg_img, outfile)
+
+        # Convert tif to png, and move the png to the image store
+        out_path = outfile.split('.')[0] + ".png"
+        utilities.tif_to_png(outfile, out_path)
+        start_date_time = start_scan.replace(" ", ":")
+        image_hash = images.put(out_path, key=start_date_time, previous=image_hash, tolerance=image_tolerance)
+
+        # Tile manifest of the incremental background images ("incremental_tiles"), kept per epoch
+        tiles_file = getattr(background_projection, "tile_manifest_filename", None)
+        if tiles_file is not None:
+            tiles_file = os.path.splitext(os.path.relpath(tiles_file))[0] + f"_{start_scan}.json"
+            os.replace(background_projection.tile_manifest_filename, tiles_file)
+        png_images.append((start_date_time, images.path(image_hash), tiles_file))
+
+        job_manifest.record(
+            job, [pc], settings, [outfile, images.path(image_hash)] + ([tiles_file] if tiles_file else []),
+            result={
+                "reference": reference if enum == 0 else None, "startDateTime": start_date_time,
+                "image_hash": image_hash, "tiles": tiles_file
+            }
+        )
 
 
     # Create json
     aggregated_data = utilities.DataModel([])
 
-    for (i, background_projection) in enumerate(list_background_projections):
-        full_path = f"http://localhost:{configuration['project_setting']['hosting_port']}/" + png_images[i]
-        img_size = Image.open(png_images[i]).convert("RGB").size
+    base_url = f"http://localhost:{configuration['project_setting']['hosting_port']}/"
+    for start_date_time, png_image, tiles_file in png_images:
+        full_path = base_url + os.path.relpath(png_image)
+        with Image.open(png_image) as im:
+            img_size = im.size
         aggregated_data.observations.append(utilities.Observation(
-            startDateTime = os.path.basename(background_projection.bg_image_filename[0]).split('_')[-1][:-5].replace(" ", ":"),
-            endDateTime = os.path.basename(background_projection.bg_image_filename[0]).split('_')[-1][:-5].replace(" ", ":"),
+            startDateTime = start_date_time,
+            endDateTime = start_date_time,
             geoObjects=[],
             backgroundImageData=utilities.ImageData(
                 url=str(full_path).replace("\\", "/"),
                 width=img_size[0],
-                height=img_size[1]
+                height=img_size[1],
+                tiles=(base_url + os.path.relpath(tiles_file)).replace("\\", "/") if tiles_file else None
             )
         ))
 
-    with open(f"{output_folder}/data_model.json", "w") as f:
-        f.write(aggregated_data.toJSON())
+    with manifest.atomic_output(f"{output_folder}/data_model.json") as tmp_path:
+        with open(tmp_path, "w") as f:
+            f.write(aggregated_data.toJSON())
+
+    # Precomputed aggregates of the observations for the Chart module
+    observation_aggregates = aggregates.ObservationAggregates(f"{output_folder}/data_model_aggregates.json")
+    observation_aggregates.rebuild(json.loads(aggregated_data.toJSON())["observations"])
+    observation_aggregates.save()
 
 
 class CORSRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Images of an ImageStore or TileStore, named by content hash, never change
+    immutable_path = re.compile(r"/(objects|tiles)/[0-9a-f]{2}/[0-9a-f]{16}\.png$")
+
     def end_headers(self):
         # Add CORS headers
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', '*')
+        # Content-addressed images are cached by the browser for good, the rest is revalidated
+        if self.immutable_path.search(self.path.split("?")[0]):
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        else:
+            self.send_header('Cache-Control', 'no-cache')
         http.server.SimpleHTTPRequestHandler.end_headers(self)
 
     def do_OPTIONS(self):
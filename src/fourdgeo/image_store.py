@@ -0,0 +1,211 @@
+import os
+import io
+import json
+import hashlib
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+from fourdgeo import manifest
+
+
+class ImageStore:
+    """
+    Content-addressed store of the background images of a data model.
+
+    Images are stored once under the hash of their pixels, so identical frames (e.g. the empty nights
+    of a time series) take the space of one image and are downloaded once. Optionally, an image that
+    differs from the previous one by at most a tolerance is replaced by it. An index maps the
+    observations (e.g. their startDateTime) to the hash of their image, an image being deleted when
+    no observation refers to it anymore. As the content of a path never changes, the images can be
+    served with immutable cache headers (see helpers.getting_started.CORSRequestHandler).
+
+    The index is a JSON lines log, like the JobManifest: each reference or release appends one line,
+    so a long series does not rewrite the whole index per image. The latest line of an observation
+    wins, a line truncated by a crash is ignored, and the log is compacted when it grows much longer
+    than the number of observations.
+
+    Methods:
+        - image_hash: Hash of the pixels of an image.
+        - put / put_array: Stores an image file or array, returns its hash.
+        - path / read: Path and content of a stored image.
+        - reference / release: Sets or removes the image of an observation, deleting unused images.
+        - refcount: Number of observations referring to an image.
+        - collect_garbage: Deletes the images no observation refers to.
+        - save: Rewrites the index log with one line per observation.
+    """
+
+    def __init__(self, folder, objects_folder="objects"):
+        """
+        :param folder: Folder of the store, holding the index and the images.
+        :param objects_folder: Subfolder of the images.
+        """
+        self.folder = folder
+        self.objects_folder = objects_folder
+        self.index_filename = os.path.join(folder, "index.jsonl")
+        # Hash of the image of each observation, and number of observations of each image
+        self.references = {}
+        n_lines = 0
+        # Whether the log ends with a truncated line, which the next line must not be appended to
+        self._truncated = False
+        if os.path.isfile(self.index_filename):
+            with open(self.index_filename, "r") as f:
+                for line in f:
+                    self._truncated = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    n_lines += 1
+                    if entry["hash"] is None:
+                        self.references.pop(entry["key"], None)
+                    else:
+                        self.references[entry["key"]] = entry["hash"]
+        self._counts = Counter(self.references.values())
+        if n_lines > 2 * len(self.references) + 16:
+            self.save()
+
+
+    def path(self, image_hash):
+        # Images are spread over subfolders named by the first characters of their hash
+        return os.path.join(self.folder, self.objects_folder, image_hash[:2], f"{image_hash}.png")
+
+
+    def read(self, image_hash):
+        with Image.open(self.path(image_hash)) as im:
+            return np.array(im)
+
+
+    @staticmethod
+    def image_hash(image):
+        """
+        Hash of the pixels of an image, independent of the encoding of the file.
+        :param image: uint8 image array of shape (h, w) or (h, w, bands).
+        :return: The first 16 characters of the SHA-256 hex digest.
+        """
+        image = np.ascontiguousarray(image)
+        digest = hashlib.sha256(str(image.shape).encode())
+        digest.update(image.data)
+        return digest.hexdigest()[:16]
+
+
+    def put_array(self, image, key=None):
+        """
+        Store an image array as PNG, unless an image with the same pixels is already stored.
+        :param image: uint8 image of shape (h, w) or (h, w, 3).
+        :param key: Optional observation key, whose image becomes this one (see reference).
+        :return: The hash of the image.
+        """
+        image_hash = self.image_hash(image)
+        filename = self.path(image_hash)
+        if not os.path.isfile(filename):
+            buffer = io.BytesIO()
+            Image.fromarray(np.ascontiguousarray(image)).save(buffer, format="PNG")
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with manifest.atomic_output(filename) as tmp_filename:
+                with open(tmp_filename, "wb") as f:
+                    f.write(buffer.getvalue())
+        if key is not None:
+            self.reference(key, image_hash)
+        return image_hash
+
+
+    def put(self, filename, key=None, previous=None, tolerance=0):
+        """
+        Store an image file and remove it.
+        :param filename: Path of the image, e.g. a projected background image.
+        :param key: Optional observation key, whose image becomes this one (see reference).
+        :param previous: Optional hash of the previous image of the series.
+        :param tolerance: If the mean absolute difference of the pixels to the previous image is at
+            most tolerance, the previous image is used instead. 0 to only merge identical images.
+        :return: The hash of the stored image.
+        """
+        with Image.open(filename) as im:
+            image = np.array(im)
+        near_previous = False
+        if tolerance > 0 and previous is not None and os.path.isfile(self.path(previous)):
+            previous_image = self.read(previous)
+            near_previous = (
+                previous_image.shape == image.shape
+                and np.mean(np.abs(previous_image.astype(np.int16) - image)) <= tolerance
+            )
+        image_hash = previous if near_previous else self.put_array(image)
+        os.remove(filename)
+        if key is not None:
+            self.reference(key, image_hash)
+        return image_hash
+
+
+    def refcount(self, image_hash):
+        return self._counts[image_hash]
+
+
+    def reference(self, key, image_hash):
+        """
+        Set the image of an observation. Its previous image is deleted if no observation refers to it.
+        """
+        previous = self.references.get(key)
+        if previous == image_hash:
+            return
+        self.references[key] = image_hash
+        self._counts[image_hash] += 1
+        if previous is not None:
+            self._counts[previous] -= 1
+            self._delete_unused(previous)
+        self._append({"key": key, "hash": image_hash})
+
+
+    def release(self, key):
+        """
+        Remove an observation. Its image is deleted if no other observation refers to it.
+        """
+        image_hash = self.references.pop(key, None)
+        if image_hash is not None:
+            self._counts[image_hash] -= 1
+            self._delete_unused(image_hash)
+            self._append({"key": key, "hash": None})
+
+
+    def _delete_unused(self, image_hash):
+        if self.refcount(image_hash) == 0:
+            del self._counts[image_hash]
+            if os.path.isfile(self.path(image_hash)):
+                os.remove(self.path(image_hash))
+
+
+    def collect_garbage(self):
+        """
+        Delete the stored images that no observation refers to, e.g. after the index was edited.
+        :return: The number of deleted images.
+        """
+        used = set(self.references.values())
+        removed = 0
+        objects_folder = os.path.join(self.folder, self.objects_folder)
+        if not os.path.isdir(objects_folder):
+            return removed
+        for folder, _, filenames in os.walk(objects_folder):
+            for filename in filenames:
+                if os.path.splitext(filename)[0] not in used:
+                    os.remove(os.path.join(folder, filename))
+                    removed += 1
+        return removed
+
+
+    def _append(self, entry):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.index_filename, "a") as f:
+            if self._truncated:
+                f.write("\n")
+                self._truncated = False
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+    def save(self):
+        """Rewrite the index log atomically, with one line per observation."""
+        os.makedirs(self.folder, exist_ok=True)
+        with manifest.atomic_output(self.index_filename) as tmp_filename:
+            with open(tmp_filename, "w") as f:
+                for key, image_hash in sorted(self.references.items()):
+                    f.write(json.dumps({"key": key, "hash": image_hash}, sort_keys=True) + "\n")
+        self._truncated = False
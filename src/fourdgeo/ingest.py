@@ -0,0 +1,326 @@
+import os
+import glob
+import json
+import time
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+
+from fourdgeo import projection, change, utilities, manifest, aggregates, image_store
+
+
+logger = logging.getLogger(__name__)
+
+
+def m3c2_change_detector(m3c2_settings, dbscan_eps, min_cluster_size, vertex_budget=None):
+    """
+    Create the default change detector of IngestService: M3C2 between two epochs, significance
+    filtering, DBSCAN clustering and geoObject extraction, as in the rockfall notebook.
+    :param m3c2_settings: Dictionary with the "cyl_radius", "normal_radii", "max_distance" and
+        "registration_error" M3C2 settings.
+    :param dbscan_eps: The DBSCAN eps of cluster_m3c2_changes.
+    :param min_cluster_size: The minimum cluster size of cluster_m3c2_changes.
+    :param vertex_budget: Passed to extract_geoObjects_from_clusters.
+    :return: A function (prev_path, curr_path, endDateTime) -> list of geoObjects.
+    """
+    def detect_changes(prev_path, curr_path, endDateTime):
+        # py4dgeo is only needed by this detector
+        import py4dgeo
+
+        # Absolute paths, so py4dgeo does not look for the files in its test data
+        epoch_0 = py4dgeo.read_from_las(os.path.abspath(prev_path))
+        epoch_1 = py4dgeo.read_from_las(os.path.abspath(curr_path))
+        m3c2 = py4dgeo.M3C2(
+            epochs=(epoch_0, epoch_1),
+            corepoints=epoch_0.cloud,
+            cyl_radius=m3c2_settings["cyl_radius"],
+            normal_radii=m3c2_settings["normal_radii"],
+            max_distance=m3c2_settings["max_distance"],
+            registration_error=m3c2_settings["registration_error"],
+        )
+        distances, uncertainties = m3c2.run()
+
+        significant_changes = change.filter_significant_changes(epoch_0.cloud, distances, uncertainties)
+        if significant_changes.shape[0] == 0:
+            return []
+        labeled = change.cluster_m3c2_changes(significant_changes, dbscan_eps, min_cluster_size)
+        geoObjects = change.extract_geoObjects_from_clusters(
+            labeled, endDateTime, os.path.basename(prev_path), os.path.basename(curr_path),
+            vertex_budget=vertex_budget
+        )
+        return geoObjects or []
+
+    return detect_changes
+
+
+class IngestService:
+    """
+    Directory watcher that projects and publishes new epochs as they land.
+
+    The watched folder is polled for new .las/.laz files. A file is processed once its size and
+    modification time have not changed for settle_time seconds, so that files still being written
+    are skipped. Each new epoch is projected on the reference grid of the first epoch, compared to
+    the previous epoch with the change detector, and appended to the data model file. The reference
+    grid and the processed epochs are kept in a state file, so the service can be restarted. A file
+    that fails is logged and retried at the next polls, up to max_attempts times, after which it is
+    quarantined until it is replaced. The png images are kept in an ImageStore, and the aggregates
+    of the Chart module are updated next to the data model (see ObservationAggregates).
+
+    Methods:
+        - poll_once: Processes the files that are ready, returns the processed paths.
+        - run_forever: Polls the folder until stop is called.
+        - stop: Stops run_forever after the current poll.
+        - process_epoch: Projects one epoch, detects changes and updates the data model.
+        - record_failure: Records a failed epoch, quarantining it after max_attempts failures.
+    """
+
+    def __init__(
+        self,
+        configuration,
+        watch_folder,
+        change_detector=None,
+        poll_interval=5.0,
+        settle_time=10.0,
+        buffer_m=0.5,
+        image_base_url=None,
+        patterns=("*.las", "*.laz"),
+        max_attempts=3
+    ):
+        ##############################
+        ### INITIALIZING VARIABLES ###
+        self.configuration = configuration
+        self.watch_folder = watch_folder
+        self.change_detector = change_detector
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.buffer_m = buffer_m
+        self.image_base_url = image_base_url
+        self.patterns = patterns
+        self.max_attempts = max_attempts
+        self.project_name = configuration["project_setting"]["project_name"]
+        self.output_folder = configuration["project_setting"]["output_folder"]
+        self.data_model_path = os.path.join(self.output_folder, "data_model.json")
+        self.state_path = os.path.join(self.output_folder, "ingest_state.json")
+        self.aggregates_path = os.path.join(self.output_folder, "data_model_aggregates.json")
+        self._pending = {}
+        self._running = False
+        ##############################
+
+        if not os.path.isdir(self.output_folder):
+            os.makedirs(self.output_folder)
+        self.state = utilities.read_json_file(self.state_path) if os.path.isfile(self.state_path) else None
+        if self.state is None:
+            self.state = {"reference": None, "processed": [], "previous_epoch": None}
+        # Failed files, with their number of attempts, last error and signature
+        self.state.setdefault("failed", {})
+        # Set of the processed filenames, stored as a sorted list
+        self.processed = set(self.state["processed"])
+        self.aggregates = aggregates.ObservationAggregates(self.aggregates_path)
+        # The png images are stored by content hash, as in convert_point_cloud_time_series_to_datamodel
+        self.images = image_store.ImageStore(
+            configuration["project_setting"].get("image_store", os.path.join(self.output_folder, "images"))
+        )
+        self.image_tolerance = configuration["project_setting"].get("image_tolerance", 0)
+
+
+    def poll_once(self):
+        """Process the new files that are ready, in filename order, and return their paths."""
+        now = time.time()
+        candidates = set()
+        for pattern in self.patterns:
+            candidates.update(glob.glob(os.path.join(self.watch_folder, pattern)))
+
+        ready = []
+        for path in sorted(candidates):
+            if os.path.basename(path) in self.processed:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            failure = self.state["failed"].get(os.path.basename(path))
+            # Quarantined files are skipped until they are replaced
+            if failure is not None and failure["attempts"] >= self.max_attempts and tuple(failure["signature"]) == signature:
+                continue
+            # Debounce: wait until the file has stopped changing for settle_time seconds
+            if self._pending.get(path, (None, None))[0] != signature:
+                self._pending[path] = (signature, now)
+            elif now - self._pending[path][1] >= self.settle_time and now - stat.st_mtime >= self.settle_time:
+                ready.append(path)
+
+        processed = []
+        for path in ready:
+            self._pending.pop(path, None)
+            try:
+                self.process_epoch(path)
+            except Exception as error:
+                # A corrupt or truncated file must not stop the service
+                self.record_failure(path, error)
+                continue
+            processed.append(path)
+        return processed
+
+
+    def record_failure(self, pc_path, error):
+        """
+        Record a failed epoch in the state. It is retried at the next polls, and quarantined after
+        max_attempts failures until the file is replaced.
+        """
+        name = os.path.basename(pc_path)
+        try:
+            stat = os.stat(pc_path)
+            signature = [stat.st_size, stat.st_mtime]
+        except FileNotFoundError:
+            signature = None
+        failure = self.state["failed"].get(name)
+        if failure is None or failure["signature"] != signature:
+            failure = {"attempts": 0, "signature": signature}
+        failure["attempts"] += 1
+        failure["error"] = f"{type(error).__name__}: {error}"
+        self.state["failed"][name] = failure
+        self.save_state()
+        if failure["attempts"] >= self.max_attempts:
+            logger.error("Quarantined %s after %d failed attempts: %s", pc_path, failure["attempts"], failure["error"], exc_info=error)
+        else:
+            logger.warning("Failed to process %s (attempt %d): %s", pc_path, failure["attempts"], failure["error"], exc_info=error)
+
+
+    def save_state(self):
+        self.state["processed"] = sorted(self.processed)
+        self._write_json(self.state_path, self.state)
+
+
+    def run_forever(self):
+        """Poll the watched folder every poll_interval seconds until stop is called."""
+        self._running = True
+        while self._running:
+            self.poll_once()
+            time.sleep(self.poll_interval)
+
+
+    def stop(self):
+        self._running = False
+
+
+    def process_epoch(self, pc_path):
+        """
+        Project one epoch on the reference grid, detect the changes to the previous epoch and append
+        the observation to the data model.
+        :param pc_path: Path of the new .las/.laz file.
+        :return: The appended observation, as a dictionary.
+        """
+        dateTime = self.epoch_datetime(pc_path)
+        configuration = json.loads(json.dumps(self.configuration))
+        configuration["pc_projection"]["pc_path"] = str(pc_path)
+
+        # Project the new epoch only, on the stored reference grid
+        background_projection = projection.PCloudProjection(
+            configuration=configuration,
+            project_name=f"{self.project_name}_{dateTime.replace(':', '-')}",
+            projected_image_folder=self.output_folder,
+        )
+        reference = self.state["reference"]
+        if reference is None:
+            h_fov, v_fov, anchor_point_xyz, h_img_res, v_img_res = background_projection.project_pc(buffer_m=self.buffer_m)
+            self.state["reference"] = {
+                "h_fov": [float(value) for value in h_fov],
+                "v_fov": [float(value) for value in v_fov],
+                "anchor_point_xyz": np.asarray(anchor_point_xyz, dtype=float).tolist(),
+                "h_img_res": int(h_img_res),
+                "v_img_res": int(v_img_res),
+            }
+        else:
+            background_projection.project_pc(
+                ref_theta=reference["h_fov"][0],
+                ref_phi=reference["v_fov"][0],
+                ref_anchor_point_xyz=reference["anchor_point_xyz"],
+                ref_h_fov=tuple(reference["h_fov"]),
+                ref_v_fov=tuple(reference["v_fov"]),
+                ref_h_img_res=reference["h_img_res"],
+                ref_v_img_res=reference["v_img_res"]
+            )
+        bg_img = background_projection.bg_image_filename[0]
+        png_image = os.path.splitext(bg_img)[0] + ".png"
+        width, height = utilities.tif_to_png(bg_img, png_image)
+        image_hash = self.images.put(
+            png_image, key=dateTime, previous=self.state.get("image_hash"), tolerance=self.image_tolerance
+        )
+        png_image = self.images.path(image_hash)
+
+        # Detect the changes to the previous epoch
+        previous_epoch = self.state["previous_epoch"]
+        geoObjects = []
+        if previous_epoch is not None and self.change_detector is not None:
+            geoObjects = self.change_detector(previous_epoch["path"], str(pc_path), dateTime) or []
+        startDateTime = previous_epoch["dateTime"] if previous_epoch is not None else dateTime
+
+        # Tile manifest of the incremental background images ("incremental_tiles")
+        tiles_file = getattr(background_projection, "tile_manifest_filename", None)
+        image_data = utilities.ImageData(
+            self.image_url(png_image), width, height, tiles=self.image_url(tiles_file) if tiles_file else None
+        )
+        if geoObjects:
+            observation = {"startDateTime": startDateTime, "endDateTime": dateTime, "geoObjects": geoObjects}
+            observation_projection = projection.ProjectChange(
+                observation=observation,
+                project_name=os.path.splitext(os.path.basename(bg_img))[0],
+                projected_image_path=bg_img,
+                projected_events_folder=self.output_folder,
+            )
+            observation_projection.project_change()
+            geojson_data = utilities.read_json_file(observation_projection.geojson_name)
+            new_observations = utilities.convert_geojson_to_datamodel(
+                geojson=geojson_data, bg_img=image_data.url, width=width, height=height
+            ).observations
+            for new_observation in new_observations:
+                new_observation.backgroundImageData = image_data
+        else:
+            new_observations = [utilities.Observation(startDateTime, dateTime, [], image_data)]
+        new_observations = json.loads(utilities.DataModel(new_observations).toJSON())["observations"]
+
+        self.append_to_data_model(new_observations)
+        self.state["previous_epoch"] = {"path": str(pc_path), "dateTime": dateTime}
+        self.state["image_hash"] = image_hash
+        self.processed.add(os.path.basename(pc_path))
+        self.state["failed"].pop(os.path.basename(pc_path), None)
+        self.save_state()
+        return new_observations[-1]
+
+
+    def epoch_datetime(self, pc_path):
+        # Timestamp from a "%y%m%d_%H%M%S" filename, or from the modification time otherwise
+        try:
+            return utilities.iso_timestamp(os.path.basename(pc_path)) + "Z"
+        except ValueError:
+            timestamp = datetime.fromtimestamp(os.path.getmtime(pc_path), tz=timezone.utc).replace(tzinfo=None)
+            return timestamp.isoformat() + "Z"
+
+
+    def image_url(self, image_path):
+        if self.image_base_url is None:
+            return image_path.replace("\\", "/")
+        return self.image_base_url.rstrip("/") + "/" + os.path.relpath(image_path).replace("\\", "/")
+
+
+    def append_to_data_model(self, observations):
+        data_model = utilities.read_json_file(self.data_model_path) if os.path.isfile(self.data_model_path) else None
+        if data_model is None:
+            data_model = {"observations": []}
+        data_model["observations"].extend(observations)
+        self._write_json(self.data_model_path, data_model)
+
+        # Update the aggregates of the Chart module, rebuilt if they do not match the data model
+        if len(self.aggregates.data["observations"]) + len(observations) != len(data_model["observations"]):
+            self.aggregates.rebuild(data_model["observations"])
+        else:
+            self.aggregates.append(observations, all_observations=data_model["observations"])
+        self.aggregates.save()
+
+
+    def _write_json(self, path, data):
+        # Replace the file atomically, so that the dashboard never reads a partial data model
+        with manifest.atomic_output(path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, sort_keys=True, indent=4)
@@ -0,0 +1,199 @@
+import os
+import json
+import uuid
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+def settings_hash(settings):
+    """
+    Hash of a settings dictionary, independent of the order of its keys.
+    :param settings: JSON serializable settings, values of other types are hashed as their str.
+    :return: The first 16 characters of the SHA-256 hex digest.
+    """
+    serialized = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def atomic_output(filename):
+    """
+    Write an output file atomically. The body writes to the yielded temporary path, which replaces
+    filename only if the body succeeds, so a crash never leaves a half-written output behind.
+    The temporary path keeps the extension of filename, so that writers can infer the format.
+    :param filename: The final path of the output.
+    """
+    root, ext = os.path.splitext(filename)
+    tmp_filename = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+    try:
+        yield tmp_filename
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+class JobManifest:
+    """
+    Manifest of the completed jobs of a batch run, stored as a JSON lines log, so that reruns can skip them.
+
+    A job is identified by a key (see epoch_job and pair_job) and recorded with the content hashes of
+    its input files, the hash of its settings, its output files and an optional JSON result. It counts
+    as complete only while all of these are unchanged and its outputs exist, so changing a parameter
+    or an input file redoes exactly the jobs that depend on it.
+
+    Each record or invalidation appends one line to the log, so saving a job does not rewrite the
+    whole manifest. The latest line of a job wins when the log is read. A line truncated by a crash
+    is ignored, and the log is compacted to one line per job when it grows much longer than that.
+
+    Methods:
+        - epoch_job / pair_job: Key of the job of one epoch or one epoch pair.
+        - file_hash: Content hash of an input file, cached by size and modification time.
+        - is_complete: Whether a job is recorded with the same inputs and settings.
+        - result / outputs: The recorded result and outputs of a job.
+        - record: Records a completed job and appends it to the log.
+        - invalidate: Forgets a job.
+        - save: Rewrites the log with one line per job.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.jobs = {}
+        self.file_hashes = {}
+        n_lines = 0
+        # Whether the log ends with a truncated line, which the next line must not be appended to
+        self._truncated = False
+        if os.path.isfile(filename):
+            with open(filename, "r") as f:
+                for line in f:
+                    self._truncated = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    n_lines += 1
+                    self.file_hashes.update(entry.get("file_hashes", {}))
+                    if "job" not in entry:
+                        continue
+                    if entry["entry"] is None:
+                        self.jobs.pop(entry["job"], None)
+                    else:
+                        self.jobs[entry["job"]] = entry["entry"]
+        if n_lines > 2 * len(self.jobs) + 16:
+            self.save()
+
+
+    @staticmethod
+    def epoch_job(pc_path):
+        return f"epoch:{os.path.basename(pc_path)}"
+
+
+    @staticmethod
+    def pair_job(pc_path_0, pc_path_1):
+        return f"pair:{os.path.basename(pc_path_0)}:{os.path.basename(pc_path_1)}"
+
+
+    def file_hash(self, filename, chunk_size=1 << 24):
+        """
+        SHA-256 of the content of a file. Files are only rehashed when their size or modification
+        time changed since the last run.
+        :param filename: Path of the file.
+        :param chunk_size: Number of bytes read at once.
+        :return: The first 16 characters of the SHA-256 hex digest.
+        """
+        stat = os.stat(filename)
+        key = os.path.abspath(filename)
+        cached = self.file_hashes.get(key)
+        if cached is not None and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["hash"]
+
+        digest = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        file_hash = digest.hexdigest()[:16]
+        self.file_hashes[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash}
+        return file_hash
+
+
+    def _input_hashes(self, inputs):
+        return {os.path.basename(str(filename)): self.file_hash(filename) for filename in inputs}
+
+
+    def is_complete(self, job, inputs, settings):
+        """
+        Whether a job was completed with the same input files and settings, and its outputs still exist.
+        :param job: The job key.
+        :param inputs: List of the input file paths.
+        :param settings: JSON serializable settings of the job.
+        :return: True if the job can be skipped.
+        """
+        entry = self.jobs.get(job)
+        if entry is None:
+            return False
+        if entry["settings"] != settings_hash(settings):
+            return False
+        if entry["inputs"] != self._input_hashes(inputs):
+            return False
+        return all(os.path.isfile(filename) for filename in entry["outputs"])
+
+
+    def result(self, job):
+        return self.jobs[job]["result"]
+
+
+    def outputs(self, job):
+        return self.jobs[job]["outputs"]
+
+
+    def record(self, job, inputs, settings, outputs, result=None):
+        """
+        Record a completed job and append it to the log. Call it only after all outputs are written.
+        :param job: The job key.
+        :param inputs: List of the input file paths.
+        :param settings: JSON serializable settings of the job.
+        :param outputs: List of the output file paths.
+        :param result: JSON serializable result, returned by result() when the job is skipped.
+        """
+        self.jobs[job] = {
+            "inputs": self._input_hashes(inputs),
+            "settings": settings_hash(settings),
+            "outputs": [str(filename) for filename in outputs],
+            "result": result,
+            "completed": datetime.now(timezone.utc).isoformat(),
+        }
+        # The cached hashes of the inputs are logged with the job
+        file_hashes = {os.path.abspath(filename): self.file_hashes[os.path.abspath(filename)] for filename in inputs}
+        self._append({"job": job, "entry": self.jobs[job], "file_hashes": file_hashes})
+
+
+    def invalidate(self, job):
+        if self.jobs.pop(job, None) is not None:
+            self._append({"job": job, "entry": None})
+
+
+    def _make_folder(self):
+        folder = os.path.dirname(self.filename)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+
+    def _append(self, entry):
+        self._make_folder()
+        with open(self.filename, "a") as f:
+            if self._truncated:
+                f.write("\n")
+                self._truncated = False
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+    def save(self):
+        """Rewrite the log atomically, with one line per job and the cached hashes of the input files."""
+        self._make_folder()
+        with atomic_output(self.filename) as tmp_filename:
+            with open(tmp_filename, "w") as f:
+                f.write(json.dumps({"file_hashes": self.file_hashes}, sort_keys=True) + "\n")
+                for job, entry in self.jobs.items():
+                    f.write(json.dumps({"job": job, "entry": entry}, sort_keys=True) + "\n")
+        self._truncated = False
@@ -0,0 +1,127 @@
+import os
+import json
+
+import numpy as np
+import cv2
+import laspy
+import rasterio
+
+from fourdgeo import raster_change
+
+
+class PointIndexLookup:
+    """
+    Click-through from the projected images to the points of the point cloud.
+
+    Reads the point index saved by PCloudProjection.save_point_index and answers which point lies
+    under a pixel or inside a polygon with one array lookup per pixel, without reprojecting the
+    point cloud or searching a KD-tree. The point records are read from the memory-mapped point
+    store (.npy) when it was saved, otherwise from the point cloud file.
+
+    Pixels are given either as projection indices (u, v), as in PCloudProjection.main_projection,
+    or in the pixel coordinates of the GeoJSON files of ProjectChange, (x, y) = (v_img_res - v, -u),
+    which are the coordinates of the dashboard.
+
+    Methods:
+        - point_indices: Index in the point cloud file of the point of each pixel, -1 if empty.
+        - lookup_pixels: Points of pixels given as (u, v).
+        - lookup_image_pixels: Points of pixels given in the GeoJSON pixel coordinates.
+        - lookup_polygon: Points of all the pixels inside a polygon in the GeoJSON pixel coordinates.
+    """
+
+    def __init__(self, filename, point_store=None):
+        """
+        :param filename: The _PointIndex.tif or _PointIndex.npz file.
+        :param point_store: Path of the point store. Defaults to the one recorded in the index, or
+            the point cloud file if none was saved.
+        """
+        if os.path.splitext(filename)[1].lower() == ".npz":
+            with np.load(filename) as data:
+                self.tags = json.loads(str(data["tags"]))
+                self.grid = raster_change.grid_from_tags(self.tags)
+                self.index = np.full((self.grid["h_img_res"], self.grid["v_img_res"]), -1, dtype=data["index"].dtype)
+                self.index[data["u"], data["v"]] = data["index"]
+        else:
+            with rasterio.open(filename) as src:
+                self.tags = src.tags()
+                # The raster is flipped left to right like the shaded images
+                self.index = np.fliplr(src.read(1))
+            self.grid = raster_change.grid_from_tags(self.tags)
+
+        self.scales = np.array([float(self.tags[f"point_scale_{axis}"]) for axis in "xyz"])
+        self.offsets = np.array([float(self.tags[f"point_offset_{axis}"]) for axis in "xyz"])
+        if point_store is None:
+            point_store = self.tags.get("point_store")
+        if point_store is not None and os.path.isfile(point_store):
+            self.points = np.load(point_store, mmap_mode="r")
+        else:
+            with laspy.open(self.tags["pc_path"]) as las_file:
+                self.points = las_file.read().points.array
+
+
+    def point_indices(self, u, v):
+        """
+        :param u: Row (horizontal angle) indices of the pixels.
+        :param v: Column (vertical angle) indices of the pixels.
+        :return: The index of the point of each pixel in the point cloud file, -1 for empty pixels
+            and pixels outside the image.
+        """
+        u, v = np.atleast_1d(u).astype(int), np.atleast_1d(v).astype(int)
+        inside = (u >= 0) & (u < self.index.shape[0]) & (v >= 0) & (v < self.index.shape[1])
+        indices = np.full(u.shape, -1, dtype=np.int64)
+        indices[inside] = self.index[u[inside], v[inside]]
+        return indices
+
+
+    def lookup_pixels(self, u, v):
+        """
+        Points of pixels given as projection indices.
+        :param u: Row (horizontal angle) indices of the pixels.
+        :param v: Column (vertical angle) indices of the pixels.
+        :return: Dictionary with, for the pixels holding a point, their "u" and "v", the "index" of
+            the point in the point cloud file, its "xyz" coordinates and its "attributes" (the point
+            records, with all the dimensions of the file).
+        """
+        u, v = np.atleast_1d(u).astype(int), np.atleast_1d(v).astype(int)
+        indices = self.point_indices(u, v)
+        found = indices >= 0
+        indices = indices[found]
+        # Sorted reads are faster on the memory-mapped store
+        order = np.argsort(indices, kind="stable")
+        records = np.empty(indices.shape[0], dtype=self.points.dtype)
+        records[order] = self.points[indices[order]]
+        xyz = np.c_[records["X"], records["Y"], records["Z"]] * self.scales + self.offsets
+        return {"u": u[found], "v": v[found], "index": indices, "xyz": xyz, "attributes": records}
+
+
+    def image_to_uv(self, x, y):
+        # Inverse of the pixel coordinates of ProjectChange.project_change
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        return np.round(-y).astype(int), np.round(self.grid["v_img_res"] - x).astype(int)
+
+
+    def lookup_image_pixels(self, x, y):
+        """
+        Points of pixels given in the GeoJSON pixel coordinates, see lookup_pixels.
+        """
+        return self.lookup_pixels(*self.image_to_uv(x, y))
+
+
+    def lookup_polygon(self, coordinates):
+        """
+        Points of all the pixels inside a polygon, e.g. the geometry of a geoObject in the pixel
+        GeoJSON file.
+        :param coordinates: The exterior ring of the polygon in the GeoJSON pixel coordinates.
+        :return: See lookup_pixels.
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        u, v = self.image_to_uv(coordinates[:, 0], coordinates[:, 1])
+        # Rasterize the polygon on its bounding box only
+        u_min, v_min = max(u.min(), 0), max(v.min(), 0)
+        u_max, v_max = min(u.max(), self.index.shape[0] - 1), min(v.max(), self.index.shape[1] - 1)
+        if u_min > u_max or v_min > v_max:
+            return self.lookup_pixels([], [])
+        mask = np.zeros((u_max - u_min + 1, v_max - v_min + 1), dtype=np.uint8)
+        cv2.fillPoly(mask, [np.c_[v - v_min, u - u_min].astype(np.int32)], 1)
+        mask_u, mask_v = np.nonzero(mask)
+        return self.lookup_pixels(mask_u + u_min, mask_v + v_min)
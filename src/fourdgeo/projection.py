@@ -3,21 +3,428 @@ import laspy
 import numpy as np
 import cv2
 import rasterio
-from fourdgeo import utilities, change
+from fourdgeo import utilities, change, geometry, manifest, tiles
 import pandas as pd
 
-import os
-import numpy as np
-from scipy.spatial import ConvexHull
 from shapely import Polygon, LineString, Point
-import rasterio
-from shapely.geometry import mapping, Polygon
-import fiona
+from shapely.geometry import mapping
 import json
-from xml.etree.ElementTree import Element, SubElement, tostring
-import xml.dom.minidom
-from pyproj import Transformer
+import io
+import tempfile
+import warnings
+import zipfile
+from xml.sax.saxutils import escape
 from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+
+###############################################
+# Functional core of the projection
+#
+# Stateless functions of arrays, shared by PCloudProjection and its subclasses. They never modify
+# their inputs, so several projections can run at once in threads: the heavy steps are NumPy and
+# OpenCV calls, which release the GIL.
+
+class _ScratchTracker:
+    # Peak of the bytes held by the shading temporaries alive at the tracked points, counting the
+    # arrays of held (the shading factors), or returned by held if it is a function, at every point
+    def __init__(self, held=()):
+        self.peak_bytes = 0
+        self.held = held
+
+    def __call__(self, *arrays):
+        held = self.held() if callable(self.held) else self.held
+        alive = {id(array): array for array in arrays + tuple(held) if array is not None}
+        self.peak_bytes = max(self.peak_bytes, sum(array.nbytes for array in alive.values()))
+
+
+def image_grid(camera_position, anchor_point_xyz, resolution_cm, top_view=False, buffer_m=0.0, h_fov=None, v_fov=None):
+    """
+    Image geometry of a projection, in the format of raster_change.projection_grid.
+    The angular resolution is the one of a pixel of resolution_cm at the anchor point. Without
+    h_fov and v_fov (e.g. those of a reference epoch), the field of view is fitted to the points by
+    project, extended by buffer_m.
+    :return: Dictionary with the fields of view, resolution, image size, camera position, anchor
+        point, view and buffer.
+    """
+    # Range between camera and the mean point of the point cloud
+    range = np.sqrt(
+        (
+            (camera_position[0] - anchor_point_xyz[0]) ** 2
+            + (camera_position[1] - anchor_point_xyz[1]) ** 2
+            + (camera_position[2] - anchor_point_xyz[2]) ** 2
+        )
+    )
+    # Getting vertical and horizontal resolutions in degrees. Both calculated with the range and the pixel dimension
+    alpha_rad = np.arctan2(resolution_cm / 100, range)
+    grid = {
+        "h_fov": None,
+        "v_fov": None,
+        "res": np.rad2deg(alpha_rad),
+        "h_img_res": None,
+        "v_img_res": None,
+        "camera_position": camera_position,
+        "anchor_point_xyz": anchor_point_xyz,
+        "top_view": top_view,
+        "buffer_deg": np.rad2deg(np.arctan2(buffer_m, range)),
+    }
+    if h_fov is not None and v_fov is not None:
+        grid = fit_image_grid(dict(grid, h_fov=h_fov, v_fov=v_fov), None, None)
+    return grid
+
+
+def fit_image_grid(grid, theta_range, phi_range):
+    """
+    Complete an image geometry of image_grid with the field of view of the points and the image size.
+    :param grid: The image geometry. Its field of view is kept if set.
+    :param theta_range: Minimum and maximum horizontal angle of the points, in degrees.
+    :param phi_range: Minimum and maximum vertical angle of the points, in degrees.
+    :return: A new dictionary, the grid is not modified.
+    """
+    h_fov, v_fov = grid["h_fov"], grid["v_fov"]
+    if h_fov is None or v_fov is None:
+        h_fov = (np.floor(theta_range[0] - grid["buffer_deg"]), np.ceil(theta_range[1] + grid["buffer_deg"]))
+        v_fov = (np.floor(phi_range[0] - grid["buffer_deg"]), np.ceil(phi_range[1] + grid["buffer_deg"]))
+    return dict(
+        grid, h_fov=h_fov, v_fov=v_fov,
+        h_img_res=int((h_fov[1] - h_fov[0]) / grid["res"]),
+        v_img_res=int((v_fov[1] - v_fov[0]) / grid["res"])
+    )
+
+
+def projection_angles(xyz, camera_position, scan_angles=None):
+    """
+    Range and angles of the points seen from the camera.
+    :param xyz: Array of the points with shape (n, 3), already rotated for a top view.
+    :param camera_position: Position of the camera.
+    :param scan_angles: Optional (theta, phi) scanner-native angles of the points in degrees, used
+        instead of the spherical conversion.
+    :return: The range, and the horizontal and vertical angles in degrees, shifted to [0, 360) when
+        the points wrap around ±180°.
+    """
+    # Coordinates relative to the camera, a new array so the points are left untouched
+    xyz = np.subtract(xyz, camera_position)
+    if scan_angles is not None:
+        # The angles stored by the scanner are used as they are, only the radius is computed
+        r = np.sqrt(np.einsum("ij,ij->i", xyz, xyz))
+        theta_deg, phi_deg = (np.array(angles, dtype=np.float64) for angles in scan_angles)
+    else:
+        # Get spherical coordinates
+        r, theta, phi = utilities.xyz_2_spherical(xyz)  # Outputs r, theta (radians), phi (radians)
+        # Convert radians to degrees
+        theta_deg, phi_deg = np.rad2deg(theta), np.rad2deg(phi)
+
+    # Discretize angles to image coordinates
+    for angles in (theta_deg, phi_deg):
+        if angles.shape[0] and (np.floor(angles.min()) == -180 or np.floor(angles.max()) == 180):
+            angles[angles < 0] += 360
+    return r, theta_deg, phi_deg
+
+
+def closest_point_per_pixel(u, v, r, grid, zbuffer=False):
+    """
+    Select the point with the smallest range at each pixel.
+    :param u: Row indices of the points.
+    :param v: Column indices of the points.
+    :param r: Range of the points.
+    :param grid: The image geometry.
+    :param zbuffer: Whether the sort-free z-buffer is used. Otherwise the first point of smallest
+        range of each pixel is kept.
+    :return: Boolean mask of the selected points. Points outside of the image, e.g. within half a
+        pixel of the upper edge of a fitted field of view, are discarded.
+    """
+    h_img_res, v_img_res = grid["h_img_res"], grid["v_img_res"]
+    inside = (u >= 0) & (u < h_img_res) & (v >= 0) & (v < v_img_res)
+    if zbuffer:
+        # The minimum radius of each pixel is scattered into a flat z-buffer, and a point is kept
+        # if its radius equals the one of its pixel
+        flat_index = np.where(inside, u * v_img_res + v, 0)
+
+        buffer = np.full(h_img_res * v_img_res, np.inf)
+        np.minimum.at(buffer, flat_index[inside], r[inside])
+        return inside & (r == buffer[flat_index])
+
+    df = pd.DataFrame({'u': u[inside], 'v': v[inside], 'r': r[inside]})
+    df['idx'] = np.flatnonzero(inside)
+    min_idx = df.loc[df.groupby(['u', 'v'])['r'].idxmin(), 'idx'].values
+    selected = np.zeros(len(u), dtype=bool)
+    selected[min_idx] = True
+    return selected
+
+
+def shading_factors(u, v, r, shape, camera_position, anchor_point_xyz, rgb_light_intensity,
+                    make_color_image=True, make_range_image=True, track_scratch=None):
+    """
+    Lambertian shading factors of the color and range images.
+    The normalised range is rasterised once in float32 and the factors of both outputs are derived
+    from its gradients. The (h, v, 3) normals n = (-dz_du, -dz_dv, 1) are never materialised: the
+    color image only needs |n| and the range image the sum of n / |n|.
+    :param u: Row indices of the pixels.
+    :param v: Column indices of the pixels.
+    :param r: Normalised range of the pixels.
+    :param shape: Shape (h, v) of the image.
+    :return: The color and the range shading factors of shape (h, v), None for the images not made.
+    """
+    track_scratch = track_scratch or _ScratchTracker()
+    z_img = np.zeros(shape, dtype=np.float32)
+    z_img[u, v] = r
+    dz_dv, dz_du = np.gradient(z_img)
+    track_scratch(z_img, dz_dv, dz_du)
+    del z_img
+
+    # Sum of the normal's components, before the gradients are overwritten
+    normals_sum = np.add(dz_du, dz_dv)
+    np.subtract(1.0, normals_sum, out=normals_sum)
+    track_scratch(dz_dv, dz_du, normals_sum)
+
+    # |n| = sqrt(dz_du² + dz_dv² + 1), computed in place of dz_du
+    norms = np.square(dz_du, out=dz_du)
+    norms += np.square(dz_dv, out=dz_dv)
+    norms += 1.0
+    np.sqrt(norms, out=norms)
+
+    color_shading = range_shading = None
+    if make_color_image:
+        # Light direction for the image to have the right shading
+        light_direction = np.abs(np.asarray(camera_position) - np.asarray(anchor_point_xyz))
+        light_direction = light_direction / np.linalg.norm(light_direction)  # Normalize
+        # Reuse the dz_dv buffer for the colour shading factor
+        color_shading = np.multiply(
+            norms, np.float32(np.sum(light_direction) * rgb_light_intensity), out=dz_dv
+        )
+        np.clip(color_shading, 0, 1, out=color_shading)
+    if make_range_image:
+        normals_sum /= norms
+        range_shading = normals_sum
+    return color_shading, range_shading
+
+
+def fill_empty_pixels(image, occupancy, kernel_size=3, track_scratch=None):
+    """
+    Fill the pixels that received no point with the mean of their occupied neighbours.
+
+    Normalized convolution: the sum of the occupied neighbours divided by their number, both
+    computed with a single box filter over all channels of the uint8/uint16 (or float) image.
+    Larger kernels close larger gaps. Pixels without any occupied neighbour stay empty.
+    This is the default hole filling of project_pc ("occupancy"). Its images differ from those of
+    earlier versions, which filled the black pixels of the color image only, from all their
+    neighbours: the color images differ around the empty pixels and dark points, and the range
+    images have fewer empty pixels. The "black_pixels" hole filling (see fill_black_pixels) makes
+    the images of earlier versions, for consumers comparing against them.
+    :param image: Image of shape (h, v) or (h, v, channels), filled in place.
+    :param occupancy: Boolean mask of shape (h, v), True where the pixel received a point.
+    :param kernel_size: Size of the square neighbourhood. Values below 2 disable the filling.
+    :return: The filled image.
+    """
+    if kernel_size is None or kernel_size < 2:
+        return image
+
+    weights = occupancy.view(np.uint8)
+    ksize = (int(kernel_size), int(kernel_size))
+    count = cv2.boxFilter(weights, cv2.CV_32F, ksize, normalize=False, borderType=cv2.BORDER_CONSTANT)
+    holes = (count > 0) & ~occupancy
+    if not holes.any():
+        return image
+
+    # Empty pixels must not contribute to the neighbour sums
+    image[~occupancy] = 0
+    sums = cv2.boxFilter(image, cv2.CV_32F, ksize, normalize=False, borderType=cv2.BORDER_CONSTANT)
+    if track_scratch is not None:
+        track_scratch(count, sums, holes)
+
+    if image.ndim == 3:
+        filled = sums[holes] / count[holes][:, np.newaxis]
+    else:
+        filled = sums[holes] / count[holes]
+    if np.issubdtype(image.dtype, np.integer):
+        filled = np.rint(filled)
+    image[holes] = filled
+
+    return image
+
+
+def fill_black_pixels(image, threshold=40):
+    """
+    Hole filling of the images of earlier versions, kept with the "black_pixels" hole filling for
+    consumers comparing against their images. Empty pixels are guessed from their color: the pixels
+    whose values are all at most threshold take the mean of their 8 neighbours, black or not, and
+    the values are truncated to uint8. Range images were not filled.
+    :param image: Image of shape (h, v, 3) or (h, v).
+    :param threshold: Largest value of a black pixel.
+    :return: A new uint8 image.
+    """
+    image = image.astype(np.float32)
+    # Mean of the 8 neighbours, excluding the center pixel
+    kernel = np.ones((3, 3), np.float32) / 8.0
+    kernel[1, 1] = 0
+    mean_image = cv2.filter2D(image, -1, kernel)
+    if image.ndim == 3:
+        black_pixels_mask = np.all(image <= threshold, axis=-1)
+    else:
+        black_pixels_mask = image <= threshold
+    image[black_pixels_mask] = mean_image[black_pixels_mask]
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def smooth_image(image):
+    """
+    Blur an image in place and flip it left to right, as the images are saved.
+    :return: The flipped image, a view of the input.
+    """
+    cv2.GaussianBlur(image, (3, 3), 0, dst=image)
+    return np.fliplr(image)
+
+
+def shade_color_image(u, v, colors, color_shading, occupancy, hole_filling_kernel_size=3, track_scratch=None,
+                      hole_filling="occupancy"):
+    """
+    Shaded, hole filled and smoothed color image.
+    :param colors: The (red, green, blue) uint8 values of the pixels.
+    :param hole_filling: "occupancy" fills the empty pixels from their occupied neighbours (see
+        fill_empty_pixels), "black_pixels" fills the black pixels as earlier versions (see fill_black_pixels).
+    :return: The uint8 image of shape (h, v, 3), flipped left to right.
+    """
+    color_image = np.zeros(occupancy.shape + (3,), dtype=np.uint8)
+    color_image[u, v, 0] = colors[0]
+    color_image[u, v, 1] = colors[1]
+    color_image[u, v, 2] = colors[2]
+
+    # Apply the shading factor to the color image
+    shaded_color_image = np.multiply(color_image, color_shading[..., np.newaxis], dtype=np.float32)
+    del color_image
+    np.clip(shaded_color_image, 0, 255, out=shaded_color_image)
+    if track_scratch is not None:
+        track_scratch(shaded_color_image, color_shading)
+    shaded_color_image = shaded_color_image.astype(np.uint8)
+    if hole_filling == "black_pixels":
+        shaded_color_image = fill_black_pixels(shaded_color_image)
+    else:
+        # Fill the pixels that received no point from their occupied neighbours
+        shaded_color_image = fill_empty_pixels(shaded_color_image, occupancy, hole_filling_kernel_size, track_scratch)
+    return smooth_image(shaded_color_image)
+
+
+def shade_range_image(u, v, r, range_shading, occupancy, range_light_intensity, hole_filling_kernel_size=3, track_scratch=None,
+                      hole_filling="occupancy"):
+    """
+    Shaded, hole filled and smoothed range image. All three bands of the range image are identical,
+    so a single band is made.
+    :param r: Normalised range of the pixels.
+    :param hole_filling: "occupancy" fills the empty pixels from their occupied neighbours,
+        "black_pixels" leaves them empty as earlier versions, see shade_color_image.
+    :return: The float32 image of shape (h, v), flipped left to right.
+    """
+    # Populate the range image with the radius (scanner to point distance)
+    shaded_range_image = np.zeros(occupancy.shape, dtype=np.float32)
+    shaded_range_image[u, v] = r + range_light_intensity
+
+    # Shade the range image with the normals, in place
+    shaded_range_image *= range_shading
+    np.clip(shaded_range_image, 0, 255, out=shaded_range_image)
+    if track_scratch is not None:
+        track_scratch(shaded_range_image, range_shading)
+    if hole_filling != "black_pixels":
+        # Fill the pixels that received no point from their occupied neighbours
+        shaded_range_image = fill_empty_pixels(shaded_range_image, occupancy, hole_filling_kernel_size, track_scratch)
+    return smooth_image(shaded_range_image)
+
+
+class ProjectionResult:
+    """
+    Output of project, the pixels of the projected points and the shaded images.
+
+    Attributes:
+        - grid: The image geometry, with the field of view fitted to the points if it was not set.
+        - index: Index in the input points of the point kept at each occupied pixel.
+        - u, v: Row and column of those pixels.
+        - range_m: Range of those points in metres.
+        - r: Range of those points normalised to [0, 255], as shaded in the images.
+        - color_image, range_image: The shaded images flipped left to right as they are saved, None
+          if not made.
+        - peak_scratch_bytes: The peak memory taken by the shading temporaries.
+
+    Methods:
+        - range_raster: The range in metres as an (h, v) image, NaN where empty.
+        - occupancy: The (h, v) mask of the pixels holding a point.
+    """
+
+    def __init__(self, grid, index, u, v, range_m, r):
+        self.grid = grid
+        self.index = index
+        self.u = u
+        self.v = v
+        self.range_m = range_m
+        self.r = r
+        self.color_image = None
+        self.range_image = None
+        self.peak_scratch_bytes = 0
+
+    def range_raster(self):
+        range_m = np.full((self.grid["h_img_res"], self.grid["v_img_res"]), np.nan, dtype=np.float32)
+        range_m[self.u, self.v] = self.range_m
+        return range_m
+
+    def occupancy(self):
+        occupancy = np.zeros((self.grid["h_img_res"], self.grid["v_img_res"]), dtype=bool)
+        occupancy[self.u, self.v] = True
+        return occupancy
+
+
+def project(points, grid, colors=None, scan_angles=None, make_color_image=None, make_range_image=True,
+            rgb_light_intensity=1.0, range_light_intensity=0.0, hole_filling_kernel_size=3, make_images=True,
+            hole_filling="occupancy"):
+    """
+    Project a point cloud into color and range images, without any state: the inputs are not
+    modified and everything is returned, so projections can run concurrently in a thread pool.
+    :param points: Array of the points with shape (n, 3), in the coordinates of the point cloud.
+    :param grid: The image geometry, see image_grid.
+    :param colors: The (red, green, blue) uint8 values of the points, needed for the color image.
+    :param scan_angles: Optional scanner-native (theta, phi) angles of the points in degrees.
+    :param make_color_image: Whether the color image is made. Defaults to whether colors are given.
+    :param make_images: False to stop after the selection of the pixels.
+    :param hole_filling: "occupancy" or "black_pixels", see shade_color_image.
+    :return: A ProjectionResult.
+    """
+    if make_color_image is None:
+        make_color_image = colors is not None
+    elif make_color_image and colors is None:
+        raise ValueError("The color image needs the colors of the points, pass colors or make_color_image=False")
+    xyz = np.asarray(points, dtype=np.float64)
+    if grid["top_view"]:
+        # Rotate the point cloud on the side instead of changing the camera view
+        xyz = utilities.rotate_to_top_view(xyz, *grid["anchor_point_xyz"])
+    r, theta_deg, phi_deg = projection_angles(xyz, grid["camera_position"], scan_angles)
+    grid = fit_image_grid(grid, (np.min(theta_deg), np.max(theta_deg)), (np.min(phi_deg), np.max(phi_deg)))
+
+    # Map angles to pixel indices
+    u = np.round((theta_deg - grid["h_fov"][0]) / grid["res"]).astype(int)
+    v = np.round((phi_deg - grid["v_fov"][0]) / grid["res"]).astype(int)
+    # At each pixel (u, v), we keep the point with the smallest radius (r)
+    index = np.flatnonzero(closest_point_per_pixel(u, v, r, grid, zbuffer=scan_angles is not None))
+    u, v, r = u[index], v[index], r[index]
+    result = ProjectionResult(grid, index, u, v, r, (r - np.min(r)) * 255 / np.max(r - np.min(r)))
+    if not make_images:
+        return result
+
+    track_scratch = _ScratchTracker()
+    occupancy = result.occupancy()
+    color_shading, range_shading = shading_factors(
+        u, v, result.r, occupancy.shape, grid["camera_position"], grid["anchor_point_xyz"],
+        rgb_light_intensity, make_color_image, make_range_image, track_scratch
+    )
+    track_scratch.held = (color_shading, range_shading)
+    if make_color_image:
+        result.color_image = shade_color_image(
+            u, v, tuple(color[index] for color in colors), color_shading, occupancy,
+            hole_filling_kernel_size, track_scratch, hole_filling
+        )
+    if make_range_image:
+        result.range_image = shade_range_image(
+            u, v, result.r, range_shading, occupancy, range_light_intensity,
+            hole_filling_kernel_size, track_scratch, hole_filling
+        )
+    result.peak_scratch_bytes = track_scratch.peak_bytes
+    return result
 
 
 class PCloudProjection:
@@ -34,13 +441,30 @@ class PCloudProjection:
         - __init__: Initializes the PCloudProjection class with configuration parameters.
         - project_pc: Main function to execute the projection process.
         - load_pc_file: Loads point cloud data from .las or .laz files.
-        - create_top_view: Rotates the point cloud for top-down projection.
-        - main_projection: Projects the point cloud into 2D image space.
-        - create_shading: Calculates surface normals for image shading.
+        - thin_point_cloud: Optional voxel thinning configured with "voxel_thinning".
+        - main_projection: Projects the point cloud into 2D image space (with the top view rotation).
+        - reference_grid / apply_grid: Image geometry of the configuration, set as attributes.
+        - min_range_per_pixel: Sort-free z-buffer used for scanner-native angles.
+        - fill_empty_pixels: Fills pixels without points from their occupied neighbours.
+        - create_shading: Calculates the shading factors from the surface normals.
         - apply_shading_to_color_img: Applies lighting effects to color images.
         - apply_shading_to_range_img: Applies lighting effects to range images.
         - apply_smoothing: Smoothens images using Gaussian blur.
         - save_image: Saves generated images with metadata.
+        - project_blocks: Sparse image backend, shades and saves the occupied blocks only.
+        - project_incremental: Shades and stores the tiles that changed since the previous epoch only.
+        - save_composed_image: Writes the full image of an incremental epoch from its tiles.
+        - range_raster: Raw range image and occupancy, also with the sparse image backend.
+        - save_raw_range: Saves the raw range in metres and the occupancy, configured with "raw_range_format".
+        - save_point_index: Saves the index of the point of each pixel, configured with "point_index_format".
+
+    The class is a wrapper around the stateless functions above (project and its steps), which
+    keeps the intermediate arrays as attributes for the outputs and the subclasses. An instance
+    projects one point cloud at a time, use one instance per thread or project directly.
+
+    The shading factors are computed once in float32 by create_shading and shared by the color
+    and range images. After project_pc, peak_scratch_bytes holds the peak memory taken by the
+    shading temporaries, the shading factors included.
     """
 
     def __init__(
@@ -61,6 +485,48 @@ class PCloudProjection:
         self.camera_position = configuration["pc_projection"]["camera_position"]
         self.rgb_light_intensity = configuration["pc_projection"]["rgb_light_intensity"]
         self.range_light_intensity = configuration["pc_projection"]["range_light_intensity"]
+        # Size of the neighbourhood used to fill empty pixels, larger values close larger gaps
+        self.hole_filling_kernel_size = configuration["pc_projection"].get("hole_filling_kernel_size", 3)
+        # "occupancy" fills the pixels without point in the color and range images. "black_pixels"
+        # makes the images of earlier versions, filling the black pixels of the color image only
+        self.hole_filling = configuration["pc_projection"].get("hole_filling", "occupancy")
+        if self.hole_filling not in ("occupancy", "black_pixels"):
+            raise ValueError(f"Unknown hole_filling {self.hole_filling!r}, expected 'occupancy' or 'black_pixels'")
+        # Names of the point attributes holding the scanner-native angles (theta, phi) in degrees,
+        # with the convention of utilities.xyz_2_spherical. Used instead of the spherical
+        # conversion when present in the point cloud, set to None to always convert
+        self.scan_angle_dims = configuration["pc_projection"].get("scan_angle_dims", ["theta", "phi"])
+        # Optional voxel thinning of the point cloud before the projection, e.g. {"mode": "nearest"}.
+        # The voxel size defaults to one pixel at the anchor point (see geometry.voxel_size_from)
+        self.voxel_thinning = configuration["pc_projection"].get("voxel_thinning", None)
+        self.reduction_ratio = 1.0
+        # Optional raster of the raw range in metres next to the shaded images: "float32" or "uint16"
+        # (scaled by raw_range_scale metres, see save_raw_range). None to skip it
+        self.raw_range_format = configuration["pc_projection"].get("raw_range_format", None)
+        self.raw_range_scale = configuration["pc_projection"].get("raw_range_scale", 0.001)
+        # Number of bands of the range image, 1 or 3 identical bands
+        self.range_image_bands = configuration["pc_projection"].get("range_image_bands", 3)
+        self.raw_range_filename = None
+        # Optional pixel to point index for the click-through from the images to the points: "raster"
+        # (GeoTIFF) or "coo" (sparse .npz sidecar), see save_point_index. None to skip it
+        self.point_index_format = configuration["pc_projection"].get("point_index_format", None)
+        # Whether the point records are also saved as a .npy file, memory-mapped by PointIndexLookup
+        self.point_store = configuration["pc_projection"].get("point_store", True)
+        self.point_index_filename = None
+        self.point_store_filename = None
+        # Optional block size in pixels of the sparse image backend, for mostly empty images: only the
+        # blocks holding points are shaded and stored (see project_blocks). None for dense images
+        self.sparse_block_size = configuration["pc_projection"].get("sparse_block_size", None)
+        self.tile_size = self.sparse_block_size
+        # Optional incremental background images of a static scene, published as content-addressed
+        # tiles, e.g. {"store": "out/tiles", "series": "beehive"} (see project_incremental). Only
+        # the tiles that changed since the previous epoch of the series are shaded and encoded
+        self.incremental_tiles = configuration["pc_projection"].get("incremental_tiles", None)
+        if self.incremental_tiles is not None:
+            self.tile_size = self.incremental_tiles.get("tile_size", 256)
+        self.tile_manifest_filename = None
+        # Pixels needed around a block: one for the gradients, the hole filling kernel and one for the blur
+        self.tile_halo = 2 + int(self.hole_filling_kernel_size or 0) // 2
         self.bg_image_filename = []
         ### INITIALIZING VARIABLES ###
         ##############################
@@ -86,22 +552,28 @@ class PCloudProjection:
         self.ref_v_img_res = ref_v_img_res
         self.buffer_m = buffer_m
 
+        self.scratch_tracker = self._new_scratch_tracker()
+
         self.load_pc_file()
-        if self.top_view:
-            self.xyz = utilities.rotate_to_top_view(
-                self.xyz, 
-                self.anchor_point_xyz[0], 
-                self.anchor_point_xyz[1], 
-                self.anchor_point_xyz[2]
-            )
         self.main_projection()
-        self.create_shading()
-        if self.make_color_image:
-            self.apply_shading_to_color_img()
-            self.save_image()
-        if self.make_range_image:
-            self.apply_shading_to_range_img()
-            self.save_image()
+        if self.incremental_tiles is not None:
+            self.project_incremental()
+        elif self.sparse_block_size:
+            self.project_blocks()
+        else:
+            self.create_shading()
+            if self.make_color_image:
+                self.apply_shading_to_color_img()
+                self.save_image()
+            if self.make_range_image:
+                self.apply_shading_to_range_img()
+                self.save_image()
+            # Release the shading factors shared by both outputs
+            self.color_shading = self.range_shading = None
+        if self.raw_range_format is not None:
+            self.save_raw_range()
+        if self.point_index_format is not None:
+            self.save_point_index()
 
         # Return all reference parameters
         return (
@@ -110,41 +582,23 @@ class PCloudProjection:
         )
 
 
-    # Define a function to remove isolated black pixels - Only for RGB image
-    def remove_isolated_black_pixels(self, image, threshold=np.array([0.0, 0.0, 0.0])):
-        """Function to process each pixel neighborhood"""
-
-        # Convert the image in float
-        image = image.astype(np.float32)
-        # Create a kernel to compute the mean of neighboring pixels (same weight each)
-        # And exclude the center pixel
-        kernel = np.ones((3, 3), np.float32) / 8.0
-        kernel[1, 1] = 0
+    def fill_empty_pixels(self, image, occupancy, kernel_size=3):
+        """
+        Fill the pixels that received no point with the mean of their occupied neighbours, see the
+        function fill_empty_pixels.
+        """
+        return fill_empty_pixels(image, occupancy, kernel_size, self.scratch_tracker)
 
-        # Split the image into its color channels
-        channels = cv2.split(image)
 
-        # Apply the convolution to each channel (RGB) separately
-        mean_channels = [cv2.filter2D(channel, -1, kernel) for channel in channels]
+    def remove_isolated_black_pixels(self, image, threshold=40):
+        """
+        Fill black pixels with the mean of their neighbours, see the function fill_black_pixels.
 
-        # Merge the channels back together
-        mean_image = cv2.merge(mean_channels)
-
-        # Identify black pixels (all channels are zero)
-        # A pixel is black if each of its RGB value is less than 41
-        try:
-            black_pixels_mask = np.all(image <= [40, 40, 40], axis=-1)
-        except:
-            # If the image only has one chanel (black and white image)
-            black_pixels_mask = np.any(image <= 40, axis=-1)
-
-        # Replace black pixels with the corresponding values from the mean
-        image[black_pixels_mask] = mean_image[black_pixels_mask]
-
-        # Convert image back to integer
-        result_image = np.clip(image, 0, 255).astype(np.uint8)
-
-        return result_image
+        Kept for images without an occupancy mask, and used by the "black_pixels" hole filling.
+        Images made by project_pc are filled with fill_empty_pixels and the occupancy mask of
+        main_projection by default.
+        """
+        return fill_black_pixels(image, threshold)
 
 
     def save_image(self):
@@ -154,7 +608,14 @@ class PCloudProjection:
         filename = os.path.join(self.projected_image_folder,f"{self.project_name}_{self.image_type}Image.tif")
         self.bg_image_filename.append(filename)
 
-        raster = np.moveaxis(self.shaded_image, [0, 1, 2], [2, 1, 0])
+        image = self.shaded_image
+        count = 3
+        if image.ndim == 2:
+            # Single band (range) image, written as one band or as three identical bands
+            count = 1 if self.range_image_bands == 1 else 3
+            image = np.broadcast_to(image.astype(np.uint8)[..., np.newaxis], image.shape + (count,))
+
+        raster = np.moveaxis(image, [0, 1, 2], [2, 1, 0])
         raster = np.rot90(raster, k=-1, axes=(1, 2))
         raster = np.flip(raster, axis=2)
 
@@ -164,39 +625,160 @@ class PCloudProjection:
             'nodata': None,
             'height': self.shaded_image.shape[0],
             'width': self.shaded_image.shape[1],
-            'count': 3,  # number of bands
+            'count': count,  # number of bands
             "tiled": False,
             "compress": 'lzw'
         }
         
-        custom_tags = {
-                "pc_path": self.pc_path,
-                "image_path": filename,
-                "make_range_image": self.make_range_image,
-                "make_color_image": self.make_color_image,
-                "resolution_cm": self.resolution_cm,
-                "top_view": self.top_view,
-                "camera_position_x": self.camera_position[0],
-                "camera_position_y": self.camera_position[1],
-                "camera_position_z": self.camera_position[2],
-                "pc_mean_x": self.anchor_point_xyz[0],
-                "pc_mean_y": self.anchor_point_xyz[1],
-                "pc_mean_z": self.anchor_point_xyz[2],
-                "rgb_light_intensity": self.rgb_light_intensity,
-                "range_light_intensity": self.range_light_intensity,
-                "h_img_res": self.h_img_res,
-                "v_img_res": self.v_img_res,
-                "h_fov_x": self.h_fov[0],
-                "h_fov_y": self.h_fov[1],
-                "v_fov_x": self.v_fov[0],
-                "v_fov_y": self.v_fov[1],
-                "res": self.v_res
-            }
-
         # Write the raster
         with rasterio.open(filename, "w", **meta) as dest:
-            dest.write(raster, [1,2,3])
-            dest.update_tags(**custom_tags)
+            dest.write(raster, list(range(1, count + 1)))
+            dest.update_tags(**self.image_tags(filename))
+
+
+    def range_raster(self):
+        """
+        The raw range image in metres (NaN where no point) and the occupancy, as used by raster_change.
+        range_m and occupancy are None with the sparse and incremental backends, which keep the
+        ranges of the occupied pixels only (range_m_values), the rasters are then built here.
+        :return: The range image and the occupancy mask, in the orientation of main_projection.
+        """
+        if self.range_m is not None:
+            return self.range_m, self.occupancy
+        range_m = np.full((self.h_img_res, self.v_img_res), np.nan, dtype=np.float32)
+        range_m[self.u, self.v] = self.range_m_values
+        return range_m, ~np.isnan(range_m)
+
+
+    def save_raw_range(self):
+        """
+        Save the raw range of each pixel (range_m) as a single band raster, in the orientation and
+        with the tags of the shaded images, so it can be read back without the point cloud.
+        With raw_range_format "float32" the range is stored in metres. With "uint16" a value k stores
+        range_offset + (k - 1) * range_scale metres (both in the tags), the scale being raw_range_scale
+        or larger if the ranges would not fit. The occupancy is the internal mask of the raster, empty
+        pixels are also NaN (float32) or 0 (uint16).
+        """
+        filename = os.path.join(self.projected_image_folder, f"{self.project_name}_RawRange.tif")
+        range_m, occupancy = self.range_raster()
+        range_m = np.fliplr(range_m)
+        occupancy = np.fliplr(occupancy)
+        tags = self.image_tags(filename)
+        tags["range_unit"] = "m"
+
+        if self.raw_range_format == "float32":
+            data, nodata, predictor = range_m, np.nan, 3
+        elif self.raw_range_format == "uint16":
+            offset = float(np.nanmin(range_m)) if occupancy.any() else 0.0
+            span = float(np.nanmax(range_m)) - offset if occupancy.any() else 0.0
+            scale = max(self.raw_range_scale, span / 65534)
+            data = np.zeros(range_m.shape, dtype=np.uint16)
+            data[occupancy] = np.rint((range_m[occupancy] - offset) / scale) + 1
+            nodata, predictor = 0, 2
+            tags.update(range_offset=offset, range_scale=scale)
+        else:
+            raise ValueError(f"Unknown raw_range_format: {self.raw_range_format}")
+
+        meta = {
+            'driver': 'GTiff',
+            'dtype': data.dtype.name,
+            'nodata': nodata,
+            'height': data.shape[0],
+            'width': data.shape[1],
+            'count': 1,
+            "tiled": False,
+            "compress": 'lzw',
+            "predictor": predictor
+        }
+        with rasterio.open(filename, "w", **meta) as dest:
+            dest.write(data, 1)
+            dest.write_mask(occupancy)
+            dest.update_tags(**tags)
+        self.raw_range_filename = filename
+
+
+    def save_point_index(self):
+        """
+        Save the index in the point cloud file of the point kept at each pixel, so that a pixel of the
+        images leads back to its point without reprojecting (see PointIndexLookup).
+        With point_index_format "raster" the index is an int32 GeoTIFF (int64 for files of more than
+        2**31 points) in the orientation and with the tags of the shaded images, -1 at empty pixels.
+        With "coo" only the occupied pixels are stored, as u, v and index arrays in a .npz file with
+        the tags, which is smaller for sparse images.
+        With point_store, the point records of the file are saved as a .npy file next to it, so that
+        the lookup memory-maps them instead of decompressing the point cloud.
+        """
+        tags = self.image_tags(None)
+        header = self.las_f.header
+        tags.update(
+            point_count=len(self.las_f.points),
+            **{f"point_scale_{axis}": value for axis, value in zip("xyz", header.scales)},
+            **{f"point_offset_{axis}": value for axis, value in zip("xyz", header.offsets)},
+        )
+        if self.point_store:
+            self.point_store_filename = os.path.join(self.projected_image_folder, f"{self.project_name}_Points.npy")
+            np.save(self.point_store_filename, self.las_f.points.array)
+            tags["point_store"] = self.point_store_filename
+
+        dtype = np.int32 if len(self.las_f.points) < 2**31 else np.int64
+        if self.point_index_format == "raster":
+            filename = os.path.join(self.projected_image_folder, f"{self.project_name}_PointIndex.tif")
+            tags["image_path"] = filename
+            index = np.full((self.h_img_res, self.v_img_res), -1, dtype=dtype)
+            index[self.u, self.v] = self.point_ids
+            meta = {
+                'driver': 'GTiff',
+                'dtype': index.dtype.name,
+                'nodata': -1,
+                'height': index.shape[0],
+                'width': index.shape[1],
+                'count': 1,
+                "tiled": False,
+                "compress": 'lzw'
+            }
+            with rasterio.open(filename, "w", **meta) as dest:
+                dest.write(np.fliplr(index), 1)
+                dest.update_tags(**tags)
+        elif self.point_index_format == "coo":
+            filename = os.path.join(self.projected_image_folder, f"{self.project_name}_PointIndex.npz")
+            tags["image_path"] = filename
+            np.savez(
+                filename,
+                u=self.u.astype(np.int32),
+                v=self.v.astype(np.int32),
+                index=self.point_ids.astype(dtype),
+                tags=json.dumps({key: str(value) for key, value in tags.items()})
+            )
+        else:
+            raise ValueError(f"Unknown point_index_format: {self.point_index_format}")
+        self.point_index_filename = filename
+
+
+    def image_tags(self, filename):
+        # Custom tags of the saved images, read back by ProjectChange
+        return {
+            "pc_path": self.pc_path,
+            "image_path": filename,
+            "make_range_image": self.make_range_image,
+            "make_color_image": self.make_color_image,
+            "resolution_cm": self.resolution_cm,
+            "top_view": self.top_view,
+            "camera_position_x": self.camera_position[0],
+            "camera_position_y": self.camera_position[1],
+            "camera_position_z": self.camera_position[2],
+            "pc_mean_x": self.anchor_point_xyz[0],
+            "pc_mean_y": self.anchor_point_xyz[1],
+            "pc_mean_z": self.anchor_point_xyz[2],
+            "rgb_light_intensity": self.rgb_light_intensity,
+            "range_light_intensity": self.range_light_intensity,
+            "h_img_res": self.h_img_res,
+            "v_img_res": self.v_img_res,
+            "h_fov_x": self.h_fov[0],
+            "h_fov_y": self.h_fov[1],
+            "v_fov_x": self.v_fov[0],
+            "v_fov_y": self.v_fov[1],
+            "res": self.v_res
+        }
 
 
     def load_pc_file(self):
@@ -217,166 +799,879 @@ class PCloudProjection:
                 self.green = (self.green / 65535.0 * 255).astype(np.uint8)
                 self.blue = (self.blue / 65535.0 * 255).astype(np.uint8)
 
+        # Scanner-native angles, only valid for the scanner's own perspective
+        self.scan_angles = None
+        if self.scan_angle_dims is not None and not self.top_view:
+            dimension_names = set(self.las_f.point_format.dimension_names)
+            if all(dim in dimension_names for dim in self.scan_angle_dims):
+                self.scan_angles = tuple(
+                    np.array(self.las_f[dim], dtype=np.float64) for dim in self.scan_angle_dims
+                )
+
         self.xyz = np.c_[x, y, z]
+        # Index of each point in the file, kept through the thinning and the projection
+        self.point_ids = np.arange(len(x)) if self.point_index_format is not None else None
         if self.ref_anchor_point_xyz is not None:
             self.anchor_point_xyz = self.ref_anchor_point_xyz
         else:  
             self.anchor_point_xyz = np.hstack((np.mean(x), np.mean(y), np.mean(z)))
 
+        if self.voxel_thinning is not None:
+            self.thin_point_cloud()
+
+
+    def thin_point_cloud(self):
+        # Keep one point per voxel. The anchor point is computed before, so the image geometry
+        # does not depend on the thinning
+        voxel_size = self.voxel_thinning.get("voxel_size") or geometry.voxel_size_from(resolution_cm=self.resolution_cm)
+        indices, self.xyz, self.reduction_ratio = geometry.voxel_thin(
+            self.xyz, voxel_size, mode=self.voxel_thinning.get("mode", "nearest"),
+            reference_point=self.camera_position
+        )
+        if self.make_color_image:
+            self.red, self.green, self.blue = self.red[indices], self.green[indices], self.blue[indices]
+        if self.point_ids is not None:
+            self.point_ids = self.point_ids[indices]
+        if self.scan_angles is not None:
+            if self.voxel_thinning.get("mode", "nearest") == "centroid":
+                # The stored angles do not match the centroids
+                self.scan_angles = None
+            else:
+                self.scan_angles = tuple(angles[indices] for angles in self.scan_angles)
+
 
     def main_projection(self):
-        # Shift the point cloud by the camera position' coordinates so the latter is positionned on the origin
-        self.xyz -= self.camera_position
-        # Range between camera and the mean point of the point cloud
-        range = np.sqrt(
-            (
-                (self.camera_position[0] - self.anchor_point_xyz[0]) ** 2
-                + (self.camera_position[1] - self.anchor_point_xyz[1]) ** 2
-                + (self.camera_position[2] - self.anchor_point_xyz[2]) ** 2
-            )
+        # Select the closest point of each pixel with the functional core, without images
+        self.projection = project(
+            self.xyz, self.reference_grid(), scan_angles=self.scan_angles, make_images=False
+        )
+        self.apply_grid(self.projection.grid)
+
+        self.u = self.projection.u
+        self.v = self.projection.v
+        # Range normalised to [0, 255], for the shading
+        self.r = self.projection.r
+        # Raw range of each pixel in metres, NaN where no point, for the raster change detection.
+        # The sparse image backend keeps the ranges of the occupied pixels only, see range_raster
+        self.range_m = self.occupancy = None
+        if self.sparse_block_size or self.incremental_tiles is not None:
+            self.range_m_values = self.projection.range_m.astype(np.float32)
+        else:
+            self.range_m = self.projection.range_raster()
+            # Pixels that received a point, the others are filled by fill_empty_pixels
+            self.occupancy = self.projection.occupancy()
+        if self.make_color_image:
+            self.red = self.red[self.projection.index]
+            self.green = self.green[self.projection.index]
+            self.blue = self.blue[self.projection.index]
+        if self.point_ids is not None:
+            self.point_ids = self.point_ids[self.projection.index]
+
+
+    def reference_grid(self):
+        """
+        Image geometry of the configuration and of the reference parameters of project_pc, with the
+        field of view of the reference if set (see image_grid).
+        """
+        return image_grid(
+            self.camera_position, self.anchor_point_xyz, self.resolution_cm, self.top_view,
+            self.buffer_m, self.ref_h_fov, self.ref_v_fov
         )
-        # Getting vertical and horizontal resolutions in degrees. Both calculated with the range and the pixel dimension
-        alpha_rad = np.arctan2(self.resolution_cm / 100, range)
-        self.v_res = self.h_res = np.rad2deg(alpha_rad)
 
-        # Get spherical coordinates
-        r, theta, phi = utilities.xyz_2_spherical(self.xyz)  # Outputs r, theta (radians), phi (radians)
-        # Convert radians to degrees
-        theta_deg, phi_deg = np.rad2deg(theta), np.rad2deg(phi)
 
-        # Discretize angles to image coordinates
-        if np.floor(min(theta_deg)) == -180 or np.floor(max(theta_deg)) == 180:
-            mask = theta_deg < 0
-            theta_deg[mask] += 360
+    def apply_grid(self, grid):
+        # Image geometry as attributes, as used by the methods and the image tags
+        self.grid = grid
+        self.v_res = self.h_res = grid["res"]
+        self.h_fov = grid["h_fov"]
+        self.v_fov = grid["v_fov"]
+        self.h_img_res = grid["h_img_res"]
+        self.v_img_res = grid["v_img_res"]
 
-        if np.floor(min(phi_deg)) == -180 or np.floor(max(phi_deg)) == 180:
-            mask = phi_deg < 0
-            phi_deg[mask] += 360
-        
-        if self.ref_h_fov is not None and self.ref_v_fov is not None:
-            self.h_fov = self.ref_h_fov
-            self.v_fov = self.ref_v_fov
-        else:
-            self.buffer_deg = np.rad2deg(np.arctan2(self.buffer_m, range))
-            self.h_fov = (np.floor(min(theta_deg)-self.buffer_deg), np.ceil(max(theta_deg)+self.buffer_deg))
-            self.v_fov = (np.floor(min(phi_deg)-self.buffer_deg), np.ceil(max(phi_deg)+self.buffer_deg))
 
-        self.h_img_res = int((self.h_fov[1] - self.h_fov[0]) / self.h_res)
-        self.v_img_res = int((self.v_fov[1] - self.v_fov[0]) / self.v_res)
+    def set_image_geometry(self, theta_range, phi_range):
+        """
+        Set the angular resolution, the field of view and the image size.
+        :param theta_range: Minimum and maximum horizontal angle of the points, in degrees.
+        :param phi_range: Minimum and maximum vertical angle of the points, in degrees.
+        """
+        self.apply_grid(fit_image_grid(self.reference_grid(), theta_range, phi_range))
+
+
+    def min_range_per_pixel(self, u, v, r):
+        """
+        Select the point with the smallest radius at each pixel without sorting the points, see
+        closest_point_per_pixel. Points outside of the image are discarded.
+        :return: Boolean mask of the selected points.
+        """
+        return closest_point_per_pixel(u, v, r, self.grid, zbuffer=True)
+
 
-        # Initialize range and color image
-        self.range_image = np.full(
-            (self.h_img_res, self.v_img_res, 3), 0, dtype=np.float32
+    def create_shading(self):
+        # Shading factors shared by the color and range images, see shading_factors
+        self.color_shading = self.range_shading = None
+        self.color_shading, self.range_shading = shading_factors(
+            self.u, self.v, self.r, (self.h_img_res, self.v_img_res),
+            self.camera_position, self.anchor_point_xyz, self.rgb_light_intensity,
+            self.make_color_image, self.make_range_image, self.scratch_tracker
         )
-        self.color_image = np.full(
-            (self.h_img_res, self.v_img_res, 3), 0, dtype=np.uint8
+
+
+    def apply_shading_to_color_img(self):
+        self.shaded_image = shade_color_image(
+            self.u, self.v, (self.red, self.green, self.blue), self.color_shading, self.occupancy,
+            self.hole_filling_kernel_size, self.scratch_tracker, self.hole_filling
         )
+        # Call save_image function
+        self.image_type = "Color"
 
-        # Map angles to pixel indices
-        u = np.round((theta_deg - self.h_fov[0]) / self.h_res).astype(int)
-        v = np.round((phi_deg - self.v_fov[0]) / self.v_res).astype(int)
 
-        # At each pixel (u, v), we keep the point with the smallest radius (r)
-        df = pd.DataFrame({'u': u, 'v': v, 'r': r})
-        df['idx'] = np.arange(len(u))
-        min_idx = df.loc[df.groupby(['u', 'v'])['r'].idxmin(), 'idx'].values
+    def apply_shading_to_range_img(self):
+        self.shaded_image = shade_range_image(
+            self.u, self.v, self.r, self.range_shading, self.occupancy, self.range_light_intensity,
+            self.hole_filling_kernel_size, self.scratch_tracker, self.hole_filling
+        )
+        # Call save_image function
+        self.image_type = "Range"
 
-        # valid_indices = np.zeros(len(df), dtype=bool)
-        valid_indices = np.zeros(len(df), dtype=bool)
-        # valid_indices[min_idx] = False
-        valid_indices[min_idx] = True
 
+    def apply_smoothing(self, input_image):
+        return smooth_image(input_image)
+
+
+    def project_blocks(self):
+        """
+        Sparse image backend, for images that are mostly empty (large buffer_m, panoramic scans).
+        The pixels selected by main_projection are bucketed into square blocks of sparse_block_size
+        pixels, extended by a halo as the tiles of TiledPCloudProjection. Only the blocks whose window
+        holds a pixel are shaded and smoothed, and only their cores are written to tiled GeoTIFFs in
+        which the empty blocks are not stored, so no dense image is ever allocated. The images match
+        the dense ones, empty blocks read as black.
+        """
+        u, v, r = self.u, self.v, self.r
+        colors = (self.red, self.green, self.blue) if self.make_color_image else None
+        blocks = dict(self.block_members(u, v))
+
+        def load_block(block):
+            members = blocks[block]
+            block_colors = tuple(color[members] for color in colors) if colors is not None else None
+            return u[members], v[members], r[members], block_colors
+
+        self.write_blocks(list(blocks), load_block)
+
+
+    def project_incremental(self):
+        """
+        Incremental background images, for the epochs of a static scene projected on the same grid
+        (the field of view and anchor point of the reference epoch, see project_pc).
+
+        The z-buffer of the epoch (range and color of the occupied pixels) is compared with the one of
+        the previous epoch of the series, kept in the TileStore. A pixel changed if it appeared,
+        disappeared, or if its range changed by more than range_threshold metres or one of its colors
+        by more than color_threshold. Only the blocks of tile_size pixels whose window holds a changed
+        pixel are shaded and encoded (see shade_blocks), the others reuse the tiles of the previous
+        epoch. The tiles are stored by content hash and the epoch is published as a tile manifest,
+        {project_name}_Tiles.json, listing the window and hash of its tiles, so storage and downloads
+        grow with the amount of change. compose_tiles assembles the full image. The full images are
+        also written from the tiles, as by save_image, for the consumers of bg_image_filename (e.g. the
+        data model, whose ImageData also refers to the tile manifest), unless "full_images" is False.
+
+        The range normalisation of the first epoch of the series is kept for the next ones, so that
+        the tiles of different epochs match. A series whose grid changed starts over.
+        """
+        settings = self.incremental_tiles
+        store = tiles.TileStore(settings["store"])
+        series = settings.get("series", "background")
+        range_threshold = settings.get("range_threshold", 0.01)
+        color_threshold = settings.get("color_threshold", 0)
+
+        grid = {
+            key: np.asarray(self.grid[key], dtype=np.float64).tolist()
+            for key in ("h_fov", "v_fov", "res", "h_img_res", "v_img_res", "camera_position", "anchor_point_xyz")
+        }
+        grid.update(top_view=bool(self.top_view), tile_size=int(self.tile_size), image_types=self.image_types())
+        state = store.load_state(series)
+        if state is not None and state["grid"] != grid:
+            state = None
+
+        range_m = self.projection.range_m
+        flat_index = self.u.astype(np.int64) * self.v_img_res + self.v
+        colors = np.c_[self.red, self.green, self.blue] if self.make_color_image else np.zeros((len(self.u), 0), dtype=np.uint8)
+        if state is None:
+            r_min, r_max = float(np.min(range_m)), float(np.max(range_m))
+        else:
+            r_min, r_max = state["r_min"], state["r_max"]
+        # Same normalisation as main_projection, with the bounds of the first epoch of the series
+        r = (range_m - r_min) * 255 / (r_max - r_min)
+
+        blocks = dict(self.block_members(self.u, self.v))
+        changed_blocks = set(blocks)
+        previous_tiles = {image_type: {} for image_type in self.image_types()}
+        if state is not None:
+            # The z-buffer keeps the points tied at the smallest range of a pixel, so pixels may
+            # repeat: each pixel is compared through its first point
+            pixels, first = np.unique(flat_index, return_index=True)
+            previous_pixels, previous_first = np.unique(state["flat_index"], return_index=True)
+            _, new, old = np.intersect1d(pixels, previous_pixels, assume_unique=True, return_indices=True)
+            changed = np.ones(pixels.shape[0], dtype=bool)
+            new_points, old_points = first[new], previous_first[old]
+            changed[new] = np.abs(range_m[new_points] - state["range_m"][old_points]) > range_threshold
+            if colors.shape[1]:
+                color_change = np.abs(colors[new_points].astype(np.int16) - state["colors"][old_points].astype(np.int16))
+                changed[new] |= (color_change > color_threshold).any(axis=1)
+            removed = np.ones(previous_pixels.shape[0], dtype=bool)
+            removed[old] = False
+            changed_index = np.r_[pixels[changed], previous_pixels[removed]]
+            changed_u, changed_v = np.divmod(changed_index, self.v_img_res)
+            changed_blocks = {block for block, _ in self.block_members(changed_u, changed_v)}
+            previous_tiles = state["tiles"]
+
+        u, v = self.u, self.v
+
+        def load_block(block):
+            members = blocks[block]
+            block_colors = tuple(colors[members].T) if self.make_color_image else None
+            return u[members], v[members], r[members], block_colors
+
+        epoch_tiles = {image_type: {} for image_type in self.image_types()}
+        render = []
+        for block in blocks:
+            key = "%d_%d" % block
+            if block not in changed_blocks and all(key in previous_tiles[image_type] for image_type in epoch_tiles):
+                for image_type in epoch_tiles:
+                    epoch_tiles[image_type][key] = previous_tiles[image_type][key]
+            else:
+                render.append(block)
+        for block, core, images in self.shade_blocks(render, load_block):
+            for image_type, image in images.items():
+                epoch_tiles[image_type]["%d_%d" % block] = {
+                    "row": int(core[0]),
+                    "col": int(self.v_img_res - core[3]),
+                    "height": int(core[1] - core[0]),
+                    "width": int(core[3] - core[2]),
+                    "hash": store.put_array(image),
+                }
+        self.tiles_rendered = len(render)
+        self.tiles_reused = len(blocks) - len(render)
 
-        self.u = u[valid_indices]
-        self.v = v[valid_indices]
-        self.r = r[valid_indices]
-        self.r = (self.r-np.min(self.r))*255/np.max(self.r-np.min(self.r))
-        if self.make_color_image:
-            self.red = self.red[valid_indices]
-            self.green = self.green[valid_indices]
-            self.blue = self.blue[valid_indices]
+        if not os.path.exists(self.projected_image_folder):
+            os.makedirs(self.projected_image_folder)
+        self.tile_manifest_filename = os.path.join(self.projected_image_folder, f"{self.project_name}_Tiles.json")
+        tile_manifest = {
+            "width": int(self.v_img_res),
+            "height": int(self.h_img_res),
+            "tile_size": int(self.tile_size),
+            "store": store.folder,
+            "tags": {key: str(value) for key, value in self.image_tags(self.tile_manifest_filename).items()},
+            "images": {image_type: list(image_tiles.values()) for image_type, image_tiles in epoch_tiles.items()},
+        }
+        with manifest.atomic_output(self.tile_manifest_filename) as tmp_filename:
+            with open(tmp_filename, "w") as f:
+                json.dump(tile_manifest, f, indent=4)
+        if settings.get("full_images", True):
+            for image_type in self.image_types():
+                self.save_composed_image(image_type)
+
+        store.save_state(series, {
+            "grid": grid, "r_min": r_min, "r_max": r_max, "tiles": epoch_tiles,
+            "flat_index": flat_index, "range_m": range_m, "colors": colors,
+        })
+
+
+    def save_composed_image(self, image_type):
+        """
+        Write the full image of the epoch, assembled from its tiles (see compose_tiles), like save_image.
+        """
+        filename = os.path.join(self.projected_image_folder, f"{self.project_name}_{image_type}Image.tif")
+        self.bg_image_filename.append(filename)
+        image = tiles.compose_tiles(self.tile_manifest_filename, image_type)
+        count = self.range_image_bands if image_type == "Range" else 3
+        if image.ndim == 2:
+            image = np.broadcast_to(image[..., np.newaxis], image.shape + (count,))
+        meta = {
+            'driver': 'GTiff',
+            'dtype': 'uint8',
+            'nodata': None,
+            'height': image.shape[0],
+            'width': image.shape[1],
+            'count': count,
+            "tiled": False,
+            "compress": 'lzw'
+        }
+        with rasterio.open(filename, "w", **meta) as dest:
+            dest.write(np.ascontiguousarray(np.moveaxis(image, 2, 0)), list(range(1, count + 1)))
+            dest.update_tags(**self.image_tags(filename))
+
+
+    def tile_window(self, i, j):
+        """
+        Pixel bounds (u0, u1, v0, v1) of the core of tile (i, j), written to the images, and of its
+        window extended by the halo, in which it is shaded.
+        """
+        ts, halo = self.tile_size, self.tile_halo
+        core = (i * ts, min((i + 1) * ts, self.h_img_res), j * ts, min((j + 1) * ts, self.v_img_res))
+        window = (
+            max(core[0] - halo, 0), min(core[1] + halo, self.h_img_res),
+            max(core[2] - halo, 0), min(core[3] + halo, self.v_img_res)
+        )
+        return core, window
+
+
+    def block_members(self, u, v):
+        """
+        Assign pixels to the blocks whose window (core and halo) contains them, at most four per
+        pixel as the halo is smaller than a block.
+        :param u: Row indices of the pixels, inside the image.
+        :param v: Column indices of the pixels, inside the image.
+        :return: List of (block index (i, j), indices of its pixels in increasing order).
+        """
+        ts, halo = self.tile_size, self.tile_halo
+        n_tiles_u = -(-self.h_img_res // ts)
+        n_tiles_v = -(-self.v_img_res // ts)
+        home_u, home_v = u // ts, v // ts
+
+        # (block, pixel) pairs for the home block of each pixel and the neighbours whose halo reaches it
+        tile_ids, point_ids = [], []
+        for du in (-1, 0, 1):
+            for dv in (-1, 0, 1):
+                tu, tv = home_u + du, home_v + dv
+                members = np.flatnonzero(
+                    (tu >= 0) & (tu < n_tiles_u) & (tv >= 0) & (tv < n_tiles_v)
+                    & (u >= tu * ts - halo) & (u < (tu + 1) * ts + halo)
+                    & (v >= tv * ts - halo) & (v < (tv + 1) * ts + halo)
+                )
+                tile_ids.append(tu[members] * n_tiles_v + tv[members])
+                point_ids.append(members)
+        tile_ids = np.concatenate(tile_ids)
+        point_ids = np.concatenate(point_ids)
+        # Sorting by block then pixel keeps the input order in each block
+        order = np.lexsort((point_ids, tile_ids))
+        tile_ids, point_ids = tile_ids[order], point_ids[order]
+        splits = np.flatnonzero(np.diff(tile_ids)) + 1
+        return [
+            (divmod(int(tile_id), n_tiles_v), members)
+            for tile_id, members in zip(tile_ids[np.r_[0, splits]], np.split(point_ids, splits))
+        ] if tile_ids.shape[0] else []
+
+
+    def image_types(self):
+        return [image_type for image_type, enabled in (("Color", self.make_color_image), ("Range", self.make_range_image)) if enabled]
+
+
+    def shade_blocks(self, blocks, load_block):
+        """
+        Shade each block in its window with the dense methods (create_shading, apply_shading_to_*).
+        :param blocks: List of the block indices (i, j) holding points.
+        :param load_block: Function returning the u and v image indices, the normalised ranges and the
+            (red, green, blue) colors (None without color image) of the pixels of a block window.
+        :return: Generator of (block, core, images), images being a dictionary of the uint8 core of
+            the block by image type, in the orientation of the saved images (see tile_window).
+        """
+        # State of the whole image, replaced by the one of each block below
+        state = {
+            name: getattr(self, name, None)
+            for name in ("h_img_res", "v_img_res", "u", "v", "r", "occupancy", "red", "green", "blue")
+        }
+        # Windows of the whole image
+        windows = {block: self.tile_window(*block) for block in blocks}
+        try:
+            for block in blocks:
+                u, v, r, colors = load_block(block)
+                core, window = windows[block]
+
+                # State of one block, as main_projection leaves it for the whole image
+                self.h_img_res, self.v_img_res = window[1] - window[0], window[3] - window[2]
+                self.u = u - window[0]
+                self.v = v - window[2]
+                self.r = r
+                self.occupancy = np.zeros((self.h_img_res, self.v_img_res), dtype=bool)
+                self.occupancy[self.u, self.v] = True
+                if self.make_color_image:
+                    self.red, self.green, self.blue = colors
+
+                self.create_shading()
+                images = {}
+                for image_type in self.image_types():
+                    if image_type == "Color":
+                        self.apply_shading_to_color_img()
+                    else:
+                        self.apply_shading_to_range_img()
+                    # The shaded block is flipped left to right like the whole image, its core columns are mirrored
+                    width = window[3] - window[2]
+                    images[image_type] = self.shaded_image[
+                        core[0] - window[0]:core[1] - window[0],
+                        width - (core[3] - window[2]):width - (core[2] - window[2])
+                    ].astype(np.uint8)
+                self.color_shading = self.range_shading = self.shaded_image = None
+                # Size of the whole image while the caller uses the block
+                self.h_img_res, self.v_img_res = state["h_img_res"], state["v_img_res"]
+                yield block, core, images
+        finally:
+            for name, value in state.items():
+                setattr(self, name, value)
+
+
+    def write_blocks(self, blocks, load_block):
+        """
+        Shade each block (see shade_blocks) and write its core into the color and range images, tiled
+        GeoTIFFs whose unwritten blocks are not stored.
+        """
+        if not os.path.exists(self.projected_image_folder):
+            os.makedirs(self.projected_image_folder)
+        meta = {
+            'driver': 'GTiff',
+            'dtype': 'uint8',
+            'nodata': None,
+            'height': self.h_img_res,
+            'width': self.v_img_res,
+            'count': 3,  # number of bands
+            "tiled": True,
+            "blockxsize": 256,
+            "blockysize": 256,
+            "compress": 'lzw',
+            "sparse_ok": True
+        }
+        outputs = {}
+        for image_type in self.image_types():
+            filename = os.path.join(self.projected_image_folder, f"{self.project_name}_{image_type}Image.tif")
+            self.bg_image_filename.append(filename)
+            count = self.range_image_bands if image_type == "Range" else 3
+            outputs[image_type] = rasterio.open(filename, "w", **dict(meta, count=count))
 
-        # Shift the point cloud back to its original coordinates
-        self.xyz += self.camera_position
+        try:
+            for _, core, images in self.shade_blocks(blocks, load_block):
+                for image_type, image in images.items():
+                    self._write_tile_core(outputs[image_type], image, core)
+        finally:
+            for filename, dest in zip(self.bg_image_filename[-len(outputs):], outputs.values()):
+                dest.update_tags(**self.image_tags(filename))
+                dest.close()
+
+
+    def _write_tile_core(self, dest, image, core):
+        if image.ndim == 2:
+            # Single band (range) image, written as one band or as three identical bands
+            image = np.broadcast_to(image[..., np.newaxis], image.shape + (dest.count,))
+        raster = np.ascontiguousarray(np.moveaxis(image, 2, 0))
+        dest.write(
+            raster, list(range(1, dest.count + 1)),
+            window=Window(self.v_img_res - core[3], core[0], core[3] - core[2], core[1] - core[0])
+        )
 
 
-    def create_shading(self):
-        # Compute surface normals' components (gradient approximation)
-        z_img = np.zeros((self.h_img_res, self.v_img_res))
-        #self.r = self.r * 255 / np.max(self.r)
-        z_img[self.u, self.v] = self.r
-        dz_dv, dz_du = np.gradient(z_img)
+    def _new_scratch_tracker(self):
+        # The shading factors are held by the instance while the images are shaded
+        return _ScratchTracker(held=lambda: (getattr(self, "color_shading", None), getattr(self, "range_shading", None)))
 
-        # Compute normals with components
-        self.normals = np.dstack((-dz_du, -dz_dv, np.ones_like(z_img)))
-        self.norms = np.linalg.norm(self.normals, axis=2, keepdims=True)
-        self.normals /= self.norms  # Normalize
 
+    @property
+    def peak_scratch_bytes(self):
+        tracker = getattr(self, "scratch_tracker", None)
+        return 0 if tracker is None else tracker.peak_bytes
 
-    def apply_shading_to_color_img(self):
-        # Populate
-        self.color_image[self.u, self.v, 0] = self.red
-        self.color_image[self.u, self.v, 1] = self.green
-        self.color_image[self.u, self.v, 2] = self.blue
-        # Compute shading (Lambertian model)
-        # Light direction for the image to have the right shading
-        light_dir_x = abs(self.camera_position[0] - self.anchor_point_xyz[0])
-        light_dir_y = abs(self.camera_position[1] - self.anchor_point_xyz[1])
-        light_dir_z = abs(self.camera_position[2] - self.anchor_point_xyz[2])
-        light_direction = np.array(
-            [light_dir_x, light_dir_y, light_dir_z]
-        )  # Direction of the light source
-        light_direction = light_direction / np.linalg.norm(light_direction)  # Normalize
 
-        dot_product = np.sum(self.norms * light_direction, axis=2)
-        shading = np.clip(dot_product * self.rgb_light_intensity, 0, 1)
+class TiledPCloudProjection(PCloudProjection):
+    """
+    Tiled variant of PCloudProjection, for scenes whose point cloud or image does not fit in memory.
 
-        # Apply smoothed shading to the color image
-        shaded_color_image = (self.color_image.astype(np.float32) * shading[..., np.newaxis])
-        shaded_color_image = np.clip(shaded_color_image, 0, 255).astype(np.uint8)
-        # Apply median filter to selectively remove isolated black pixels
-        shaded_color_image = self.remove_isolated_black_pixels(shaded_color_image)
+    The point cloud is read in chunks and its angles are spilled to a scratch file. The image is split
+    into square tiles of tile_size pixels, each extended by a halo covering the neighbourhoods of the
+    gradient, hole filling and smoothing steps. The points are bucketed per tile, each tile is shaded
+    on its own with the methods of PCloudProjection and only its core is written into its window of
+    the GeoTIFF, so the mosaic has no seams. The range normalisation is the only step that needs the
+    whole scene, its bounds are gathered in a first pass over the tiles. The images match the ones of
+    PCloudProjection, up to pixels where several points have the same smallest range. The raw range
+    and point index outputs ("raw_range_format", "point_index_format") are not supported.
 
-        self.shaded_image = self.apply_smoothing(shaded_color_image)
+    Methods:
+        - project_pc: Same parameters, outputs and return values as PCloudProjection.project_pc.
+        - scan_points: Streams the point cloud and spills the angles, ranges and colors to disk.
+        - tile_window: Returns the core and the halo extended window of a tile.
+        - bucket_points: Splits the spilled points into the tiles.
+        - select_tile_points: Keeps the closest point of each pixel of each tile.
+        - write_tiles: Shades the tiles and writes their cores into the images.
+    """
 
-        # Call save_image function
-        self.image_type = "Color"
+    record_dtype = np.dtype([
+        ("theta", np.float64), ("phi", np.float64), ("r", np.float64),
+        ("red", np.uint16), ("green", np.uint16), ("blue", np.uint16)
+    ])
+    tile_record_dtype = np.dtype([
+        ("index", np.int64), ("u", np.int64), ("v", np.int64), ("r", np.float64),
+        ("red", np.uint16), ("green", np.uint16), ("blue", np.uint16)
+    ])
 
+    def __init__(
+        self,
+        configuration,
+        project_name,
+        projected_image_folder,
+        tile_size=2048,
+        chunk_size=5_000_000,
+        scratch_folder=None
+    ):
+        super().__init__(configuration, project_name, projected_image_folder)
+        # The raw range and the point index are whole-image rasters, which the tiles never hold
+        for option in ("raw_range_format", "point_index_format"):
+            if getattr(self, option) is not None:
+                raise ValueError(f"{option} is not supported by TiledPCloudProjection, use PCloudProjection")
+        self.tile_size = tile_size
+        self.chunk_size = chunk_size
+        # Folder of the temporary files, the system default if None
+        self.scratch_folder = scratch_folder
 
-    def apply_shading_to_range_img(self):
-        # Populate the range image with the radius (scanner to point distance)
-        self.range_image[self.u, self.v, 0] = \
-            self.range_image[self.u, self.v, 1] = \
-            self.range_image[self.u, self.v, 2] = \
-        self.r+ self.range_light_intensity
-        
-        # Shade the range image with the normals
-        shaded_range_image = (
-            self.range_image.astype(np.float32)
-            * (
-                self.normals[:, :, -1] + self.normals[:, :, -2] + self.normals[:, :, -3]
-            )[..., np.newaxis]
+
+    def project_pc(
+        self,
+        ref_theta=0.0,
+        ref_phi=0.0,
+        ref_anchor_point_xyz=None,
+        ref_h_fov=None,
+        ref_v_fov=None,
+        ref_h_img_res=None,
+        ref_v_img_res=None,
+        buffer_m=0.0
+    ):
+        self.ref_theta = ref_theta
+        self.ref_phi = ref_phi
+        self.ref_anchor_point_xyz = ref_anchor_point_xyz
+        self.ref_h_fov = ref_h_fov
+        self.ref_v_fov = ref_v_fov
+        self.ref_h_img_res = ref_h_img_res
+        self.ref_v_img_res = ref_v_img_res
+        self.buffer_m = buffer_m
+
+        self.scratch_tracker = self._new_scratch_tracker()
+
+        with tempfile.TemporaryDirectory(dir=self.scratch_folder) as scratch_folder:
+            spill_filename, theta_range, phi_range = self.scan_points(scratch_folder)
+            self.set_image_geometry(theta_range, phi_range)
+            tile_files = self.bucket_points(spill_filename, scratch_folder)
+            r_min, r_max = self.select_tile_points(tile_files)
+            self.write_tiles(tile_files, r_min, r_max)
+
+        # Return all reference parameters
+        return (
+            self.h_fov, self.v_fov, self.anchor_point_xyz,
+            self.h_img_res, self.v_img_res
         )
 
-        filter_255 = shaded_range_image>255.
-        shaded_range_image[filter_255] = 255.
 
-        filter_0 = shaded_range_image<0.
-        shaded_range_image[filter_0] = 0.
+    def scan_points(self, scratch_folder):
+        """
+        Read the point cloud chunk by chunk and spill the angles (degrees), ranges and colors of its
+        points to a scratch file, in file order.
+        :param scratch_folder: Folder of the spill file.
+        :return: The path of the spill file and the (min, max) of the horizontal and vertical angles.
+        """
+        spill_filename = os.path.join(scratch_folder, "points.bin")
+        self.anchor_point_xyz = self.ref_anchor_point_xyz
+        if self.anchor_point_xyz is None and self.top_view:
+            # The rotation to the top view needs the mean point before any angle is computed
+            self.anchor_point_xyz = self._mean_point()
+
+        xyz_sum = np.zeros(3)
+        n_points = 0
+        self.red_max = 0
+        # Bounds of the angles, as they are and with the negative ones shifted by 360°
+        bounds = {key: [np.inf, -np.inf] for key in ("theta", "phi", "theta_360", "phi_360")}
+        with laspy.open(self.pc_path) as las_file, open(spill_filename, "wb") as spill:
+            dimension_names = set(las_file.header.point_format.dimension_names)
+            use_scan_angles = (
+                self.scan_angle_dims is not None and not self.top_view
+                and all(dim in dimension_names for dim in self.scan_angle_dims)
+            )
+            for points in las_file.chunk_iterator(self.chunk_size):
+                xyz = np.c_[np.array(points.x), np.array(points.y), np.array(points.z)]
+                if self.anchor_point_xyz is None:
+                    xyz_sum += xyz.sum(axis=0)
+                    n_points += xyz.shape[0]
+                if self.top_view:
+                    xyz = utilities.rotate_to_top_view(xyz, *self.anchor_point_xyz)
+                xyz -= self.camera_position
+
+                records = np.zeros(xyz.shape[0], dtype=self.record_dtype)
+                if use_scan_angles:
+                    records["r"] = np.sqrt(np.einsum("ij,ij->i", xyz, xyz))
+                    records["theta"] = np.array(points[self.scan_angle_dims[0]], dtype=np.float64)
+                    records["phi"] = np.array(points[self.scan_angle_dims[1]], dtype=np.float64)
+                else:
+                    r, theta, phi = utilities.xyz_2_spherical(xyz)
+                    records["r"], records["theta"], records["phi"] = r, np.rad2deg(theta), np.rad2deg(phi)
+                if self.make_color_image:
+                    records["red"], records["green"], records["blue"] = points.red, points.green, points.blue
+                    self.red_max = max(self.red_max, int(records["red"].max(initial=0)))
+                records.tofile(spill)
+
+                if records.shape[0] == 0:
+                    continue
+                for key in ("theta", "phi"):
+                    angles = records[key]
+                    shifted = np.where(angles < 0, angles + 360, angles)
+                    for name, values in ((key, angles), (key + "_360", shifted)):
+                        bounds[name][0] = min(bounds[name][0], values.min())
+                        bounds[name][1] = max(bounds[name][1], values.max())
+
+        if self.anchor_point_xyz is None:
+            self.anchor_point_xyz = xyz_sum / n_points
+
+        # Same wrapping rule as main_projection, decided on the whole point cloud
+        self.wrap_theta = np.floor(bounds["theta"][0]) == -180 or np.floor(bounds["theta"][1]) == 180
+        self.wrap_phi = np.floor(bounds["phi"][0]) == -180 or np.floor(bounds["phi"][1]) == 180
+        theta_range = bounds["theta_360"] if self.wrap_theta else bounds["theta"]
+        phi_range = bounds["phi_360"] if self.wrap_phi else bounds["phi"]
+        return spill_filename, tuple(theta_range), tuple(phi_range)
+
+
+    def _mean_point(self):
+        xyz_sum = np.zeros(3)
+        n_points = 0
+        with laspy.open(self.pc_path) as las_file:
+            for points in las_file.chunk_iterator(self.chunk_size):
+                xyz_sum += (np.array(points.x).sum(), np.array(points.y).sum(), np.array(points.z).sum())
+                n_points += len(points)
+        return xyz_sum / n_points
+
+
+    def bucket_points(self, spill_filename, scratch_folder):
+        """
+        Compute the pixel of each spilled point and append the point to the files of the tiles whose
+        window contains it, at most four as the halo is smaller than a tile.
+        :param spill_filename: The spill file of scan_points.
+        :param scratch_folder: Folder of the tile files.
+        :return: Dictionary of the tile files by tile index (i, j).
+        """
+        tile_files = {}
+        if os.path.getsize(spill_filename) == 0:
+            return tile_files
+        records = np.memmap(spill_filename, dtype=self.record_dtype, mode="r")
+
+        for start in range(0, records.shape[0], self.chunk_size):
+            chunk = np.array(records[start:start + self.chunk_size])
+            theta_deg, phi_deg = chunk["theta"], chunk["phi"]
+            if self.wrap_theta:
+                theta_deg = np.where(theta_deg < 0, theta_deg + 360, theta_deg)
+            if self.wrap_phi:
+                phi_deg = np.where(phi_deg < 0, phi_deg + 360, phi_deg)
+            u = np.round((theta_deg - self.h_fov[0]) / self.h_res).astype(int)
+            v = np.round((phi_deg - self.v_fov[0]) / self.v_res).astype(int)
+            inside = np.flatnonzero((u >= 0) & (u < self.h_img_res) & (v >= 0) & (v < self.v_img_res))
+            u, v = u[inside], v[inside]
+
+            # The file order is kept in each tile, it breaks ties of equal range
+            for tile, tile_points in self.block_members(u, v):
+                tile_records = np.empty(tile_points.shape[0], dtype=self.tile_record_dtype)
+                tile_records["index"] = start + inside[tile_points]
+                tile_records["u"], tile_records["v"] = u[tile_points], v[tile_points]
+                for key in ("r", "red", "green", "blue"):
+                    tile_records[key] = chunk[key][inside[tile_points]]
+
+                tile_filename = tile_files.setdefault(tile, os.path.join(scratch_folder, "tile_%d_%d.bin" % tile))
+                with open(tile_filename, "ab") as f:
+                    tile_records.tofile(f)
+        return tile_files
+
+
+    def select_tile_points(self, tile_files):
+        """
+        Keep the point with the smallest range at each pixel of each tile, as main_projection does.
+        Ties go to the first point in file order. The tile files are rewritten with the kept points.
+        :param tile_files: The tile files of bucket_points.
+        :return: The smallest and largest kept range over the tile cores, for the range normalisation.
+        """
+        r_min, r_max = np.inf, -np.inf
+        for (i, j), tile_filename in tile_files.items():
+            records = np.fromfile(tile_filename, dtype=self.tile_record_dtype)
+            core, window = self.tile_window(i, j)
+            flat_index = (records["u"] - window[0]) * (window[3] - window[2]) + (records["v"] - window[2])
+            order = np.lexsort((records["index"], records["r"], flat_index))
+            first = np.r_[True, flat_index[order][1:] != flat_index[order][:-1]]
+            records = records[order[first]]
+            records.tofile(tile_filename)
+
+            in_core = (
+                (records["u"] >= core[0]) & (records["u"] < core[1])
+                & (records["v"] >= core[2]) & (records["v"] < core[3])
+            )
+            if in_core.any():
+                r_min = min(r_min, records["r"][in_core].min())
+                r_max = max(r_max, records["r"][in_core].max())
+        return r_min, r_max
+
+
+    def write_tiles(self, tile_files, r_min, r_max):
+        """
+        Shade each tile in its window with the methods of PCloudProjection and write its core to the
+        color and range images. Tiles without points stay black, as in the untiled images.
+        """
+        def load_tile(tile):
+            records = np.fromfile(tile_files[tile], dtype=self.tile_record_dtype)
+            colors = None
+            if self.make_color_image:
+                colors = (records["red"], records["green"], records["blue"])
+                # Normalize RGB values if necessary, decided on the whole point cloud as in load_pc_file
+                if self.red_max > 255:
+                    colors = tuple((color / 65535.0 * 255).astype(np.uint8) for color in colors)
+            return records["u"], records["v"], (records["r"] - r_min) * 255 / (r_max - r_min), colors
+
+        self.write_blocks(list(tile_files), load_tile)
+
+
+class GeoJSONWriter:
+    """
+    Streaming GeoJSON writer.
 
-        self.shaded_image = self.apply_smoothing(shaded_range_image)
+    Features are serialized as they are written and flushed to disk in batches, through a single
+    file handle. The output is byte-compatible with the files written by the GDAL GeoJSON driver
+    (through fiona) for the same features: same layout, coordinate formatting and CRS member, and
+    dictionaries or lists written as JSON objects like GDAL does for string fields holding JSON.
 
-        # Call save_image function
-        self.image_type = "Range"
+    Methods:
+        - write: Adds a feature.
+        - close: Flushes the remaining features and closes the file.
+
+    Used as a context manager, the file is closed at the end of the block, and removed if the block
+    raised an exception.
+    """
+
+    def __init__(self, filename, epsg=None, batch_size=1000):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.n_features = 0
+        self._batch = []
+        self._file = open(filename, "w", encoding="utf-8")
+
+        name = os.path.splitext(os.path.basename(filename))[0]
+        header = '{\n"type": "FeatureCollection",\n"name": %s,\n' % _json_c_dumps(name)
+        if epsg is not None:
+            urn = "urn:ogc:def:crs:OGC:1.3:CRS84" if int(epsg) == 4326 else f"urn:ogc:def:crs:EPSG::{int(epsg)}"
+            header += '"crs": { "type": "name", "properties": { "name": "%s" } },\n' % urn
+        self._file.write(header + '"features": [\n')
+
+
+    def write(self, geometry, properties):
+        """
+        Add a feature.
+        :param geometry: GeoJSON-like geometry mapping, e.g. from shapely.geometry.mapping.
+        :param properties: Dictionary of the feature properties. Strings holding a JSON object or
+            array are written as JSON, like GDAL does. Non-finite property values are written as NaN,
+            Infinity or -Infinity, like GDAL does.
+        """
+        properties = {key: _parse_json_string(value) for key, value in properties.items()}
+        try:
+            geometry = '{ "type": "%s", "coordinates": %s }' % (geometry["type"], _format_coordinates(geometry["coordinates"]))
+        except ValueError as error:
+            # Like GDAL, a geometry with a NaN or infinite coordinate is written as null
+            warnings.warn(f"{error}, the geometry of the feature is written as null")
+            geometry = "null"
+        self._batch.append('{ "type": "Feature", "properties": %s, "geometry": %s }' % (_json_c_dumps(properties), geometry))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+
+    def _flush(self):
+        if self._batch:
+            self._file.write((",\n" if self.n_features > 0 else "") + ",\n".join(self._batch))
+            self.n_features += len(self._batch)
+            self._batch = []
 
-        
-    def apply_smoothing(self, input_image):
-        blur = cv2.GaussianBlur(input_image, (3, 3), 0)
-        # Flip the image left to right
-        output_image = np.fliplr(np.asarray(blur))
 
-        return output_image
-    
+    def close(self):
+        if self._file.closed:
+            return
+        self._flush()
+        self._file.write("\n]\n}\n")
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # No truncated file is left behind
+            self._file.close()
+            os.remove(self.filename)
+
+
+def _parse_json_string(value):
+    # GDAL writes string fields holding a JSON object or array as JSON
+    if isinstance(value, str) and len(value) > 1 and (value[0], value[-1]) in (("{", "}"), ("[", "]")):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _json_c_dumps(value):
+    # JSON with the spacing of json-c, as used by GDAL: { "key": value }, [ 1, 2 ], { } and [ ]
+    if isinstance(value, dict):
+        if not value:
+            return "{ }"
+        return "{ " + ", ".join(
+            "%s: %s" % (_json_c_dumps(str(key)), _json_c_dumps(item)) for key, item in value.items()
+        ) + " }"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if len(value) == 0:
+            return "[ ]"
+        return "[ " + ", ".join(_json_c_dumps(item) for item in value) + " ]"
+    if isinstance(value, np.generic):
+        value = value.item()
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _format_coordinate(value):
+    # Coordinate formatting of the GDAL GeoJSON driver: 15 decimals, likely round-off error trimmed
+    # (GDAL's "intelliround"), then trailing zeros removed
+    if not np.isfinite(value):
+        raise ValueError(f"Non-finite coordinate {value}")
+    if abs(value) > 1e50:
+        return "%.17g" % value
+    s = "%.15f" % value
+    dot = s.index(".")
+    before_dot = dot - 1 - (s[0] == "-")
+    n = len(s)
+    if s[n - 6:n - 1] == "00000":
+        s = s[:-1]
+    elif (dot < n - 8 and s[n - 9:n - 7] == "00"
+            and all(before_dot >= 4 + i or s[n - 3 - i] == "0" for i in range(5))):
+        s = s[:-8]
+    elif s[n - 6:n - 1] == "99999" or (dot < n - 9 and s[n - 9:n - 7] == "99"
+            and all(before_dot >= 4 + i or s[n - 3 - i] == "9" for i in range(5))):
+        s = _round_up_last_digit(s[:n - 6] if s[n - 6:n - 1] == "99999" else s[:n - 9])
+    s = s.rstrip("0")
+    return s + "0" if s.endswith(".") else s
+
+
+def _round_up_last_digit(s):
+    # Add one unit to the last digit of a decimal string, carrying over the 9s
+    digits = list(s)
+    i = len(digits) - 1
+    while i >= 0:
+        if digits[i] == ".":
+            i -= 1
+            continue
+        if digits[i] == "-":
+            break
+        if digits[i] == "9":
+            digits[i] = "0"
+            i -= 1
+            continue
+        digits[i] = str(int(digits[i]) + 1)
+        return "".join(digits)
+    digits.insert(i + 1, "1")
+    return "".join(digits)
+
+
+def _format_coordinates(coordinates):
+    if len(coordinates) > 0 and isinstance(coordinates[0], (int, float, np.number)):
+        return "[ " + ", ".join(_format_coordinate(float(value)) for value in coordinates) + " ]"
+    return "[ " + ", ".join(_format_coordinates(item) for item in coordinates) + " ]"
+
 
 class ProjectChange:
     """
@@ -393,9 +1688,10 @@ class ProjectChange:
         - __init__: Initializes the ProjectChange class with input parameters.
         - project_change: Main function to project changes and create GeoJSON files.
         - project_gis_layer: Helper function to handle GIS layer projection.
+        - geojson2kml: Writes the GIS layer as a kml or kmz file.
     """
 
-    def __init__(self, observation, project_name, projected_image_path, projected_events_folder, epsg=None, create_kml=False):
+    def __init__(self, observation, project_name, projected_image_path, projected_events_folder, epsg=None, create_kml=False, vertex_budget=None, create_kmz=False, footprints=None):
         ##############################
         ### INITIALIZING VARIABLES ###
         self.project = project_name
@@ -407,6 +1703,14 @@ class ProjectChange:
         self.geojson_name_gis = os.path.join(projected_events_folder,"%s_gis.geojson"%self.project)
         self.epsg = epsg
         self.create_kml = create_kml
+        # Write the kml file zipped, as kmz
+        self.create_kmz = create_kmz
+        self.gis_features = []
+        # Maximum number of vertices of the written polygons, None to keep all hull vertices
+        self.vertex_budget = vertex_budget
+        # 2D footprints of the geoObjects keyed by id (see extract_geoObjects_from_clusters),
+        # otherwise the footprint is the convex hull of the stored vertices
+        self.footprints = footprints if footprints is not None else {}
         ##############################
 
 
@@ -417,52 +1721,34 @@ class ProjectChange:
             # Get change events dictionnary in json file
             observation = utilities.read_json_file(self.observation)
 
-        for geoObject in observation["geoObjects"]:
-            # Fetch points
-            observation_pts_og = geoObject["geometry"]["coordinates"]
-            observation_pts_og = np.asarray(observation_pts_og)
-
+        self.gis_features = []
+        if self.epsg is not None:
             # GIS layer
-            geom = self.project_gis_layer(observation_pts_og)
-            # Create the schema for the attributes of the geojson
-            
-            schema = {
-                'geometry': geom,
-                'properties': {
-                    'startDateTime': 'str',
-                    'endDateTime': 'str',
-                    'id': 'str',
-                    'type': 'str',
-                    'dateTime': 'str',
-                    'customAttributes': 'str'
+            with GeoJSONWriter(self.geojson_name_gis, epsg=self.epsg) as geojson_gis:
+                for geoObject in observation["geoObjects"]:
+                    # Fetch points
+                    observation_pts_og = np.asarray(geoObject["geometry"]["coordinates"])
+                    self.project_gis_layer(observation_pts_og, self.footprints.get(geoObject["id"]))
+
+                    customAttributes = dict(geoObject['customAttributes'])
+                    customAttributes['centroid_X'] = float(self.centroid_gis[0])
+                    customAttributes['centroid_Y'] = float(self.centroid_gis[1])
+                    customAttributes['centroid_Z'] = float(self.centroid_gis[2])
+                    feature = {
+                        'geometry': mapping(self.geom_gis),
+                        'properties': {
+                            'startDateTime': str(observation["startDateTime"]),
+                            'endDateTime': str(observation["endDateTime"]),
+                            'id': str(geoObject["id"]),
+                            'type': str(geoObject["type"]),
+                            'dateTime': str(geoObject["dateTime"]),
+                            'customAttributes': customAttributes
+                        }
                     }
-                }
-            
-            # Open the shapefile to be able to write each polygon in it
-            geojson = fiona.open(self.geojson_name, 'w', 'GeoJSON', schema, None, 'binary')
-            if self.epsg is None:
-                break
-            else:
-                geojson_gis = fiona.open(self.geojson_name_gis, 'w', 'GeoJSON', schema, fiona.crs.CRS.from_epsg(self.epsg))
-                # Add the polygon to the main geojson file
-                customAttributes = list(geoObject['customAttributes'])
-                customAttributes.append([float(centroid[0]), float(centroid[1]), float(centroid[2])])
-                geojson_gis.write({
-                    'geometry': mapping(geom),
-                    'properties': {
-                        'startDateTime': str(observation["startDateTime"]),
-                        'endDateTime': str(observation["endDateTime"]),
-                        'id': str(geoObject["id"]),
-                        'type': str(geoObject["type"]),
-                        'dateTime': str(geoObject["dateTime"]),
-                        'customAttributes': json.dumps(customAttributes)
-                    }
-                })
-
-        if self.epsg is not None:
-            try:
-                geojson_gis.close()
-            except:
+                    # Add the polygon to the GIS geojson file, and keep it for the kml export
+                    geojson_gis.write(feature['geometry'], feature['properties'])
+                    self.gis_features.append(feature)
+            if len(observation["geoObjects"]) == 0:
                 print("No observation detected")
 
         # Load EXIF data from an image
@@ -489,200 +1775,218 @@ class ProjectChange:
         v_fov_y = float(image_metadata_loaded['v_fov_y'])
         res = float(image_metadata_loaded['res'])
         top_view = json.loads(image_metadata_loaded['top_view'].lower()) # Using json.loads() method to convert the string "True"/"False" to a boolean
+
+        # Features are streamed to the pixel geojson file in batches
+        with GeoJSONWriter(self.geojson_name) as geojson:
+            for geoObject in observation["geoObjects"]:
+                # Fetch points
+                observation_pts_og = geoObject["geometry"]["coordinates"]
+                observation_pts_og = np.asarray(observation_pts_og)
         
-        for geoObject in observation["geoObjects"]:
-            # Fetch points
-            observation_pts_og = geoObject["geometry"]["coordinates"]
-            observation_pts_og = np.asarray(observation_pts_og)
-        
-            # If top_view is True, rotate the observations the same way the point cloud was rotated to make the top view
-            if top_view:
-                observation_pts = utilities.rotate_to_top_view(
-                    observation_pts_og, 
-                    pc_mean_x,
-                    pc_mean_y,
-                    pc_mean_z
-                )
-            else:
-                observation_pts = observation_pts_og.copy()
+                # If top_view is True, rotate the observations the same way the point cloud was rotated to make the top view
+                if top_view:
+                    observation_pts = utilities.rotate_to_top_view(
+                        observation_pts_og, 
+                        pc_mean_x,
+                        pc_mean_y,
+                        pc_mean_z
+                    )
+                else:
+                    observation_pts = observation_pts_og.copy()
             
-            # Translation of point cloud coordinates for the scanner position of (0, 0, 0)
-            observation_pts = observation_pts - np.asarray([camera_position_x, camera_position_y, camera_position_z])
-
-            # Transformation from cartesian coordinates (x, y, z) to spherical coordinates (r, θ, φ)
-            r, theta, phi = utilities.xyz_2_spherical(observation_pts)
-            theta, phi = np.rad2deg(theta), np.rad2deg(phi)
-
-            # Discretize angles to image coordinates
-            if np.floor(max(theta)) - np.floor(min(theta)) > 180:
-                mask = theta < 0
-                theta[mask] += 360
-
-            if np.floor(max(phi)) - np.floor(min(phi)) > 180:
-                mask = phi < 0
-                phi[mask] += 360
-
-            # Transformation from spherical coordinates (r, θ, φ) to pixel coordinates (u, v)
-            u = np.round((theta - h_fov_x) / res).astype(int)
-            v = np.round((phi - v_fov_x) / res).astype(int)
-            change_points_uv = np.c_[u, v]
-
-            # Create the geometry
-            list_points = []
-            if change_points_uv.shape[0] == 1:   # If ther
-                list_points.append([int(v_img_res - change_points_uv[0, 1]), -int(change_points_uv[0, 0])])
-                geom = Point(np.array(list_points))
+                # Translation of point cloud coordinates for the scanner position of (0, 0, 0)
+                observation_pts = observation_pts - np.asarray([camera_position_x, camera_position_y, camera_position_z])
+
+                # Transformation from cartesian coordinates (x, y, z) to spherical coordinates (r, θ, φ)
+                r, theta, phi = utilities.xyz_2_spherical(observation_pts)
+                theta, phi = np.rad2deg(theta), np.rad2deg(phi)
+
+                # Discretize angles to image coordinates
+                if np.floor(max(theta)) - np.floor(min(theta)) > 180:
+                    mask = theta < 0
+                    theta[mask] += 360
+
+                if np.floor(max(phi)) - np.floor(min(phi)) > 180:
+                    mask = phi < 0
+                    phi[mask] += 360
+
+                # Transformation from spherical coordinates (r, θ, φ) to pixel coordinates (u, v)
+                u = np.round((theta - h_fov_x) / res).astype(int)
+                v = np.round((phi - v_fov_x) / res).astype(int)
+                change_points_uv = np.c_[u, v]
+
+                # Create the geometry
+                list_points = []
+                if change_points_uv.shape[0] == 1:   # If ther
+                    list_points.append([int(v_img_res - change_points_uv[0, 1]), -int(change_points_uv[0, 0])])
+                    geom = Point(np.array(list_points))
             
-            elif change_points_uv.shape[0] < 3:   # If there are less than 3 points, create a LineString
-                for i in range(change_points_uv.shape[0]):
-                    list_points.append([int(v_img_res - change_points_uv[i, 1]), -int(change_points_uv[i, 0])])
+                elif change_points_uv.shape[0] < 3:   # If there are less than 3 points, create a LineString
+                    for i in range(change_points_uv.shape[0]):
+                        list_points.append([int(v_img_res - change_points_uv[i, 1]), -int(change_points_uv[i, 0])])
 
-                geom = LineString(np.array(list_points))
+                    geom = LineString(np.array(list_points))
 
-            else:
-                hull = ConvexHull(change_points_uv)
-
-                # Order the points anti-clockwise
-                for simplex in hull.vertices:
-                    list_points.append([int(v_img_res - change_points_uv[simplex, 1]), -int(change_points_uv[simplex, 0])])
-                
-                # Create the polygon
-                geom = Polygon(np.array(list_points))
-
-            # Compute centroid
-            centroid = np.mean(observation_pts_og, axis=0)
-            geoObject['customAttributes']['centroid_X'] = float(centroid[0])
-            geoObject['customAttributes']['centroid_Y'] = float(centroid[1])
-            geoObject['customAttributes']['centroid_Z'] = float(centroid[2])
-
-            # Add the polygon to the main shapefile
-            geojson.write({
-                'geometry': mapping(geom),
-                'properties': {
+                else:
+                    # Hull of the projected vertices, ordered anti-clockwise
+                    hull_vertices = geometry.convex_hull_indices(change_points_uv)
+                    hull_vertices = hull_vertices[geometry.simplify_ring(change_points_uv[hull_vertices], self.vertex_budget)]
+                    for simplex in hull_vertices:
+                        list_points.append([int(v_img_res - change_points_uv[simplex, 1]), -int(change_points_uv[simplex, 0])])
+
+                    # Create the polygon, or a line if the projected vertices are collinear
+                    geom = Polygon(np.array(list_points)) if len(list_points) >= 3 else LineString(np.array(list_points))
+
+                # Compute centroid
+                centroid = np.mean(observation_pts_og, axis=0)
+                geoObject['customAttributes']['centroid_X'] = float(centroid[0])
+                geoObject['customAttributes']['centroid_Y'] = float(centroid[1])
+                geoObject['customAttributes']['centroid_Z'] = float(centroid[2])
+
+                # Add the polygon to the main geojson file
+                geojson.write(mapping(geom), {
                     'startDateTime': str(observation["startDateTime"]),
                     'endDateTime': str(observation["endDateTime"]),
                     'id': str(geoObject["id"]),
                     'type': str(geoObject["type"]),
                     'dateTime': str(geoObject["dateTime"]),
-                    'customAttributes': json.dumps(geoObject['customAttributes'])
-                }
-            })
-
-        try:
-            geojson.close()
-        except:
-            # Exception already handled for 'geojson_gis.close()'
-            pass
+                    'customAttributes': geoObject['customAttributes']
+                })
 
-        if self.create_kml:
+        if self.create_kml or self.create_kmz:
             if self.epsg is not None:
-                self.geojson2kml()
+                self.geojson2kml(self.gis_features)
             else:
                 print("Cannot create kml file. EPSG not specified.")
 
 
-    def project_gis_layer(self, observation_pts_og):
-        observation_pts_xy = observation_pts_og[:,:2]
-        # Create the convex hull
-        try:
-            hull = ConvexHull(observation_pts_xy)
-            # Order the points anti-clockwise
-            list_points = []
-            for simplex in hull.vertices:
-                list_points.append([int(observation_pts_xy[simplex, 1]), -int(observation_pts_xy[simplex, 0])])
-            
+    def project_gis_layer(self, observation_pts_og, footprint=None):
+        # Footprint of the observation, reused when computed by the hull engine
+        if footprint is not None and len(footprint) > 0:
+            observation_pts_xy = np.asarray(footprint)[:, :2]
+        else:
+            observation_pts_xy = observation_pts_og[:, :2]
+            observation_pts_xy = observation_pts_xy[geometry.convex_hull_indices(observation_pts_xy)]
+        observation_pts_xy = observation_pts_xy[geometry.simplify_ring(observation_pts_xy, self.vertex_budget)]
+        # Compute centroid
+        self.centroid_gis = np.mean(observation_pts_og, axis=0)
+
+        if observation_pts_xy.shape[0] >= 3:
             # Create the polygon
-            list_points = np.asarray(list_points)
-            list_points.T[[0, 1]] = list_points.T[[1, 0]]
-            list_points[:, 0] *= -1
-            self.geom_gis = Polygon(np.array(list_points))
-            # Compute centroid
-            self.centroid_gis = np.mean(observation_pts_og, axis=0)
+            self.geom_gis = Polygon(observation_pts_xy.astype(int))
             return 'Polygon'
+        elif observation_pts_xy.shape[0] > 1:
+            # Create the vector
+            self.geom_gis = LineString(np.array(observation_pts_xy))
+            return 'LineString'
+        else:
+            # Create the point
+            self.geom_gis = Point(np.array(observation_pts_xy[0]))
+            return 'Point'
+
+
+    def geojson2kml(self, features=None, kmz=None):
+        """
+        Write the GIS observations to a KML file, or a zipped KMZ file.
+        The vertices of all polygons are transformed to WGS84 in a single call, and the Placemarks are
+        streamed to the file as they are formatted.
+        :param features: List of GeoJSON-like features in the EPSG of the project. Read from the GIS
+            geojson file if not given.
+        :param kmz: Whether to write a KMZ file. Defaults to the create_kmz attribute.
+        """
+        kmz = self.create_kmz if kmz is None else kmz
+        if features is None:
+            geojson_data = utilities.read_json_file(self.geojson_name_gis) or {}
+            features = geojson_data.get("features", [])
+        self.kml_name_gis = os.path.abspath(
+            os.path.splitext(self.geojson_name_gis)[0] + (".kmz" if kmz else ".kml")
+        )
 
-        except:
-            if np.array(observation_pts_xy).shape[0] > 1:
-                # Create the vector
-                self.geom_gis = LineString(np.array(observation_pts_xy))
-                # Compute centroid
-                self.centroid_gis = np.mean(observation_pts_og, axis=0)
-                return 'LineString'
-            else:
-                # Create the point
-                self.geom_gis = Point(np.array(observation_pts_xy))
-                # Compute centroid
-                self.centroid_gis = np.mean(observation_pts_og, axis=0)
-                return 'Point'
-
-
-
-    def geojson2kml(self):
-        self.kml_name_gis = self.geojson_name_gis.replace('.geojson', ".kml")
-        self.kml_name_gis = f"{os.path.abspath('.')}/{self.kml_name_gis}"
-        geojson_data = utilities.read_json_file(self.geojson_name_gis)
-
-        transformer = Transformer.from_crs(f"EPSG:{self.epsg}", "EPSG:4326", always_xy=True)
-        #############################
-
-        # Initialize KML structure
-        kml = Element('kml', xmlns="http://www.opengis.net/kml/2.2")
-        document = SubElement(kml, 'Document', id="root_doc")
-
-        # Folder for Placemarks
-        folder = SubElement(document, 'Folder')
-        folder_name = SubElement(folder, 'name')
-        folder_name.text = "observations_gis"
-
-        # Fetch fields
-        field_names = list(geojson_data['features'][0]['properties'].keys())
-        fields = []
-
-        # Generate Placemarks from GeoJSON
-        for feature in geojson_data.get("features", []):
-            properties = feature.get("properties", {})
+        # Gather the vertices of all polygons, to transform them at once
+        vertices = []
+        for feature in features:
             geometry = feature.get("geometry", {})
-            
-            for field in field_names:
-                propertie = str(properties.get(field, "string"))
-                fields.append((field, propertie))
-            
-            # Extract coordinates
-            coordinates = ""
             if geometry.get("type") == "Polygon":
-                for ring in geometry.get("coordinates", []):
-                    for lon, lat in ring:
-                        lon, lat = transformer.transform(lon, lat)
-                        coordinates += f"{lon},{lat} "
-            
-            # Create Placemark
-            placemark = SubElement(folder, 'Placemark')
-            style = SubElement(placemark, 'Style')
-            line_style = SubElement(style, 'LineStyle')
-            line_width = SubElement(line_style, 'width')
-            line_width.text = "4"
-            line_color = SubElement(line_style, 'color')
-            line_color.text = "ff0000ff"
-            poly_style = SubElement(style, 'PolyStyle')
-            fill = SubElement(poly_style, 'fill')
-            fill.text = "0"
-            
-            extended_data = SubElement(placemark, 'ExtendedData')
-            schema_data = SubElement(extended_data, 'SchemaData', schemaUrl="#observations_gis")
-            
-            # Add properties to SchemaData
-            for name, value in fields:
-                simple_data = SubElement(schema_data, 'SimpleData', name=name)
-                simple_data.text = value
+                vertices.append(np.concatenate(
+                    [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in geometry.get("coordinates", [])]
+                ))
+            else:
+                vertices.append(np.empty((0, 2)))
+        counts = [vertex.shape[0] for vertex in vertices]
+        if sum(counts) > 0:
+            transformer = utilities.get_transformer(self.epsg, 4326, always_xy=True)
+            all_vertices = np.concatenate(vertices)
+            lon, lat = transformer.transform(all_vertices[:, 0], all_vertices[:, 1])
+        else:
+            lon = lat = np.empty(0)
 
+        if kmz:
+            with zipfile.ZipFile(self.kml_name_gis, "w", zipfile.ZIP_DEFLATED) as archive:
+                with archive.open("doc.kml", "w") as binary_file:
+                    with io.TextIOWrapper(binary_file, encoding="utf-8") as file:
+                        self._write_kml(file, features, lon.tolist(), lat.tolist(), counts)
+        else:
+            with open(self.kml_name_gis, "w", encoding="utf-8") as file:
+                self._write_kml(file, features, lon.tolist(), lat.tolist(), counts)
+
+
+    def _write_kml(self, file, features, lon, lat, counts):
+        # Same layout as the former xml.dom.minidom pretty-printed output
+        file.write(
+            '<?xml version="1.0" ?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+            '  <Document id="root_doc">\n'
+            '    <Folder>\n'
+            '      <name>observations_gis</name>\n'
+        )
+        start = 0
+        for feature, count in zip(features, counts):
+            # Properties written as SimpleData, dictionaries and lists as JSON
+            simple_data = []
+            for name, value in feature.get("properties", {}).items():
+                value = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+                name = escape(str(name), {'"': "&quot;"})
+                if value:
+                    value = escape(value, {'"': "&quot;"})
+                    simple_data.append(f'            <SimpleData name="{name}">{value}</SimpleData>\n')
+                else:
+                    simple_data.append(f'            <SimpleData name="{name}"/>\n')
+
+            placemark = [
+                '      <Placemark>\n'
+                '        <Style>\n'
+                '          <LineStyle>\n'
+                '            <width>4</width>\n'
+                '            <color>ff0000ff</color>\n'
+                '          </LineStyle>\n'
+                '          <PolyStyle>\n'
+                '            <fill>0</fill>\n'
+                '          </PolyStyle>\n'
+                '        </Style>\n'
+                '        <ExtendedData>\n'
+                '          <SchemaData schemaUrl="#observations_gis">\n',
+                *simple_data,
+                '          </SchemaData>\n'
+                '        </ExtendedData>\n'
+            ]
             # Add Polygon geometry
-            if coordinates:
-                polygon = SubElement(placemark, 'Polygon')
-                outer_boundary = SubElement(polygon, 'outerBoundaryIs')
-                linear_ring = SubElement(outer_boundary, 'LinearRing')
-                coord_element = SubElement(linear_ring, 'coordinates')
-                coord_element.text = coordinates.strip()
-                
-        # Beautify the output XML
-        kml_str = xml.dom.minidom.parseString(tostring(kml)).toprettyxml(indent="  ")
-        with open(self.kml_name_gis, 'w') as file:
-            file.write(kml_str)
\ No newline at end of file
+            if count > 0:
+                coordinates = " ".join(f"{x},{y}" for x, y in zip(lon[start:start + count], lat[start:start + count]))
+                placemark.append(
+                    '        <Polygon>\n'
+                    '          <outerBoundaryIs>\n'
+                    '            <LinearRing>\n'
+                    f'              <coordinates>{coordinates}</coordinates>\n'
+                    '            </LinearRing>\n'
+                    '          </outerBoundaryIs>\n'
+                    '        </Polygon>\n'
+                )
+            placemark.append('      </Placemark>\n')
+            file.write("".join(placemark))
+            start += count
+
+        file.write(
+            '    </Folder>\n'
+            '  </Document>\n'
+            '</kml>\n'
+        )
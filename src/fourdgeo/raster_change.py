@@ -0,0 +1,209 @@
+import numpy as np
+import cv2
+import rasterio
+
+from fourdgeo import utilities, change
+
+
+def projection_grid(pc_projection):
+    """
+    Image geometry of a PCloudProjection after project_pc, needed to go between pixels and 3D.
+    :param pc_projection: The PCloudProjection object.
+    :return: Dictionary with the fields of view, resolution, camera position, anchor point and view.
+    """
+    return {
+        "h_fov": tuple(float(value) for value in pc_projection.h_fov),
+        "v_fov": tuple(float(value) for value in pc_projection.v_fov),
+        "res": float(pc_projection.v_res),
+        "h_img_res": int(pc_projection.h_img_res),
+        "v_img_res": int(pc_projection.v_img_res),
+        "camera_position": [float(value) for value in pc_projection.camera_position],
+        "anchor_point_xyz": [float(value) for value in pc_projection.anchor_point_xyz],
+        "top_view": bool(pc_projection.top_view),
+    }
+
+
+def read_raw_range(filename):
+    """
+    Read a raw range raster written by PCloudProjection.save_raw_range.
+    :param filename: Path of the _RawRange.tif file.
+    :return: The range image in metres in the orientation of PCloudProjection.range_raster (NaN where
+        empty), and the image geometry read from the tags (see projection_grid).
+    """
+    with rasterio.open(filename) as src:
+        data = src.read(1)
+        occupancy = src.read_masks(1) > 0
+        tags = src.tags()
+
+    range_m = np.full(data.shape, np.nan, dtype=np.float32)
+    if data.dtype == np.uint16:
+        range_m[occupancy] = float(tags["range_offset"]) + (data[occupancy] - 1.0) * float(tags["range_scale"])
+    else:
+        range_m[occupancy] = data[occupancy]
+
+    # The rasters are flipped left to right like the shaded images
+    return np.fliplr(range_m), grid_from_tags(tags)
+
+
+def grid_from_tags(tags):
+    """
+    Image geometry from the tags written with the images by PCloudProjection.
+    :param tags: Dictionary of the tags, as read by rasterio.
+    :return: The image geometry, see projection_grid.
+    """
+    return {
+        "h_fov": (float(tags["h_fov_x"]), float(tags["h_fov_y"])),
+        "v_fov": (float(tags["v_fov_x"]), float(tags["v_fov_y"])),
+        "res": float(tags["res"]),
+        "h_img_res": int(tags["h_img_res"]),
+        "v_img_res": int(tags["v_img_res"]),
+        "camera_position": [float(tags[f"camera_position_{axis}"]) for axis in "xyz"],
+        "anchor_point_xyz": [float(tags[f"pc_mean_{axis}"]) for axis in "xyz"],
+        "top_view": tags["top_view"] == "True",
+    }
+
+
+def range_difference(range_0, range_1):
+    """
+    Per pixel range difference of two epochs projected on the same reference grid.
+    :param range_0: Raw range image (PCloudProjection.range_raster) of the first epoch, NaN where empty.
+    :param range_1: Raw range image of the second epoch.
+    :return: range_1 - range_0 in metres, NaN where one of the epochs has no point. Positive values
+        are surfaces moving away from the scanner (e.g. a rockfall), negative ones towards it.
+    """
+    return np.subtract(range_1, range_0, dtype=np.float32)
+
+
+def detect_range_changes(range_0, range_1, threshold, opening_size=3, closing_size=3, min_area=10):
+    """
+    Label the regions of significant range change between two epochs.
+    Pixels whose absolute range difference reaches the threshold are cleaned with a morphological
+    opening (removes isolated pixels) and closing (fills small holes), then grouped into 8-connected
+    components, the smaller ones being dropped.
+    :param range_0: Raw range image of the first epoch.
+    :param range_1: Raw range image of the second epoch.
+    :param threshold: The minimum absolute range difference in metres.
+    :param opening_size: Size of the square opening kernel, values below 2 disable the opening.
+    :param closing_size: Size of the square closing kernel, values below 2 disable the closing.
+    :param min_area: The minimum number of pixels of a region.
+    :return: The label image (0 for no change, 1..n for the regions), the number of regions n and
+        the range difference image.
+    """
+    difference = range_difference(range_0, range_1)
+    with np.errstate(invalid="ignore"):
+        mask = (np.abs(difference) >= threshold).astype(np.uint8)
+    if opening_size is not None and opening_size >= 2:
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((opening_size, opening_size), np.uint8))
+    if closing_size is not None and closing_size >= 2:
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((closing_size, closing_size), np.uint8))
+
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    # Drop the small regions and number the others consecutively
+    keep = np.zeros(n_labels, dtype=np.int32)
+    large = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area) + 1
+    keep[large] = np.arange(1, large.shape[0] + 1)
+    return keep[labels], int(large.shape[0]), difference
+
+
+def pixels_to_xyz(u, v, ranges, grid):
+    """
+    Back-project pixels with their range to 3D, the inverse of PCloudProjection.main_projection.
+    :param u: Row (horizontal angle) indices of the pixels.
+    :param v: Column (vertical angle) indices of the pixels.
+    :param ranges: Range of the pixels in metres.
+    :param grid: The image geometry, see projection_grid.
+    :return: Array of the points with shape (n, 3), in the coordinates of the point cloud.
+    """
+    theta = np.deg2rad(grid["h_fov"][0] + np.asarray(u) * grid["res"])
+    phi = np.deg2rad(grid["v_fov"][0] + np.asarray(v) * grid["res"])
+    # Inverse of utilities.xyz_2_spherical
+    dxy = ranges * np.sin(theta)
+    xyz = np.c_[dxy * np.cos(phi), dxy * np.sin(phi), ranges * np.cos(theta)]
+    xyz += grid["camera_position"]
+    if grid["top_view"]:
+        xyz = utilities.rotate_from_top_view(xyz, *grid["anchor_point_xyz"])
+    return xyz
+
+
+def xyz_to_pixels(xyz, grid):
+    """
+    Pixel indices of 3D points, as computed by PCloudProjection.main_projection.
+    :param xyz: Array of the points with shape (n, 3).
+    :param grid: The image geometry, see projection_grid.
+    :return: The u and v indices of the points, and a mask of the points inside the image.
+    """
+    xyz = np.array(xyz, dtype=np.float64)
+    if grid["top_view"]:
+        xyz = utilities.rotate_to_top_view(xyz, *grid["anchor_point_xyz"])
+    xyz -= grid["camera_position"]
+    _, theta, phi = utilities.xyz_2_spherical(xyz)
+    theta_deg, phi_deg = np.rad2deg(theta), np.rad2deg(phi)
+    # Grids crossing ±180° were built with the negative angles shifted by 360°
+    if grid["h_fov"][1] > 180:
+        theta_deg[theta_deg < 0] += 360
+    if grid["v_fov"][1] > 180:
+        phi_deg[phi_deg < 0] += 360
+    u = np.round((theta_deg - grid["h_fov"][0]) / grid["res"]).astype(int)
+    v = np.round((phi_deg - grid["v_fov"][0]) / grid["res"]).astype(int)
+    inside = (u >= 0) & (u < grid["h_img_res"]) & (v >= 0) & (v < grid["v_img_res"])
+    return u, v, inside
+
+
+def range_changes_to_clusters(labels, difference, range_0, grid):
+    """
+    Turn labelled change regions into clustered changes, in the format of cluster_m3c2_changes.
+    Each changed pixel is back-projected at its range in the first epoch and carries the range
+    difference as distance. Pixels added by the closing without a range in both epochs are skipped.
+    :return: Array with shape (m, 5): x, y, z, distance and label.
+    """
+    u, v = np.nonzero((labels > 0) & np.isfinite(difference))
+    xyz = pixels_to_xyz(u, v, range_0[u, v], grid)
+    return np.column_stack((xyz, difference[u, v], labels[u, v]))
+
+
+def detect_raster_changes(
+    range_0, range_1, grid, endDateTime, filename_0, filename_1, threshold,
+    opening_size=3, closing_size=3, min_area=10, vertex_budget=None
+):
+    """
+    Fast change detector on the range images of two epochs, emitting geoObjects in the format of
+    extract_geoObjects_from_clusters.
+    :param range_0: Raw range image (PCloudProjection.range_raster) of the first epoch.
+    :param range_1: Raw range image of the second epoch, on the same reference grid.
+    :param grid: The image geometry, see projection_grid.
+    :param endDateTime: The end date and time of the observation.
+    :param filename_0: The filename of the first epoch.
+    :param filename_1: The filename of the second epoch.
+    :param threshold: The minimum absolute range difference in metres, see detect_range_changes.
+    :return: A list of geoObjects, empty if nothing changed.
+    """
+    labels, n_regions, difference = detect_range_changes(
+        range_0, range_1, threshold, opening_size, closing_size, min_area
+    )
+    if n_regions == 0:
+        return []
+    clusters = range_changes_to_clusters(labels, difference, range_0, grid)
+    return change.extract_geoObjects_from_clusters(
+        clusters, endDateTime, filename_0, filename_1, vertex_budget=vertex_budget
+    ) or []
+
+
+def prescreen_corepoints(corepoints, labels, grid, buffer_px=2):
+    """
+    Restrict M3C2 corepoints to the regions flagged by detect_range_changes.
+    :param corepoints: Array of the corepoints with shape (n, 3).
+    :param labels: The label image of detect_range_changes.
+    :param grid: The image geometry, see projection_grid.
+    :param buffer_px: The regions are grown by this many pixels, to keep the corepoints at their edges.
+    :return: Boolean mask of the corepoints inside a flagged region. All False when nothing changed,
+        so the pair can be skipped.
+    """
+    flagged = (labels > 0).astype(np.uint8)
+    if not flagged.any():
+        return np.zeros(len(corepoints), dtype=bool)
+    if buffer_px:
+        flagged = cv2.dilate(flagged, np.ones((2 * buffer_px + 1, 2 * buffer_px + 1), np.uint8))
+    u, v, inside = xyz_to_pixels(corepoints, grid)
+    selected = np.zeros(len(corepoints), dtype=bool)
+    selected[inside] = flagged[u[inside], v[inside]].astype(bool)
+    return selected
@@ -0,0 +1,292 @@
+import os
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from fourdgeo import projection, change
+
+
+class TaskResult:
+    """
+    Placeholder for the result of a task in the arguments of another task.
+    Indexing it (ref["key"]) refers to an item of the result.
+    """
+
+    def __init__(self, key, path=()):
+        self.key = key
+        self.path = path
+
+    def __getitem__(self, item):
+        return TaskResult(self.key, self.path + (item,))
+
+    def __repr__(self):
+        return f"TaskResult({self.key!r}, {self.path!r})"
+
+
+def _dependencies(value, keys):
+    # Collect the keys of the TaskResults nested in lists, tuples and dicts
+    if isinstance(value, TaskResult):
+        keys.add(value.key)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _dependencies(item, keys)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _dependencies(item, keys)
+    return keys
+
+
+def _resolve(value, results):
+    if isinstance(value, TaskResult):
+        resolved = results[value.key]
+        for item in value.path:
+            resolved = resolved[item]
+        return resolved
+    if isinstance(value, list):
+        return [_resolve(item, results) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_resolve(item, results) for item in value)
+    if isinstance(value, dict):
+        return {key: _resolve(item, results) for key, item in value.items()}
+    return value
+
+
+def _run_task(function, args, kwargs, dependency_keys, *dependency_results):
+    # Runs on the worker, the dependency results are passed positionally so that Dask resolves its futures
+    results = dict(zip(dependency_keys, dependency_results))
+    return function(*_resolve(args, results), **_resolve(kwargs, results))
+
+
+class TaskGraph:
+    """
+    Graph of the units of work of a time series, executed by a scheduler.
+
+    Tasks are added with the function to call and its arguments. Arguments may contain the
+    TaskResult returned by add for another task, which makes that task a dependency and is replaced
+    by its result before the call. This is how the reference geometry of epoch 0 reaches all the
+    projection tasks of the later epochs.
+
+    Methods:
+        - add: Adds a task, returns a TaskResult placeholder of its result.
+        - order: Returns the task keys in an order that respects the dependencies.
+        - run: Executes the graph with a scheduler (LocalScheduler by default).
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+
+    def add(self, key, function, *args, **kwargs):
+        """
+        Add a task to the graph.
+        :param key: Unique key of the task, used in the results of run.
+        :param function: Module-level function to call, so that it can be sent to worker processes.
+        :return: A TaskResult placeholder, to be used in the arguments of other tasks.
+        """
+        if key in self.tasks:
+            raise ValueError(f"Task {key!r} already exists.")
+        dependencies = _dependencies(args, set())
+        _dependencies(kwargs, dependencies)
+        missing = dependencies.difference(self.tasks)
+        if missing:
+            raise KeyError(f"Task {key!r} depends on unknown tasks: {list(missing)}")
+        self.tasks[key] = (function, args, kwargs, list(dependencies))
+        return TaskResult(key)
+
+
+    def order(self):
+        # Tasks can only depend on earlier tasks, so the insertion order is a valid order
+        return list(self.tasks)
+
+
+    def run(self, scheduler=None):
+        """
+        Execute the graph.
+        :param scheduler: A LocalScheduler or a DaskScheduler. Defaults to a LocalScheduler.
+        :return: Dictionary of the results by task key.
+        """
+        if scheduler is None:
+            scheduler = LocalScheduler()
+        return scheduler.run(self)
+
+
+class LocalScheduler:
+    """
+    Run a TaskGraph on a local process pool. A task is submitted as soon as all its dependencies
+    are done. With max_workers=1 the tasks run one after the other in the current process.
+    Workers are spawned rather than forked, as forking a process that already used GDAL or OpenCV
+    threads can deadlock.
+    With threads=True a thread pool is used instead, without spawning and pickling: the projection
+    tasks spend their time in NumPy, OpenCV and GDAL calls, which release the GIL.
+    """
+
+    def __init__(self, max_workers=None, threads=False):
+        self.max_workers = max_workers
+        self.threads = threads
+
+
+    def run(self, graph):
+        results = {}
+        if self.max_workers == 1:
+            for key in graph.order():
+                function, args, kwargs, dependencies = graph.tasks[key]
+                results[key] = _run_task(function, args, kwargs, dependencies, *[results[d] for d in dependencies])
+            return results
+
+        waiting = {key: set(graph.tasks[key][3]) for key in graph.order()}
+        running = {}
+        if self.threads:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        with executor:
+            while waiting or running:
+                for key in [key for key, dependencies in waiting.items() if not dependencies]:
+                    function, args, kwargs, dependencies = graph.tasks[key]
+                    future = executor.submit(_run_task, function, args, kwargs, dependencies, *[results[d] for d in dependencies])
+                    running[future] = key
+                    del waiting[key]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    try:
+                        results[key] = future.result()
+                    except Exception:
+                        for pending in running:
+                            pending.cancel()
+                        raise
+                    for dependencies in waiting.values():
+                        dependencies.discard(key)
+        return results
+
+
+class DaskScheduler:
+    """
+    Run a TaskGraph on a Dask distributed cluster. The results of the dependencies are passed to the
+    workers as futures, so they move between workers without going through the client. The Dask
+    keys are prefixed with a token per run, so that a client running several graphs, or the same
+    graph twice, never reuses the results of another run.
+    :param client: A dask.distributed Client. If None, a client of a new LocalCluster is used.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+
+
+    def run(self, graph):
+        # dask is optional, it is only needed for this scheduler
+        from dask.distributed import Client
+
+        client = self.client if self.client is not None else Client()
+        token = uuid.uuid4().hex
+        try:
+            futures = {}
+            for key in graph.order():
+                function, args, kwargs, dependencies = graph.tasks[key]
+                futures[key] = client.submit(
+                    _run_task, function, args, kwargs, dependencies, *[futures[d] for d in dependencies],
+                    key=f"{key}-{token}", pure=False
+                )
+            return dict(zip(futures, client.gather(list(futures.values()))))
+        finally:
+            if self.client is None:
+                client.close()
+
+
+###############################################
+# Units of work of the 4DGeo pipeline
+
+def project_epoch_task(configuration, pc_path, project_name, projected_image_folder, reference=None, buffer_m=0.5):
+    """
+    Project one epoch. Without reference, the epoch defines the reference geometry.
+    :param reference: The result of the projection task of the reference epoch.
+    :return: Dictionary with the "bg_image_filename" list and the "reference" geometry.
+    """
+    configuration = dict(configuration, pc_projection=dict(configuration["pc_projection"], pc_path=str(pc_path)))
+    background_projection = projection.PCloudProjection(
+        configuration=configuration,
+        project_name=project_name,
+        projected_image_folder=projected_image_folder,
+    )
+    if reference is None:
+        h_fov, v_fov, anchor_point_xyz, h_img_res, v_img_res = background_projection.project_pc(buffer_m=buffer_m)
+        reference = {
+            "h_fov": tuple(float(value) for value in h_fov),
+            "v_fov": tuple(float(value) for value in v_fov),
+            "anchor_point_xyz": tuple(float(value) for value in anchor_point_xyz),
+            "h_img_res": int(h_img_res),
+            "v_img_res": int(v_img_res),
+        }
+    else:
+        reference = reference["reference"]
+        background_projection.project_pc(
+            ref_theta=reference["h_fov"][0],
+            ref_phi=reference["v_fov"][0],
+            ref_anchor_point_xyz=reference["anchor_point_xyz"],
+            ref_h_fov=reference["h_fov"],
+            ref_v_fov=reference["v_fov"],
+            ref_h_img_res=reference["h_img_res"],
+            ref_v_img_res=reference["v_img_res"]
+        )
+    return {"bg_image_filename": background_projection.bg_image_filename, "reference": reference}
+
+
+def extract_changes_task(significant_changes, dbscan_eps, min_cluster_size, endDateTime, t1, t2, vertex_budget=None):
+    """
+    Cluster the significant changes of an epoch pair and extract their geoObjects.
+    :param significant_changes: Array of the significant changes with shape (m, 4), or a
+        (ChangeResultsStore folder, epoch_0, epoch_1, settings) tuple to load them on the worker.
+    :return: The list of geoObjects.
+    """
+    if isinstance(significant_changes, tuple):
+        folder, epoch_0, epoch_1, settings = significant_changes
+        significant_changes = change.ChangeResultsStore(folder).significant_changes(epoch_0, epoch_1, settings)
+    if significant_changes.shape[0] == 0:
+        return []
+    labeled = change.cluster_m3c2_changes(significant_changes, dbscan_eps, min_cluster_size)
+    return change.extract_geoObjects_from_clusters(labeled, endDateTime, t1, t2, vertex_budget=vertex_budget) or []
+
+
+def project_change_task(observation, project_name, projected_image_path, projected_events_folder, **kwargs):
+    """
+    Project the geoObjects of an observation on a background image.
+    :param projected_image_path: Path of the background image, or the result of a projection task.
+    :return: The path of the pixel GeoJSON file.
+    """
+    if isinstance(projected_image_path, dict):
+        projected_image_path = projected_image_path["bg_image_filename"][0]
+    observation_projection = projection.ProjectChange(
+        observation=observation,
+        project_name=project_name,
+        projected_image_path=projected_image_path,
+        projected_events_folder=projected_events_folder,
+        **kwargs
+    )
+    observation_projection.project_change()
+    return observation_projection.geojson_name
+
+
+def build_projection_graph(configuration, pc_paths, graph=None, buffer_m=0.5):
+    """
+    Add one projection task per epoch to a graph. The first epoch defines the reference geometry,
+    all the other epochs depend on it and run in parallel.
+    :param configuration: The configuration of PCloudProjection.
+    :param pc_paths: The sorted point cloud paths of the epochs.
+    :param graph: The TaskGraph to extend. A new one is created if None.
+    :return: The graph and the list of the TaskResults of the epochs.
+    """
+    graph = TaskGraph() if graph is None else graph
+    project_name = configuration["project_setting"]["project_name"]
+    output_folder = configuration["project_setting"]["output_folder"]
+
+    epochs = []
+    for enum, pc_path in enumerate(pc_paths):
+        # One project name per epoch, so that parallel tasks do not write to the same image
+        epoch_name = f"{project_name}_{os.path.splitext(os.path.basename(pc_path))[0]}"
+        epochs.append(graph.add(
+            ("project", os.path.basename(pc_path)), project_epoch_task,
+            configuration, pc_path, epoch_name, output_folder,
+            reference=epochs[0] if enum > 0 else None, buffer_m=buffer_m
+        ))
+    return graph, epochs
@@ -0,0 +1,103 @@
+import os
+import json
+
+import numpy as np
+
+from fourdgeo import manifest, image_store
+
+
+class TileStore:
+    """
+    Content-addressed store of the background image tiles of a time series.
+
+    Tiles are stored as PNG files named by the hash of their pixels, in an ImageStore without
+    observation index, so a tile that did not change between epochs, or that appears in several
+    series, is stored and downloaded once. Each epoch is described by a tile manifest listing the
+    window and hash of its tiles (see PCloudProjection.project_incremental), from which compose_tiles
+    assembles the full image. As tiles are referred to by the manifests, the store never deletes
+    them. The store also keeps the z-buffer of the last epoch of each series, against which the next
+    epoch is compared.
+
+    Methods:
+        - put_array: Stores a tile and returns its hash.
+        - path / read: Path and content of a stored tile.
+        - load_state / save_state: The z-buffer and tiles of the last epoch of a series.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        # Only the content-addressed files of the ImageStore are used, not its index
+        self._images = image_store.ImageStore(folder, objects_folder="tiles")
+
+
+    def put_array(self, image):
+        """
+        Store a tile, unless a tile with the same pixels is already stored.
+        :param image: uint8 image of shape (h, w) or (h, w, 3).
+        :return: The hash of the tile.
+        """
+        return self._images.put_array(image)
+
+
+    def path(self, image_hash):
+        return self._images.path(image_hash)
+
+
+    def read(self, image_hash):
+        return self._images.read(image_hash)
+
+
+    def _state_filenames(self, series):
+        return (
+            os.path.join(self.folder, f"{series}_state.json"),
+            os.path.join(self.folder, f"{series}_state.npz")
+        )
+
+
+    def load_state(self, series):
+        """
+        :param series: Name of the series.
+        :return: The state saved by save_state, None if the series has none.
+        """
+        json_filename, npz_filename = self._state_filenames(series)
+        if not os.path.isfile(json_filename) or not os.path.isfile(npz_filename):
+            return None
+        with open(json_filename, "r") as f:
+            state = json.load(f)
+        with np.load(npz_filename) as arrays:
+            state.update({key: arrays[key] for key in arrays.files})
+        return state
+
+
+    def save_state(self, series, state):
+        """
+        Save the state of the last epoch of a series.
+        :param series: Name of the series.
+        :param state: Dictionary of numpy arrays (the z-buffer) and of JSON serializable values.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        json_filename, npz_filename = self._state_filenames(series)
+        arrays = {key: value for key, value in state.items() if isinstance(value, np.ndarray)}
+        values = {key: value for key, value in state.items() if key not in arrays}
+        with manifest.atomic_output(npz_filename) as tmp_filename:
+            np.savez(tmp_filename, **arrays)
+        with manifest.atomic_output(json_filename) as tmp_filename:
+            with open(tmp_filename, "w") as f:
+                json.dump(values, f, indent=4)
+
+
+def compose_tiles(manifest_filename, image_type="Color"):
+    """
+    Assemble the full background image of an epoch from its tile manifest.
+    :param manifest_filename: The tile manifest written by PCloudProjection.project_incremental.
+    :param image_type: "Color" or "Range".
+    :return: The uint8 image, black where there is no tile.
+    """
+    with open(manifest_filename, "r") as f:
+        tile_manifest = json.load(f)
+    store = TileStore(tile_manifest["store"])
+    shape = (tile_manifest["height"], tile_manifest["width"])
+    image = np.zeros(shape + (3,) if image_type == "Color" else shape, dtype=np.uint8)
+    for tile in tile_manifest["images"][image_type]:
+        image[tile["row"]:tile["row"] + tile["height"], tile["col"]:tile["col"] + tile["width"]] = store.read(tile["hash"])
+    return image
@@ -7,14 +7,18 @@ import numpy as np
 
 from itertools import cycle
 from shutil import get_terminal_size
-from threading import Thread
+from threading import Thread, Lock
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
+import cv2
 import rasterio
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import matplotlib.colors as mcolors
 from shapely.geometry import shape
+from PIL import Image
 from scipy.spatial import ConvexHull
 
 from collections import defaultdict
@@ -30,6 +34,7 @@ from urllib.request import urlopen
 from shutil import copyfileobj
 
 import laspy
+from pyproj import CRS, Transformer
 
 
 def read_json_file(file_path):
@@ -278,6 +283,17 @@ def rotate_to_top_view(xyz, mean_x, mean_y, mean_z):
 
         return xyz
 
+
+def rotate_from_top_view(xyz, mean_x, mean_y, mean_z):
+        # Inverse of rotate_to_top_view, back to the coordinates of the point cloud
+        rotated = rotate_to_top_view(np.eye(3), 0.0, 0.0, 0.0)  # Rows are the rotated unit vectors
+        xyz = np.array(xyz, dtype=np.float64)
+        xyz -= (mean_x, mean_y, mean_z)
+        xyz = np.dot(xyz, np.linalg.inv(rotated))
+        xyz += (mean_x, mean_y, mean_z)
+
+        return xyz
+
 #loc2ref_TRIER()#
 
 
@@ -341,14 +357,14 @@ def build_pipeline_command(folder_path, config_file, default_cmd, use_every_xth_
     Returns:
         list: A sorted list of las or laz filenames found in the folder.
     """
-    # List all files in the folder
-    files = os.listdir(folder_path)
+    # List all files in the folder, in alphabetical order
+    files = sorted(os.listdir(folder_path))
   
     file_paths = []
     # Build full file paths for each las or laz file
     counter = 0
     for file in files:
-        if file.endswith('.last') or file.endswith('.laz'):
+        if file.endswith('.las') or file.endswith('.laz'):
             counter += 1
             # Skip files based on the use_every_xth_file parameter
             if counter % use_every_xth_file != 0 and counter != 1:
@@ -366,12 +382,18 @@ def build_pipeline_command(folder_path, config_file, default_cmd, use_every_xth_
     return command_str
 
 def tif_to_png(input_tif, output_png):
-    with Image.open(input_tif) as src:
+    """
+    Convert a GeoTIFF image of PCloudProjection to PNG.
+    The TIFF is read with rasterio, as PIL cannot read the sparse tiled GeoTIFFs of the sparse image
+    backend, whose unwritten blocks are read as black.
+    :return: The width and height of the image.
+    """
+    with rasterio.open(input_tif) as src:
         data = src.read()
-
-        img = Image.fromarray(array)
-        img.save(output_png)
-        print(f"Saved PNG to {output_png}")
+    # Bands last, a single band image is saved as grayscale
+    array = data[0] if data.shape[0] == 1 else np.moveaxis(data, 0, 2)
+    Image.fromarray(np.ascontiguousarray(array)).save(output_png)
+    return array.shape[1], array.shape[0]
 
 
 def plot_change_events(change_event_file, img_path, event_type_col=None, colors=None, figsize=(8,6)):
@@ -440,6 +462,150 @@ def plot_change_events(change_event_file, img_path, event_type_col=None, colors=
     plt.show()
 
 
+def _event_color_map(features, event_type_col=None, colors=None):
+    # Same color assignment as plot_change_events, as BGR tuples for OpenCV
+    event_types = np.unique([str(f.get('properties', {}).get(event_type_col)) for f in features]) if event_type_col else np.array(["None"])
+    if isinstance(colors, list):
+        if event_types.shape[0] > len(colors):
+            raise ValueError(f"Only {len(colors)} colors defined but {len(event_types)} classes found.")
+        hex_colors = colors[:len(event_types)]
+    elif isinstance(colors, str) and event_type_col is None:
+        hex_colors = [colors]
+    elif event_type_col is None:
+        hex_colors = ["yellow"]
+    else:
+        cmap = plt.get_cmap(colors if colors is not None else 'summer', len(event_types))
+        hex_colors = [mcolors.to_hex(cmap(i)) for i in range(len(event_types))]
+    return {
+        event_type: tuple(int(round(255 * c)) for c in mcolors.to_rgb(color)[::-1])
+        for event_type, color in zip(event_types, hex_colors)
+    }
+
+
+def _read_background(img_path):
+    # Background image as an 8-bit BGR array
+    with rasterio.open(img_path) as src:
+        img = src.read(list(range(1, min(src.count, 3) + 1)))
+    if img.dtype != np.uint8:
+        img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    img = np.moveaxis(img, 0, -1)
+    if img.shape[2] == 1:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return np.ascontiguousarray(img[..., ::-1])
+
+
+def render_change_events(change_event_file, img_path, out_path, event_type_col=None, colors=None, line_width=2, point_radius=4):
+    """
+    Draw the change events of a pixel GeoJSON file onto their background image, without a display.
+
+    All polygons and lines of one color are drawn in a single cv2.polylines call on the 8-bit image.
+
+    Parameters:
+        change_event_file (str): Path to the pixel GeoJSON file written by ProjectChange.
+        img_path (str): Path to the background image.
+        out_path (str): Path of the output frame. The format follows the extension (.png, .webp, .jpg).
+        event_type_col (str): Property used to color the events, as in plot_change_events.
+        colors (list or str): List of colors, one per event type, or the name of a matplotlib colormap.
+            Without event_type_col, a single color. Defaults to the 'summer' colormap, or yellow.
+        line_width (int): Width of the outlines in pixels.
+        point_radius (int): Radius of the point events in pixels.
+
+    Returns:
+        str: The path of the written frame.
+    """
+    img = _read_background(img_path)
+    with open(change_event_file, 'r') as f:
+        features = json.load(f)['features']
+    color_map = _event_color_map(features, event_type_col, colors)
+
+    # Group the outlines by color, pixel geojson y coordinates are negated
+    outlines = defaultdict(list)
+    points = defaultdict(list)
+    for feat in features:
+        event_type = str(feat.get('properties', {}).get(event_type_col)) if event_type_col else "None"
+        geometry = feat['geometry']
+        # Features without geometry (e.g. with non-finite coordinates, see GeoJSONWriter) are skipped
+        if geometry is None:
+            continue
+        coordinates = np.asarray(
+            geometry['coordinates'][0] if geometry['type'] == 'Polygon' else geometry['coordinates'],
+            dtype=np.float64
+        )
+        pixels = np.rint(coordinates.reshape(-1, 2) * [1, -1]).astype(np.int32)
+        if geometry['type'] == 'Point':
+            points[event_type].append(pixels[0])
+        else:
+            outlines[(event_type, geometry['type'] == 'Polygon')].append(pixels)
+
+    for (event_type, is_closed), polylines in outlines.items():
+        cv2.polylines(img, polylines, is_closed, color_map[event_type], line_width, cv2.LINE_AA)
+    for event_type, centers in points.items():
+        for center in centers:
+            cv2.circle(img, (int(center[0]), int(center[1])), point_radius, color_map[event_type], -1, cv2.LINE_AA)
+
+    out_folder = os.path.dirname(out_path)
+    if out_folder and not os.path.isdir(out_folder):
+        os.makedirs(out_folder)
+    cv2.imwrite(out_path, img)
+    return out_path
+
+
+def render_change_event_series(change_event_files, img_paths, out_folder, frame_format="png", max_workers=None, **kwargs):
+    """
+    Render the change events of a whole time series in parallel, one frame per observation.
+
+    Parameters:
+        change_event_files (list): Paths to the pixel GeoJSON files, one per observation.
+        img_paths (list or str): Background image of each observation, or one shared background.
+        out_folder (str): Folder of the frames, named frame_00000.<frame_format>, ...
+        frame_format (str): Image format of the frames, e.g. "png" or "webp".
+        max_workers (int): Number of spawned processes. Defaults to the number of CPUs.
+        **kwargs: Passed to render_change_events.
+
+    Returns:
+        list: The paths of the frames, in the order of change_event_files.
+    """
+    if isinstance(img_paths, (str, os.PathLike)):
+        img_paths = [img_paths] * len(change_event_files)
+    out_paths = [
+        os.path.join(out_folder, f"frame_{i:05d}.{frame_format}") for i in range(len(change_event_files))
+    ]
+    # Spawned workers, as forking after GDAL or OpenCV were used can deadlock
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            executor.submit(render_change_events, change_event_file, img_path, out_path, **kwargs)
+            for change_event_file, img_path, out_path in zip(change_event_files, img_paths, out_paths)
+        ]
+        return [future.result() for future in futures]
+
+
+def frames_to_animation(frame_paths, out_path, duration_ms=1000):
+    """
+    Assemble rendered frames into an animated GIF, or an MP4 video if out_path ends with .mp4.
+
+    Parameters:
+        frame_paths (list): Paths to the frames, all of the same size.
+        out_path (str): Path of the animation.
+        duration_ms (int): Display duration of each frame in milliseconds.
+
+    Returns:
+        str: The path of the animation.
+    """
+    if out_path.lower().endswith(".mp4"):
+        first = cv2.imread(frame_paths[0])
+        height, width = first.shape[:2]
+        writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*"mp4v"), 1000.0 / duration_ms, (width, height))
+        try:
+            for frame_path in frame_paths:
+                writer.write(cv2.imread(frame_path))
+        finally:
+            writer.release()
+    else:
+        frames = [Image.open(frame_path).convert("RGB") for frame_path in frame_paths]
+        frames[0].save(out_path, save_all=True, append_images=frames[1:], duration=duration_ms, loop=0)
+    return out_path
+
+
 ###############################################
 # Handling online files
 
@@ -510,6 +676,86 @@ def plot_change_events(change_event_file, img_path, event_type_col=None, colors=
 
 
 
+###############################################
+# Coordinate reference systems
+
+# Process-wide caches of the pyproj objects. CRS and Transformer objects are thread-safe since
+# pyproj 3.1, the lock only guards their creation.
+_crs_cache = {}
+_transformer_cache = {}
+_proj_cache_lock = Lock()
+
+
+def _crs_key(crs):
+    # Normalise 32632, "32632" and "epsg:32632" to "EPSG:32632"
+    if isinstance(crs, CRS):
+        return crs.to_wkt()
+    crs = str(crs).strip()
+    if crs.isdigit():
+        return f"EPSG:{crs}"
+    if crs.upper().startswith("EPSG:"):
+        return crs.upper()
+    return crs
+
+
+def get_crs(crs):
+    """
+    Get a cached pyproj CRS.
+
+    Parameters:
+        crs (int, str or CRS): EPSG code, or any input accepted by pyproj.CRS.from_user_input.
+
+    Returns:
+        CRS: The same object for every call with the same CRS, in the whole process.
+    """
+    key = _crs_key(crs)
+    cached = _crs_cache.get(key)
+    if cached is None:
+        with _proj_cache_lock:
+            cached = _crs_cache.get(key)
+            if cached is None:
+                cached = CRS.from_user_input(crs if isinstance(crs, CRS) else key)
+                _crs_cache[key] = cached
+    return cached
+
+
+def get_transformer(src, dst, always_xy=True):
+    """
+    Get a cached pyproj Transformer, keyed by (src, dst, always_xy).
+
+    Parameters:
+        src (int, str or CRS): Source CRS, see get_crs.
+        dst (int, str or CRS): Destination CRS, see get_crs.
+        always_xy (bool): Whether the transformer uses the x, y (lon, lat) axis order.
+
+    Returns:
+        Transformer: The same object for every call with the same key, in the whole process.
+    """
+    key = (_crs_key(src), _crs_key(dst), bool(always_xy))
+    cached = _transformer_cache.get(key)
+    if cached is None:
+        src_crs, dst_crs = get_crs(src), get_crs(dst)
+        with _proj_cache_lock:
+            cached = _transformer_cache.get(key)
+            if cached is None:
+                cached = Transformer.from_crs(src_crs, dst_crs, always_xy=always_xy)
+                _transformer_cache[key] = cached
+    return cached
+
+
+def warm_up_transformers(crs_pairs, always_xy=True):
+    """
+    Create the transformers of the given CRS pairs ahead of time, e.g. at worker start, so that the
+    PROJ database lookups are not paid by the first tasks.
+
+    Parameters:
+        crs_pairs (list): List of (src, dst) CRS pairs, see get_transformer.
+        always_xy (bool): Whether the transformers use the x, y (lon, lat) axis order.
+    """
+    for src, dst in crs_pairs:
+        get_transformer(src, dst, always_xy=always_xy)
+
+
 ###############################################
 # For datamodel
 
@@ -527,10 +773,13 @@ class GeoObject:
         self.customAttributes = customAttributes
 
 class ImageData:
-    def __init__(self, url: str, width: int, height: int):
+    def __init__(self, url: str, width: int, height: int, tiles: str = None):
         self.url = url
         self.width = width
         self.height = height
+        # Optional URL of the tile manifest of the image (see PCloudProjection.project_incremental)
+        if tiles is not None:
+            self.tiles = tiles
 
 class Observation:
     def __init__(self, startDateTime: str, endDateTime: str, geoObjects: list[GeoObject], backgroundImageData: ImageData = {}):